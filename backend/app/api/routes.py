@@ -1,18 +1,39 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from typing import List, Dict, Any
 from app.models.database import (
-    DatabaseConnection, DatabaseSchema, ChatMessage, QueryResult, OllamaModel, LearnDatabaseRequest
+    DatabaseConnection, DatabaseSchema, ChatMessage, QueryResult, OllamaModel, LearnDatabaseRequest,
+    NextPageRequest, DatabaseType
 )
 from app.services.schema_analyzer import SchemaAnalyzer
-from app.services.database_service import DatabaseService
+from app.services.database_service import DatabaseService, RESULT_PAGE_SIZE
 from app.services.ollama_service import OllamaService
 from app.services.data_profiler import DataProfiler
+from app.services.query_analyzer import QueryAnalyzer
 from app.services.context_cache import context_cache
+from app.services.schema_embeddings import schema_embeddings
+from app.services.prompt_assembler import PromptAssembler, token_budget_for_model
+from app.services.model_sessions import model_sessions
+from app.services.ollama_pool import QueueFullError
+from app.services.result_cursor import result_cursors, InvalidCursorError
+from app.services.request_deadline import (
+    DeadlineExceeded, RequestDeadline, chat_deadline, cancel_on_disconnect, abandoned_requests
+)
+from app.services.metrics import metrics
+from app.services.generation_stats import generation_stats
+from app.services.statement_stats import statement_stats
+from app.services.structured_logging import get_logger
+import asyncio
 import os
-import httpx
+import time
+
+logger = get_logger("chat")
 
 router = APIRouter()
 ollama_service = OllamaService(os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"))
+# Los embeddings del esquema comparten hosts y cola de admisión con las generaciones
+schema_embeddings.pool = ollama_service.pool
 
 @router.get("/models", response_model=List[OllamaModel])
 async def get_ollama_models():
@@ -20,6 +41,41 @@ async def get_ollama_models():
     models = await ollama_service.get_available_models()
     return models
 
+@router.post("/models/preload")
+async def preload_model(request: dict):
+    """Precargar el modelo seleccionado para que la primera consulta no pague la carga"""
+    model_name = request.get("model_name")
+    if not model_name:
+        return {
+            "success": False,
+            "message": "Falta el nombre del modelo"
+        }
+    return await ollama_service.preload_model(model_name)
+
+@router.get("/models/status")
+async def get_models_status():
+    """Modelos cargados en Ollama y los gestionados por este backend"""
+    return await ollama_service.get_loaded_models()
+
+@router.get("/models/routing-stats")
+async def get_routing_stats():
+    """
+    Latencia por nivel (modelo rápido / elegido), tasa de escalado de la
+    cascada, cola de admisión (espera estimada) y cola y latencia de cada
+    host de Ollama
+    """
+    stats = ollama_service.router.get_stats()
+    stats["pool"] = ollama_service.pool.get_stats()
+    return stats
+
+@router.get("/models/generation-stats")
+async def get_generation_stats():
+    """
+    Rendimiento de Ollama por modelo y por BD: tokens/s de prefill y de
+    decodificación, cargas en frío y distribución del tamaño de los prompts
+    """
+    return generation_stats.get_stats()
+
 @router.post("/test-connection")
 async def test_database_connection(db_connection: DatabaseConnection):
     """Probar conexión a la base de datos"""
@@ -89,51 +145,159 @@ async def get_sample_data(db_connection: DatabaseConnection, table_name: str, li
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener datos de muestra: {str(e)}")
 
+async def get_database_context(db_connection: DatabaseConnection) -> Dict[str, Any]:
+    """
+    Obtener el contexto de una BD (esquema, perfil, analizador, índices y
+    ensamblador de prompts) desde el caché, o analizarla y perfilarla.
+    """
+    connection_dict = db_connection.dict()
+    
+    # 1. Intentar obtener contexto del caché
+    with metrics.stage("cache_lookup"):
+        cached_context = context_cache.get(connection_dict)
+    if cached_context:
+        schema = cached_context["schema"]
+        data_profile = cached_context["data_profile"]
+        logger.info(f"✅ [CHAT] Usando contexto en caché")
+        return {
+            "schema": schema,
+            "data_profile": data_profile,
+            "analyzer": cached_context.get("analyzer") or QueryAnalyzer(schema, data_profile),
+            "embedding_index": cached_context.get("embedding_index"),
+            "prompt_assembler": cached_context.get("prompt_assembler") or PromptAssembler(data_profile)
+        }
+    
+    # Analizar y perfilar la base de datos (primera vez o caché expirado)
+    logger.info(f"🔍 [CHAT] Analizando y perfilando base de datos...")
+    
+    # Analizar esquema
+    with metrics.stage("schema_analysis"):
+        schema = SchemaAnalyzer(db_connection).analyze_schema()
+    
+    # Perfilar datos (obtener valores únicos de columnas categóricas)
+    with metrics.stage("profiling"):
+        profiler = DataProfiler(db_connection)
+        data_profile = profiler.profile_database(schema.tables)
+    
+    context = {
+        "schema": schema,
+        "data_profile": data_profile,
+        # Construir analizador (e índices) una sola vez por esquema
+        "analyzer": QueryAnalyzer(schema, data_profile),
+        # Índice de embeddings (solo embebe tablas nuevas o modificadas)
+        "embedding_index": await schema_embeddings.sync(
+            context_cache.fingerprint(connection_dict), schema, data_profile
+        ),
+        # Fragmentos de prompt por tabla (se renderizan una vez por versión)
+        "prompt_assembler": PromptAssembler(data_profile)
+    }
+    
+    # Guardar en caché
+    context_cache.set(connection_dict, context)
+    logger.info(f"💾 [CHAT] Contexto analizado y guardado en caché")
+    return context
+
+async def execute_query_cancellable(db_service: DatabaseService,
+                                    sql_query: str,
+                                    statement: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Ejecutar la primera página de la consulta (con control de coste previo)
+    en un hilo; si se cancela, cancelarla también en la BD. En `statement`
+    se anota solo el tiempo de la consulta (el EXPLAIN previo va a la etapa
+    sql_preflight de las métricas).
+    """
+    try:
+        result = await asyncio.to_thread(db_service.execute_guarded, sql_query, RESULT_PAGE_SIZE)
+    except asyncio.CancelledError:
+        db_service.cancel_running_query()
+        # Cancelada a medias: solo cuenta lo que llevaba ejecutándose la consulta
+        started = db_service.execution_started
+        statement["elapsed_ms"] = (time.perf_counter() - started) * 1000 if started else 0.0
+        raise
+    statement["elapsed_ms"] = result["execution_ms"]
+    return result
+
 @router.post("/chat", response_model=QueryResult)
-async def process_chat_message(chat_request: ChatMessage):
-    """Procesar mensaje de chat y ejecutar consulta SQL con contexto mejorado y perfilado"""
+async def process_chat_message(chat_request: ChatMessage, request: Request):
+    """
+    Procesar mensaje de chat y ejecutar consulta SQL con contexto mejorado y
+    perfilado. Si el cliente se desconecta se cancelan la generación y la
+    consulta en curso.
+    """
+    deadline = chat_deadline()
+    # Datos de la ejecución del SQL que rellena el pipeline (para statement_stats)
+    trace: Dict[str, Any] = {}
+    pipeline = asyncio.create_task(run_chat_pipeline(chat_request, deadline, trace))
+    if await cancel_on_disconnect(pipeline, request.is_disconnected):
+        abandoned_requests.record("disconnect", deadline)
+        record_statement(trace)
+        return QueryResult(success=False, error="Cliente desconectado")
+    response = serialize_result(pipeline.result())
+    record_statement(trace, len(response.body))
+    return response
+
+def serialize_result(result: QueryResult) -> JSONResponse:
+    """Serializar la respuesta aquí (igual que FastAPI) para medirla como etapa"""
+    with metrics.stage("serialization"):
+        return JSONResponse(jsonable_encoder(result))
+
+def record_statement(trace: Dict[str, Any], bytes_serialized: int = 0) -> None:
+    """Registrar la ejecución del SQL (si se llegó a ejecutar) en las estadísticas de consultas"""
+    statement = trace.get("statement")
+    if statement is None:
+        return
+    # Sin elapsed_ms la ejecución se canceló (plazo o desconexión) a medias
+    elapsed_ms = statement.get("elapsed_ms", (time.perf_counter() - statement["started"]) * 1000)
+    statement_stats.record(
+        statement["sql"],
+        elapsed_ms,
+        rows=statement["rows"],
+        bytes_serialized=bytes_serialized,
+        success=statement["success"],
+        database=statement["database"],
+        question=statement.get("question"),
+        model=statement.get("model")
+    )
+
+async def run_chat_pipeline(chat_request: ChatMessage,
+                            deadline: RequestDeadline,
+                            trace: Dict[str, Any]) -> QueryResult:
+    """
+    Etapas de /chat (contexto, generación, ejecución), cada una con su plazo.
+    Los datos de la ejecución del SQL se dejan en `trace["statement"]`.
+    """
     try:
-        print(f"\n🚀 [CHAT] Nueva consulta: {chat_request.message}")
+        logger.info(f"🚀 [CHAT] Nueva consulta: {chat_request.message}")
         
         # Convertir conexión a dict para el caché
         connection_dict = chat_request.database_connection.dict()
         
-        # 1. Intentar obtener contexto del caché
-        cached_context = context_cache.get(connection_dict)
+        # 1. Contexto de la BD (caché o análisis + perfilado)
+        context = await deadline.run("context", get_database_context(chat_request.database_connection))
         
-        if cached_context:
-            # Usar contexto en caché
-            schema = cached_context["schema"]
-            data_profile = cached_context["data_profile"]
-            print(f"✅ [CHAT] Usando contexto en caché")
-        else:
-            # Analizar y perfilar la base de datos (primera vez o caché expirado)
-            print(f"🔍 [CHAT] Analizando y perfilando base de datos...")
-            
-            # Analizar esquema
-            analyzer = SchemaAnalyzer(chat_request.database_connection)
-            schema = analyzer.analyze_schema()
-            
-            # Perfilar datos (obtener valores únicos de columnas categóricas)
-            profiler = DataProfiler(chat_request.database_connection)
-            data_profile = profiler.profile_database(schema.tables)
-            
-            # Guardar en caché
-            context_cache.set(connection_dict, {
-                "schema": schema,
-                "data_profile": data_profile
-            })
-            
-            print(f"💾 [CHAT] Contexto analizado y guardado en caché")
+        # Sesión aprendida (/learn-database) para este modelo, si sigue vigente
+        learned_session = model_sessions.get(
+            context_cache.fingerprint(connection_dict), chat_request.model
+        )
+        
+        db_service = DatabaseService(chat_request.database_connection)
         
         # 2. Generar consulta SQL usando Ollama con contexto enriquecido
-        ollama_result = await ollama_service.generate_sql_query(
+        ollama_result = await deadline.run("generation", ollama_service.generate_sql_query(
             chat_request.message,
             chat_request.model,
-            schema,
+            context["schema"],
             sample_data=None,  
-            data_profile=data_profile
-        )
+            data_profile=context["data_profile"],
+            analyzer=context["analyzer"],
+            embedding_index=context["embedding_index"],
+            prompt_assembler=context["prompt_assembler"],
+            learned_session=learned_session,
+            # EXPLAIN en un hilo para no bloquear a los demás candidatos
+            dry_run=lambda sql: asyncio.to_thread(db_service.explain_query, sql),
+            # Mismo léxico que _is_safe_query al ejecutar
+            mysql=chat_request.database_connection.type == DatabaseType.MYSQL
+        ))
         
         if not ollama_result["success"]:
             return QueryResult(
@@ -154,8 +318,24 @@ async def process_chat_message(chat_request: ChatMessage):
             )
         
         # 3. Ejecutar consulta SQL
-        db_service = DatabaseService(chat_request.database_connection)
-        query_result = db_service.execute_query(sql_query)
+        statement = trace["statement"] = {
+            "sql": sql_query,
+            "started": time.perf_counter(),
+            "success": False,
+            "rows": 0,
+            "database": context["schema"].database_name,
+            "question": chat_request.message,
+            "model": ollama_result.get("model_used", chat_request.model)
+        }
+        query_result = await deadline.run("execution", execute_query_cancellable(db_service, sql_query, statement))
+        statement["success"] = query_result["success"]
+        statement["rows"] = len(query_result.get("data") or [])
+        
+        # Sin paginación, el control de coste puede haber añadido un LIMIT
+        guard = query_result.get("guard", {})
+        if guard.get("action") == "limit" and "page" not in query_result:
+            sql_query = guard["sql_query"]
+            explanation = f"{explanation}\n\nNota: {guard['reason']}." if explanation else f"Nota: {guard['reason']}."
         
         if not query_result["success"]:
             return QueryResult(
@@ -165,14 +345,82 @@ async def process_chat_message(chat_request: ChatMessage):
                 explanation=explanation
             )
         
-        # 4. Devolver resultado completo
+        # 4. Devolver resultado (primera página y token para las siguientes)
         return QueryResult(
             success=True,
             data=query_result["data"],
             sql_query=sql_query,
-            explanation=explanation
+            explanation=explanation,
+            next_cursor=next_page_cursor(query_result, sql_query, context_cache.fingerprint(connection_dict))
         )
     
+    except DeadlineExceeded as e:
+        abandoned_requests.record("deadline", deadline, str(e))
+        return QueryResult(
+            success=False,
+            error=f"{str(e)}: la consulta tardó demasiado y se canceló"
+        )
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        return QueryResult(
+            success=False,
+            error=f"Error interno del servidor: {str(e)}"
+        )
+
+def next_page_cursor(query_result: Dict[str, Any], sql_query: str, fingerprint: str):
+    """Token de continuación para la página siguiente (None si no hay más)"""
+    page = query_result.get("page")
+    if not page or not page["has_more"]:
+        return None
+    return result_cursors.encode({
+        "sql": sql_query,
+        "offset": page["next_offset"],
+        "page_size": page["page_size"],
+        "db": fingerprint
+    })
+
+@router.post("/chat/next-page", response_model=QueryResult)
+async def get_next_page(request: NextPageRequest):
+    """Página siguiente de un resultado de /chat, sin volver a llamar al modelo"""
+    try:
+        state = result_cursors.decode(request.cursor)
+        fingerprint = context_cache.fingerprint(request.database_connection.dict())
+        if state["db"] != fingerprint:
+            return QueryResult(success=False, error="El token no corresponde a esta base de datos")
+        
+        db_service = DatabaseService(request.database_connection)
+        statement = {
+            "sql": state["sql"],
+            "started": time.perf_counter(),
+            "database": request.database_connection.database
+        }
+        with metrics.stage("sql_execution"):
+            query_result = await asyncio.to_thread(
+                db_service.execute_page, state["sql"], state["page_size"], state["offset"]
+            )
+        statement["elapsed_ms"] = (time.perf_counter() - statement["started"]) * 1000
+        statement["success"] = query_result["success"]
+        statement["rows"] = len(query_result.get("data") or [])
+        if not query_result["success"]:
+            record_statement({"statement": statement})
+            return QueryResult(
+                success=False,
+                sql_query=state["sql"],
+                error=query_result.get("error", "Error al ejecutar consulta SQL")
+            )
+        
+        response = serialize_result(QueryResult(
+            success=True,
+            data=query_result["data"],
+            sql_query=state["sql"],
+            next_cursor=next_page_cursor(query_result, state["sql"], fingerprint)
+        ))
+        record_statement({"statement": statement}, len(response.body))
+        return response
+    
+    except InvalidCursorError as e:
+        return QueryResult(success=False, error=str(e))
     except Exception as e:
         return QueryResult(
             success=False,
@@ -189,137 +437,66 @@ async def execute_sql_query(db_connection: DatabaseConnection, sql_query: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al ejecutar consulta: {str(e)}")
 
-async def create_optimized_learning_prompt(schema, learning_data):
-    """Crear un prompt enfocado SOLO en estructura y esquema de la base de datos"""
-    
-    prompt = f"""Eres un experto generador de consultas SQL. Te proporciono la ESTRUCTURA COMPLETA de la base de datos '{schema.database_name}' para que puedas generar consultas SQL precisas.
-
-# 📊 BASE DE DATOS: {schema.database_name}
-
-## 🏗️ ESQUEMA Y ESTRUCTURA:
-"""
-    
-    # Solo estructura esencial - SIN registros masivos
-    for table in schema.tables:
-        prompt += f"\n### 📋 TABLA: {table.table_name}\n"
-        
-        # Columnas con información esencial
-        prompt += "**COLUMNAS:**\n"
-        for col in table.columns:
-            col_info = f"  • {col['name']} ({col['type']})"
-            if col['name'] in table.primary_keys:
-                col_info += " [PK]"
-            if not col['nullable']:
-                col_info += " [NOT NULL]"
-            if col.get('default'):
-                col_info += f" [DEFAULT: {col['default']}]"
-            prompt += col_info + "\n"
-        
-        # Relaciones entre tablas
-        if table.foreign_keys:
-            prompt += "\n**RELACIONES:**\n"
-            for fk in table.foreign_keys:
-                prompt += f"  • {fk['column']} → {fk['referenced_table']}.{fk['referenced_column']}\n"
-        
-        # Solo 2-3 ejemplos para entender formato (NO datos masivos)
-        if table.table_name in learning_data and learning_data[table.table_name]:
-            prompt += f"\n**FORMATO DE DATOS (ejemplo):**\n"
-            for i, record in enumerate(learning_data[table.table_name][:2]):  # Solo 2 ejemplos
-                example_values = []
-                for key, value in record.items():
-                    if isinstance(value, str):
-                        example_values.append(f"'{value}'")
-                    else:
-                        example_values.append(str(value))
-                prompt += f"  Ejemplo {i+1}: ({', '.join(example_values)})\n"
-        
-        prompt += "\n" + "-"*50 + "\n"
-    
-    # Instrucciones claras y concisas
-    prompt += f"""
-## ✅ RESUMEN:
-- Base de datos: {schema.database_name}
-- Tablas disponibles: {len(schema.tables)}
-- Tu función: Generar consultas SQL precisas usando esta estructura
-
-## 🎯 IMPORTANTE:
-Cuando recibas preguntas:
-1. Usa nombres EXACTOS de tablas y columnas mostradas arriba
-2. Respeta las relaciones entre tablas (FK)
-3. Genera SOLO consultas SELECT válidas
-4. Los datos reales vendrán de la ejecución de la consulta
-
-Responde únicamente: "ESTRUCTURA MEMORIZADA - Listo para generar consultas SQL para {schema.database_name} con {len(schema.tables)} tablas."
-"""
-    
-    return prompt
-
 @router.post("/learn-database")
 async def learn_database(request: LearnDatabaseRequest):
-    """Hacer que el modelo de IA aprenda la base de datos completamente"""
+    """
+    Hacer que el modelo aprenda la base de datos: se precarga el esquema como
+    prefijo (mensaje de sistema) en la caché KV de Ollama y se registra una
+    sesión por BD y modelo para que /chat reenvíe ese mismo prefijo y solo
+    la pregunta necesite prefill.
+    """
     try:
-        # 1. Analizar esquema completo
-        analyzer = SchemaAnalyzer(request.database_connection)
-        if not analyzer.test_connection():
+        # 1. Comprobar conexión
+        if not SchemaAnalyzer(request.database_connection).test_connection():
             return {
                 "success": False,
                 "message": "No se pudo conectar a la base de datos"
             }
         
-        schema = analyzer.analyze_schema()
-        
-        # 2. Obtener muestras de datos de todas las tablas
-        db_service = DatabaseService(request.database_connection)
-        learning_data = {}
+        # 2. Contexto completo (esquema + perfil), reutilizado por /chat
+        context = await get_database_context(request.database_connection)
+        schema = context["schema"]
         
-        for table in schema.tables:
-            try:
-                # Solo obtener 2-3 registros de ejemplo para entender estructura
-                result = db_service.get_sample_data(table.table_name, limit=3)  # Solo ejemplos mínimos
-                if result["success"] and result["data"]:
-                    learning_data[table.table_name] = result["data"]
-            except Exception as e:
-                learning_data[table.table_name] = []
-        
-        # 3. Crear prompt de aprendizaje optimizado
-        learning_prompt = await create_optimized_learning_prompt(schema, learning_data)
-        
-        # 4. Enviar al modelo para aprendizaje
-        async with httpx.AsyncClient(timeout=1000.0) as client:
-            response = await client.post(
-                f"{ollama_service.base_url}/api/generate",
-                json={
-                    "model": request.selected_model,
-                    "prompt": learning_prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.1,
-                        "top_p": 0.8,
-                        "num_predict": 1000,  # Respuesta corta esperada
-                        "repeat_penalty": 1.1
-                        # Sin stop tokens para permitir respuesta completa
-                    }
-                }
+        # 3. Prefijo del esquema que se mantendrá en el modelo
+        system_prompt, covered_tables = context["prompt_assembler"].learned_system_prompt(
+            schema.database_name,
+            schema.tables,
+            token_budget_for_model(
+                request.selected_model,
+                (await ollama_service.registry.get_info(request.selected_model)).get("context_length")
             )
+        )
         
-        if response.status_code == 200:
-            result = response.json()
-            learning_response = result.get("response", "")
-            
-            return {
-                "success": True,
-                "message": "El modelo ha aprendido la base de datos exitosamente",
-                "learning_summary": learning_response,
-                "tables_analyzed": len(schema.tables),
-                "total_samples": sum(len(data) for data in learning_data.values()),
-                "database_name": schema.database_name
-            }
-        else:
+        # 4. Precargarlo en Ollama
+        result = await ollama_service.learn_schema(request.selected_model, system_prompt)
+        if not result["success"]:
             return {
                 "success": False,
-                "message": f"Error en el proceso de aprendizaje: {response.status_code}"
+                "message": f"Error en el proceso de aprendizaje: {result['error']}"
             }
-            
+        
+        fingerprint = context_cache.fingerprint(request.database_connection.dict())
+        model_sessions.set(
+            fingerprint,
+            request.selected_model,
+            schema.database_name,
+            system_prompt,
+            covered_tables,
+            result["prefill"]
+        )
+        
+        return {
+            "success": True,
+            "message": "El modelo ha aprendido la base de datos exitosamente",
+            "learning_summary": result["response"],
+            "tables_analyzed": len(schema.tables),
+            "tables_in_context": len(covered_tables),
+            "prefix_tokens": result["prefill"]["prompt_eval_count"],
+            "database_name": schema.database_name
+        }
+    
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         return {
             "success": False,
@@ -332,26 +509,17 @@ async def refresh_context(db_connection: DatabaseConnection):
     try:
         connection_dict = db_connection.dict()
         
-        # Invalidar caché existente
+        # Invalidar caché existente (y las sesiones aprendidas con el esquema anterior)
         context_cache.invalidate(connection_dict)
+        model_sessions.invalidate(context_cache.fingerprint(connection_dict))
         
-        # Reanalizar y perfilar
-        analyzer = SchemaAnalyzer(db_connection)
-        schema = analyzer.analyze_schema()
-        
-        profiler = DataProfiler(db_connection)
-        data_profile = profiler.profile_database(schema.tables)
-        
-        # Guardar nuevo contexto en caché
-        context_cache.set(connection_dict, {
-            "schema": schema,
-            "data_profile": data_profile
-        })
+        # Reanalizar, perfilar y guardar nuevo contexto en caché
+        context = await get_database_context(db_connection)
         
         return {
             "success": True,
             "message": f"Contexto refrescado para {db_connection.database}",
-            "tables_analyzed": len(schema.tables)
+            "tables_analyzed": len(context["schema"].tables)
         }
     except Exception as e:
         return {
@@ -359,10 +527,32 @@ async def refresh_context(db_connection: DatabaseConnection):
             "message": f"Error al refrescar contexto: {str(e)}"
         }
 
+@router.get("/chat-stats")
+async def get_chat_stats():
+    """
+    Peticiones de /chat abandonadas (desconexión o plazo), trabajo
+    desperdiciado y duración media por etapa (el detalle está en /metrics)
+    """
+    return {
+        "abandoned_requests": abandoned_requests.get_stats(),
+        "stages": metrics.stage_seconds.summary()
+    }
+
+@router.get("/query-stats")
+async def get_query_stats(limit: int = 20, order_by: str = "total_ms"):
+    """
+    Consultas generadas más costosas, agrupadas por huella de SQL (llamadas,
+    tiempo total y p95, filas y bytes; `order_by` = total_ms, calls, p95_ms,
+    rows o bytes) y registro de consultas lentas con su pregunta y modelo
+    """
+    return statement_stats.get_stats(limit, order_by)
+
 @router.get("/cache-stats")
 async def get_cache_stats():
-    """Obtener estadísticas del caché de contextos"""
-    return context_cache.get_stats()
+    """Obtener estadísticas del caché de contextos y de las sesiones aprendidas"""
+    stats = context_cache.get_stats()
+    stats["model_sessions"] = model_sessions.get_stats()
+    return stats
 
 @router.post("/disconnect")
 async def disconnect(request: dict):
@@ -377,26 +567,19 @@ async def disconnect(request: dict):
                 "message": "Faltan parámetros requeridos"
             }
         
-        # 1. Limpiar caché
+        # 1. Limpiar caché y sesión aprendida
         context_cache.invalidate(db_connection_dict)
-        print(f"🗑️ [DISCONNECT] Caché limpiado para {db_connection_dict.get('database')}")
+        model_sessions.invalidate(context_cache.fingerprint(db_connection_dict), model_name)
+        logger.info(f"🗑️ [DISCONNECT] Caché limpiado para {db_connection_dict.get('database')}")
         
-        # 2. Detener modelo en Ollama
-        try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                # Comando para detener el modelo en Ollama
-                # Nota: Ollama no tiene un endpoint directo para "stop", pero podemos
-                # intentar descargar el modelo de memoria (esto es opcional)
-                print(f"⏸️ [DISCONNECT] Intentando detener modelo: {model_name}")
-                # En Ollama, los modelos se descargan automáticamente después de un tiempo
-                # No hay un endpoint oficial para "stop", pero lo registramos
-        except Exception as e:
-            print(f"⚠️ [DISCONNECT] Advertencia al detener modelo: {str(e)}")
+        # 2. Descargar el modelo de Ollama (keep_alive=0) para liberar memoria
+        logger.info(f"⏸️ [DISCONNECT] Descargando modelo: {model_name}")
+        model_stopped = await ollama_service.unload_model(model_name)
         
         return {
             "success": True,
             "message": f"Desconexión exitosa. Caché limpiado para {db_connection_dict.get('database')}",
-            "model_stopped": model_name
+            "model_stopped": model_name if model_stopped else None
         }
     except Exception as e:
         return {
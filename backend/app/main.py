@@ -1,18 +1,28 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 import os
 from dotenv import load_dotenv
-from app.api.routes import router
+from app.api.routes import router, ollama_service
+from app.services.metrics import metrics, ServerTimingMiddleware
 
 # Cargar variables de entorno
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Chequeo de salud periódico de los hosts de Ollama mientras la app está en marcha"""
+    ollama_service.pool.start_health_checks()
+    yield
+    await ollama_service.pool.stop_health_checks()
+
 # Crear aplicación FastAPI
 app = FastAPI(
     title="AI Database Chatbot API",
     description="API para chatbot con IA que puede consultar bases de datos usando Ollama",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configurar CORS
@@ -27,8 +37,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# Duración por etapa en la cabecera Server-Timing y en /metrics
+app.add_middleware(ServerTimingMiddleware, registry=metrics)
+
 # Incluir rutas
 app.include_router(router, prefix="/api/v1")
 
@@ -44,10 +58,16 @@ async def root():
             "models": "/api/v1/models",
             "test_connection": "/api/v1/test-connection",
             "analyze_schema": "/api/v1/analyze-schema",
-            "chat": "/api/v1/chat"
+            "chat": "/api/v1/chat",
+            "metrics": "/metrics"
         }
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Histogramas de latencia por etapa y por ruta (formato de texto de Prometheus)"""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
     """Manejador global de excepciones"""
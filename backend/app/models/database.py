@@ -35,12 +35,21 @@ class QueryResult(BaseModel):
     sql_query: Optional[str] = None
     error: Optional[str] = None
     explanation: Optional[str] = None
+    # Token para pedir la página siguiente (None si no hay más filas)
+    next_cursor: Optional[str] = None
 
 class OllamaModel(BaseModel):
     name: str
     size: str
     modified_at: str
+    parameter_size: Optional[str] = None
+    quantization_level: Optional[str] = None
+    context_length: Optional[int] = None
 
 class LearnDatabaseRequest(BaseModel):
     database_connection: DatabaseConnection
     selected_model: str
+
+class NextPageRequest(BaseModel):
+    database_connection: DatabaseConnection
+    cursor: str
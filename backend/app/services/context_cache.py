@@ -6,6 +6,9 @@ from typing import Dict, Any, Optional
 from datetime import datetime, timedelta
 import hashlib
 import json
+from app.services.structured_logging import get_logger
+
+logger = get_logger("cache")
 
 
 class ContextCache:
@@ -34,6 +37,13 @@ class ContextCache:
         # Generar hash MD5
         return hashlib.md5(connection_str.encode()).hexdigest()
     
+    def fingerprint(self, connection_data: Dict[str, Any]) -> str:
+        """
+        Huella estable de una base de datos (misma clave que usa el caché).
+        Sirve para asociar otros recursos (índices, estadísticas) a una BD.
+        """
+        return self._generate_key(connection_data)
+    
     def get(self, connection_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """
         Obtener contexto del caché si existe y no ha expirado.
@@ -46,14 +56,14 @@ class ContextCache:
             
             # Verificar si el caché ha expirado
             if cached_time and datetime.now() - cached_time < self._ttl:
-                print(f"✅ [CACHE] Usando contexto en caché para {connection_data.get('database')}")
+                logger.info(f"✅ [CACHE] Usando contexto en caché para {connection_data.get('database')}")
                 return cached_data.get("context")
             else:
                 # Caché expirado, eliminarlo
-                print(f"⏰ [CACHE] Caché expirado para {connection_data.get('database')}")
+                logger.info(f"⏰ [CACHE] Caché expirado para {connection_data.get('database')}")
                 del self._cache[key]
         
-        print(f"❌ [CACHE] No hay caché disponible para {connection_data.get('database')}")
+        logger.info(f"❌ [CACHE] No hay caché disponible para {connection_data.get('database')}")
         return None
     
     def set(self, connection_data: Dict[str, Any], context: Dict[str, Any]) -> None:
@@ -68,7 +78,7 @@ class ContextCache:
             "database": connection_data.get('database')
         }
         
-        print(f"💾 [CACHE] Contexto almacenado en caché para {connection_data.get('database')}")
+        logger.info(f"💾 [CACHE] Contexto almacenado en caché para {connection_data.get('database')}")
     
     def invalidate(self, connection_data: Dict[str, Any]) -> None:
         """
@@ -78,14 +88,14 @@ class ContextCache:
         
         if key in self._cache:
             del self._cache[key]
-            print(f"🗑️ [CACHE] Caché invalidado para {connection_data.get('database')}")
+            logger.info(f"🗑️ [CACHE] Caché invalidado para {connection_data.get('database')}")
     
     def clear_all(self) -> None:
         """
         Limpiar todo el caché.
         """
         self._cache.clear()
-        print(f"🧹 [CACHE] Todo el caché ha sido limpiado")
+        logger.info(f"🧹 [CACHE] Todo el caché ha sido limpiado")
     
     def get_stats(self) -> Dict[str, Any]:
         """
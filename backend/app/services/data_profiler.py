@@ -6,6 +6,9 @@ from typing import Dict, List, Any
 import psycopg2
 import pymysql
 from app.models.database import DatabaseConnection, DatabaseType
+from app.services.structured_logging import get_logger
+
+logger = get_logger("profiler")
 
 
 class DataProfiler:
@@ -104,7 +107,7 @@ class DataProfiler:
             return profile
             
         except Exception as e:
-            print(f"❌ Error perfilando columna {table_name}.{column_name}: {str(e)}")
+            logger.error(f"❌ Error perfilando columna {table_name}.{column_name}: {str(e)}")
             return {
                 "unique_values": None,
                 "sample_values": [],
@@ -158,7 +161,7 @@ class DataProfiler:
             return table_profile
             
         except Exception as e:
-            print(f"❌ Error perfilando tabla {table_name}: {str(e)}")
+            logger.error(f"❌ Error perfilando tabla {table_name}: {str(e)}")
             return table_profile
     
     def profile_database(self, tables: List[Any]) -> Dict[str, Any]:
@@ -170,13 +173,13 @@ class DataProfiler:
             "tables": {}
         }
         
-        print(f"🔍 [PROFILER] Iniciando perfilado de base de datos...")
+        logger.info(f"🔍 [PROFILER] Iniciando perfilado de base de datos...")
         
         for table in tables:
-            print(f"📊 [PROFILER] Perfilando tabla: {table.table_name}")
+            logger.debug(f"📊 [PROFILER] Perfilando tabla: {table.table_name}")
             table_profile = self.profile_table(table.table_name, table.columns)
             db_profile["tables"][table.table_name] = table_profile
         
-        print(f"✅ [PROFILER] Perfilado completado para {len(tables)} tablas")
+        logger.info(f"✅ [PROFILER] Perfilado completado para {len(tables)} tablas")
         
         return db_profile
\ No newline at end of file
@@ -1,12 +1,38 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional
+import json
+import os
+import time
 import psycopg2
 import pymysql
-import re
 from app.models.database import DatabaseConnection, DatabaseType
+from app.services.metrics import metrics
+from app.services.sql_lexer import analyze_sql, split_row_limit
+from app.services.structured_logging import get_logger
+
+logger = get_logger("db")
+
+# Control de coste previo (EXPLAIN): por encima de QUERY_MAX_COST se rechaza
+# la consulta y, si estima más de QUERY_MAX_ROWS filas, se le añade un LIMIT
+QUERY_MAX_COST = float(os.getenv("QUERY_MAX_COST", "1000000"))
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "1000"))
+# Límite de tiempo en el servidor por consulta (0 = sin límite)
+QUERY_STATEMENT_TIMEOUT_MS = int(os.getenv("QUERY_STATEMENT_TIMEOUT_MS", "30000"))
+# Filas por página de resultados en /chat (0 = sin paginar)
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "50"))
+
+class QueryCancelledError(Exception):
+    """La petición se canceló antes de que la consulta terminara"""
+
 
 class DatabaseService:
     def __init__(self, db_connection: DatabaseConnection):
         self.db_connection = db_connection
+        # Conexión de la consulta en curso (para poder cancelarla desde otro hilo)
+        self._active_conn = None
+        # Petición cancelada: no se abren más conexiones para ella
+        self._cancelled = False
+        # Inicio de la ejecución tras el control de coste (para medirla si se cancela)
+        self.execution_started: Optional[float] = None
     
     def get_connection(self):
         """Crear conexión a la base de datos"""
@@ -38,21 +64,26 @@ class DatabaseService:
                     "data": None
                 }
             
-            conn = self.get_connection()
+            conn = self._open_active_connection()
             
-            if self.db_connection.type == DatabaseType.POSTGRESQL:
-                cursor = conn.cursor()
-                cursor.execute(sql_query)
-                results = cursor.fetchall()
-                columns = [desc[0] for desc in cursor.description] if cursor.description else []
-            else:  # MySQL
-                cursor = conn.cursor(pymysql.cursors.DictCursor)
-                cursor.execute(sql_query)
-                results = cursor.fetchall()
-                columns = list(results[0].keys()) if results else []
-            
-            cursor.close()
-            conn.close()
+            try:
+                if self.db_connection.type == DatabaseType.POSTGRESQL:
+                    cursor = conn.cursor()
+                    self._apply_statement_timeout(cursor)
+                    cursor.execute(sql_query)
+                    results = cursor.fetchall()
+                    columns = [desc[0] for desc in cursor.description] if cursor.description else []
+                else:  # MySQL
+                    cursor = conn.cursor(pymysql.cursors.DictCursor)
+                    self._apply_statement_timeout(cursor)
+                    cursor.execute(sql_query)
+                    results = cursor.fetchall()
+                    columns = list(results[0].keys()) if results else []
+                
+                cursor.close()
+            finally:
+                self._active_conn = None
+                conn.close()
             
             # Convertir resultados a formato JSON serializable
             formatted_results = []
@@ -96,41 +127,280 @@ class DatabaseService:
                 "data": None
             }
     
-    def _is_safe_query(self, sql_query: str) -> bool:
-        """Validar que la consulta SQL sea segura (solo SELECT)"""
-        # Limpiar la consulta
-        cleaned_query = sql_query.strip().upper()
+    def _open_active_connection(self):
+        """
+        Abrir la conexión de la consulta (o del EXPLAIN previo) y registrarla
+        para que cancel_running_query pueda cortarla. Si la petición ya se
+        canceló no se llega a abrir.
+        """
+        if self._cancelled:
+            raise QueryCancelledError("Consulta cancelada")
+        conn = self.get_connection()
+        self._active_conn = conn
+        # La cancelación pudo llegar entre la comprobación y el registro
+        if self._cancelled:
+            self._active_conn = None
+            conn.close()
+            raise QueryCancelledError("Consulta cancelada")
+        return conn
+    
+    def _apply_statement_timeout(self, cursor) -> None:
+        """Límite de tiempo en el servidor para la consulta de esta conexión"""
+        if not QUERY_STATEMENT_TIMEOUT_MS:
+            return
+        if self.db_connection.type == DatabaseType.POSTGRESQL:
+            cursor.execute(f"SET statement_timeout = {QUERY_STATEMENT_TIMEOUT_MS}")
+        else:
+            try:
+                cursor.execute(f"SET SESSION max_execution_time = {QUERY_STATEMENT_TIMEOUT_MS}")
+            except pymysql.MySQLError:
+                # MariaDB y MySQL < 5.7.8 no tienen max_execution_time
+                pass
+    
+    def execute_guarded(self, sql_query: str, page_size: int = 0) -> Dict[str, Any]:
+        """
+        Ejecutar una consulta generada pasando antes por el control de coste.
+        Con `page_size` solo se trae la primera página (ver execute_page) en
+        lugar de depender del LIMIT que añade el control.
+        El resultado incluye la decisión del control en "guard" y los tiempos
+        por separado: "preflight_ms" (EXPLAIN) y "execution_ms" (la consulta;
+        0 si no llegó a ejecutarse).
+        """
+        start = time.perf_counter()
+        with metrics.stage("sql_preflight"):
+            check = self.preflight_query(sql_query)
+        timings = {"preflight_ms": (time.perf_counter() - start) * 1000, "execution_ms": 0.0}
+        # Cancelada durante el EXPLAIN: no se ejecuta la consulta
+        if self._cancelled:
+            return {"success": False, "error": "Consulta cancelada", "data": None, "guard": check, **timings}
+        if check["action"] == "refuse":
+            return {"success": False, "error": check["reason"], "data": None, "guard": check, **timings}
         
-        # Verificar que empiece con SELECT
-        if not cleaned_query.startswith('SELECT'):
-            return False
+        self.execution_started = time.perf_counter()
+        with metrics.stage("sql_execution"):
+            if page_size:
+                result = self.execute_page(sql_query, page_size)
+            else:
+                result = self.execute_query(check["sql_query"])
+        timings["execution_ms"] = (time.perf_counter() - self.execution_started) * 1000
+        result["guard"] = check
+        result.update(timings)
+        return result
+    
+    def execute_page(self, sql_query: str, page_size: int, offset: int = 0) -> Dict[str, Any]:
+        """
+        Ejecutar una página de la consulta: se piden page_size + 1 filas y la
+        sobrante solo indica si hay más. El resultado añade "page" con el
+        estado para pedir la siguiente.
+        """
+        result = self.execute_query(
+            self.paginate(sql_query, page_size, offset, mysql=self.db_connection.type == DatabaseType.MYSQL)
+        )
+        if not result["success"]:
+            return result
+        
+        has_more = len(result["data"]) > page_size
+        result["data"] = result["data"][:page_size]
+        result["row_count"] = len(result["data"])
+        result["page"] = {
+            "offset": offset,
+            "page_size": page_size,
+            "has_more": has_more,
+            "next_offset": offset + page_size if has_more else None
+        }
+        return result
+    
+    @staticmethod
+    def paginate(sql_query: str, page_size: int, offset: int = 0, mysql: bool = False) -> str:
+        """
+        Reescribir la consulta para traer page_size + 1 filas desde `offset`.
+        La cláusula de límite exterior (LIMIT, OFFSET, FETCH FIRST, con
+        comentarios finales) se sustituye por una nueva que respeta el límite
+        y el desplazamiento originales; el ORDER BY se conserva. Solo una
+        cláusula que no se sabe reescribir (LIMIT ?) se envuelve en una subconsulta.
+        """
+        parts = split_row_limit(sql_query, mysql)
+        if parts is None:
+            sql = sql_query.strip().rstrip(';').strip()
+            return f"SELECT * FROM (\n{sql}\n) AS paged_query\nLIMIT {int(page_size) + 1} OFFSET {int(offset)}"
+        
+        count = int(page_size) + 1
+        if parts["limit"] is not None:
+            # No pasar del límite original: sin fila sobrante no hay más páginas
+            count = max(0, min(count, parts["limit"] - int(offset)))
+        return f"{parts['body']}\nLIMIT {count} OFFSET {parts['offset'] + int(offset)}"
+    
+    def preflight_query(self, sql_query: str) -> Dict[str, Any]:
+        """
+        Control de coste antes de ejecutar: EXPLAIN estima el coste y las filas
+        y, según los umbrales, la consulta se ejecuta tal cual ("execute"), con
+        un LIMIT añadido ("limit") o se rechaza con una explicación ("refuse").
+        """
+        # El SQL generado no llega al servidor (ni siquiera en un EXPLAIN)
+        # sin pasar antes el control de seguridad
+        if not self._is_safe_query(sql_query):
+            return {
+                "action": "refuse",
+                "sql_query": sql_query,
+                "reason": "Solo se permiten consultas SELECT. Operaciones de modificación están bloqueadas por seguridad."
+            }
+        
+        sql = sql_query.strip().rstrip(';').strip()
+        try:
+            estimate = self.estimate_query_cost(sql)
+            limited_sql = limited = None
+            parts = split_row_limit(sql, self.db_connection.type == DatabaseType.MYSQL)
+            if estimate["rows"] > QUERY_MAX_ROWS and parts is not None and parts["limit"] is None:
+                limited_sql = self.with_limit(parts, QUERY_MAX_ROWS)
+                limited = self.estimate_query_cost(limited_sql)
+        except Exception as e:
+            # Si EXPLAIN falla, la ejecución dará el error real
+            return {"action": "execute", "sql_query": sql_query, "reason": f"Sin estimación: {str(e)}"}
         
-        # Palabras prohibidas que podrían modificar datos
-        forbidden_words = [
-            'INSERT', 'UPDATE', 'DELETE', 'DROP', 'CREATE', 'ALTER',
-            'TRUNCATE', 'EXEC', 'EXECUTE', 'CALL', 'GRANT', 'REVOKE',
-            'MERGE', 'REPLACE', 'LOAD', 'COPY', 'BULK'
-        ]
+        check = {"action": "execute", "sql_query": sql, "cost": estimate["cost"], "rows": estimate["rows"], "reason": None}
         
-        # Usar regex para buscar palabras completas, no subcadenas
-        # Esto evita que "created_at", "updated_at" activen el filtro
-        for word in forbidden_words:
-            pattern = r'\b' + word + r'\b'
-            if re.search(pattern, cleaned_query):
-                return False
+        if limited is not None:
+            if limited["cost"] <= QUERY_MAX_COST:
+                check.update({
+                    "action": "limit",
+                    "sql_query": limited_sql,
+                    "cost": limited["cost"],
+                    "reason": f"Se estiman ~{estimate['rows']} filas: se devuelven las primeras {QUERY_MAX_ROWS}"
+                })
+                logger.info(f"✂️ [DB] LIMIT {QUERY_MAX_ROWS} añadido (~{estimate['rows']} filas estimadas)")
+                return check
+            check["cost"] = limited["cost"]
         
-        # Verificar que no contenga subconsultas peligrosas
-        dangerous_patterns = [
-            r'INTO\s+',  # SELECT INTO
-            r'OUTFILE\s+',  # SELECT INTO OUTFILE
-            r'DUMPFILE\s+',  # SELECT INTO DUMPFILE
-        ]
+        if check["cost"] > QUERY_MAX_COST:
+            check.update({
+                "action": "refuse",
+                "reason": (
+                    f"Consulta rechazada por su coste estimado ({check['cost']:.0f} > {QUERY_MAX_COST:.0f}, "
+                    f"~{estimate['rows']} filas). Puede faltar una condición de JOIN o un filtro; "
+                    f"prueba con una pregunta más concreta."
+                )
+            })
+            logger.warning(f"🚫 [DB] Consulta rechazada: coste {check['cost']:.0f}, ~{estimate['rows']} filas")
+        return check
+    
+    @staticmethod
+    def with_limit(parts: Dict[str, Any], limit: int) -> str:
+        """Consulta sin límite (partes de split_row_limit) con un LIMIT añadido, conservando su OFFSET"""
+        offset = f" OFFSET {parts['offset']}" if parts["offset"] else ""
+        return f"{parts['body']}\nLIMIT {int(limit)}{offset}"
+    
+    def estimate_query_cost(self, sql_query: str) -> Dict[str, Any]:
+        """Coste y filas estimados por el planificador (EXPLAIN en JSON)"""
+        conn = self._open_active_connection()
+        try:
+            cursor = conn.cursor()
+            self._apply_statement_timeout(cursor)
+            if self.db_connection.type == DatabaseType.POSTGRESQL:
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql_query}")
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                top = plan[0]["Plan"]
+                return {"cost": float(top["Total Cost"]), "rows": int(top["Plan Rows"])}
+            
+            cursor.execute(f"EXPLAIN FORMAT=JSON {sql_query}")
+            plan = json.loads(cursor.fetchone()[0])
+            return {
+                "cost": float(plan["query_block"].get("cost_info", {}).get("query_cost", 0)),
+                # Filas de la última etapa del join (la mayor en un producto cartesiano)
+                "rows": int(max(self._mysql_join_rows(plan), default=0))
+            }
+        finally:
+            self._active_conn = None
+            conn.close()
+    
+    @classmethod
+    def _mysql_join_rows(cls, node: Any) -> Iterator[float]:
+        """Filas estimadas por tabla (rows_produced_per_join) en un plan de MySQL"""
+        if isinstance(node, dict):
+            table = node.get("table")
+            if isinstance(table, dict) and "rows_produced_per_join" in table:
+                yield float(table["rows_produced_per_join"])
+            for value in node.values():
+                yield from cls._mysql_join_rows(value)
+        elif isinstance(node, list):
+            for value in node:
+                yield from cls._mysql_join_rows(value)
+    
+    def cancel_running_query(self) -> bool:
+        """
+        Cancelar la consulta en curso (llamado desde otro hilo): en PostgreSQL
+        con la petición de cancelación del protocolo (lo mismo que
+        pg_cancel_backend) y en MySQL con KILL QUERY desde otra conexión.
+        La petición queda marcada como cancelada, así que si aún no había
+        conexión abierta (p.ej. antes del EXPLAIN) la consulta ya no se ejecuta.
+        """
+        self._cancelled = True
+        conn = self._active_conn
+        if conn is None:
+            logger.info(f"🛑 [DB] Consulta cancelada antes de ejecutarse en {self.db_connection.database}")
+            return True
+        
+        try:
+            if self.db_connection.type == DatabaseType.POSTGRESQL:
+                conn.cancel()
+            else:
+                killer = self.get_connection()
+                try:
+                    cursor = killer.cursor()
+                    cursor.execute(f"KILL QUERY {int(conn.thread_id())}")
+                    cursor.close()
+                finally:
+                    killer.close()
+            logger.info(f"🛑 [DB] Consulta cancelada en {self.db_connection.database}")
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ [DB] No se pudo cancelar la consulta: {str(e)}")
+            return False
+    
+    def explain_query(self, sql_query: str) -> Dict[str, Any]:
+        """
+        Comprobar la consulta con EXPLAIN (sin ejecutarla): detecta errores de
+        sintaxis y tablas o columnas inexistentes antes de devolverla.
+        Como la ejecución, registra la conexión (cancelable) y aplica el
+        límite de tiempo en el servidor.
+        """
+        if not self._is_safe_query(sql_query):
+            return {"valid": False, "error": "Solo se permiten consultas SELECT"}
         
-        for pattern in dangerous_patterns:
-            if re.search(pattern, cleaned_query):
-                return False
+        try:
+            conn = self._open_active_connection()
+            try:
+                cursor = conn.cursor()
+                self._apply_statement_timeout(cursor)
+                cursor.execute(f"EXPLAIN {sql_query.strip().rstrip(';')}")
+                cursor.fetchall()
+                cursor.close()
+            finally:
+                # Los dry-runs de varios candidatos corren a la vez: no borrar
+                # la conexión registrada por otro
+                if self._active_conn is conn:
+                    self._active_conn = None
+                conn.close()
+            return {"valid": True, "error": None}
+        
+        except QueryCancelledError:
+            return {"valid": False, "error": "Consulta cancelada"}
+        except Exception as e:
+            return {"valid": False, "error": f"EXPLAIN falló: {str(e)}"}
+    
+    def _is_safe_query(self, sql_query: str) -> bool:
+        """Validar que la consulta SQL sea segura (una sola sentencia SELECT)"""
+        # Análisis léxico con las reglas del motor: las palabras dentro de
+        # literales o comentarios no cuentan, pero sí las de /*! ... */ en MySQL
+        analysis = analyze_sql(sql_query, mysql=self.db_connection.type == DatabaseType.MYSQL)
+        
+        # Solo SELECT (también WITH ... SELECT) y una única sentencia
+        if analysis["main_statement"] != "SELECT" or analysis["statement_count"] != 1:
+            return False
         
-        return True
+        # Palabras prohibidas (incluye SELECT INTO / INTO OUTFILE / DUMPFILE)
+        return not analysis["forbidden"]
     
     def test_connection(self) -> bool:
         """Probar conexión a la base de datos"""
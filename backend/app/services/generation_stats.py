@@ -0,0 +1,123 @@
+"""
+Estadísticas de rendimiento de Ollama por modelo y por base de datos.
+Cada respuesta de /api/chat trae `prompt_eval_count`/`prompt_eval_duration`
+(prefill), `eval_count`/`eval_duration` (decodificación) y `load_duration`
+(carga del modelo). Acumulándolas se ve de dónde viene la latencia: prefill
+lento (prompt demasiado grande), decodificación lenta (modelo demasiado
+grande) o cargas en frío. Los tamaños de prompt son los tokens evaluados:
+si Ollama reutiliza el prefijo de su caché KV, son menos que el prompt.
+"""
+from typing import Dict, Any, Tuple
+from collections import deque
+import math
+import statistics
+
+# Límites (tokens) de la distribución de tamaños de prompt
+PROMPT_SIZE_BUCKETS = (512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+class GenerationStats:
+    """Acumulados de tokens y duraciones de las generaciones por (modelo, BD)"""
+
+    # Una carga de más de esto cuenta como carga en frío (el modelo no estaba en memoria)
+    COLD_LOAD_MS = 500
+    # Tamaños de prompt guardados por (modelo, BD) para los percentiles
+    PROMPT_WINDOW = 500
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def record(self, model: str, database: str, result: Dict[str, Any]) -> None:
+        """Registrar los contadores de una respuesta de Ollama"""
+        entry = self._entries.get((model, database))
+        if entry is None:
+            entry = {
+                "requests": 0,
+                "prompt_tokens": 0,
+                "prompt_eval_ms": 0.0,
+                "eval_tokens": 0,
+                "eval_ms": 0.0,
+                "load_ms": 0.0,
+                "cold_loads": 0,
+                "prompt_sizes": deque(maxlen=self.PROMPT_WINDOW),
+                "prompt_histogram": [0] * (len(PROMPT_SIZE_BUCKETS) + 1)
+            }
+            self._entries[(model, database)] = entry
+
+        prompt_tokens = result.get("prompt_eval_count", 0)
+        load_ms = result.get("load_duration", 0) / 1e6
+        entry["requests"] += 1
+        entry["prompt_tokens"] += prompt_tokens
+        entry["prompt_eval_ms"] += result.get("prompt_eval_duration", 0) / 1e6
+        entry["eval_tokens"] += result.get("eval_count", 0)
+        entry["eval_ms"] += result.get("eval_duration", 0) / 1e6
+        entry["load_ms"] += load_ms
+        if load_ms > self.COLD_LOAD_MS:
+            entry["cold_loads"] += 1
+        entry["prompt_sizes"].append(prompt_tokens)
+        bucket = next((i for i, bound in enumerate(PROMPT_SIZE_BUCKETS) if prompt_tokens <= bound),
+                      len(PROMPT_SIZE_BUCKETS))
+        entry["prompt_histogram"][bucket] += 1
+
+    @staticmethod
+    def _merge(entries) -> Dict[str, Any]:
+        merged = {
+            "requests": 0, "prompt_tokens": 0, "prompt_eval_ms": 0.0, "eval_tokens": 0,
+            "eval_ms": 0.0, "load_ms": 0.0, "cold_loads": 0, "prompt_sizes": [],
+            "prompt_histogram": [0] * (len(PROMPT_SIZE_BUCKETS) + 1)
+        }
+        for entry in entries:
+            for key in ("requests", "prompt_tokens", "prompt_eval_ms", "eval_tokens", "eval_ms", "load_ms", "cold_loads"):
+                merged[key] += entry[key]
+            merged["prompt_sizes"].extend(entry["prompt_sizes"])
+            merged["prompt_histogram"] = [a + b for a, b in zip(merged["prompt_histogram"], entry["prompt_histogram"])]
+        return merged
+
+    @staticmethod
+    def _summary(entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Tokens/s de prefill y decodificación, cargas y distribución de prompts"""
+        sizes = sorted(entry["prompt_sizes"])
+        labels = [f"<={bound}" for bound in PROMPT_SIZE_BUCKETS] + [f">{PROMPT_SIZE_BUCKETS[-1]}"]
+        times = {"prefill": entry["prompt_eval_ms"], "decode": entry["eval_ms"], "load": entry["load_ms"]}
+        requests = entry["requests"]
+        return {
+            "requests": requests,
+            "prefill_tokens_per_s": (
+                round(entry["prompt_tokens"] / (entry["prompt_eval_ms"] / 1000), 1) if entry["prompt_eval_ms"] else None
+            ),
+            "decode_tokens_per_s": (
+                round(entry["eval_tokens"] / (entry["eval_ms"] / 1000), 1) if entry["eval_ms"] else None
+            ),
+            "avg_prefill_ms": round(entry["prompt_eval_ms"] / requests, 1) if requests else None,
+            "avg_decode_ms": round(entry["eval_ms"] / requests, 1) if requests else None,
+            "avg_load_ms": round(entry["load_ms"] / requests, 1) if requests else None,
+            "cold_loads": entry["cold_loads"],
+            "prompt_tokens": {
+                "avg": round(statistics.mean(sizes), 1) if sizes else None,
+                "p50": sizes[math.ceil(0.5 * len(sizes)) - 1] if sizes else None,
+                "p95": sizes[math.ceil(0.95 * len(sizes)) - 1] if sizes else None,
+                "max": sizes[-1] if sizes else None,
+                "distribution": dict(zip(labels, entry["prompt_histogram"]))
+            },
+            "avg_output_tokens": round(entry["eval_tokens"] / requests, 1) if requests else None,
+            # Dónde se va la mayor parte del tiempo de Ollama
+            "dominant_phase": max(times, key=times.get) if any(times.values()) else None
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Resumen por modelo (todas las BD) y por BD y modelo"""
+        by_model: Dict[str, list] = {}
+        by_database: Dict[str, Dict[str, Any]] = {}
+        for (model, database), entry in self._entries.items():
+            by_model.setdefault(model, []).append(entry)
+            by_database.setdefault(database, {})[model] = self._summary(entry)
+
+        return {
+            "cold_load_threshold_ms": self.COLD_LOAD_MS,
+            "models": {model: self._summary(self._merge(entries)) for model, entries in by_model.items()},
+            "databases": by_database
+        }
+
+
+# Instancia global de estadísticas de generación
+generation_stats = GenerationStats()
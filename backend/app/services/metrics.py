@@ -0,0 +1,174 @@
+"""
+Instrumentación de latencia por etapa.
+Cada etapa de /chat (búsqueda en caché, análisis del esquema, perfilado,
+análisis de la pregunta, construcción del prompt, generación, ejecución del
+SQL y serialización) se mide con `metrics.stage(...)` y se acumula en
+histogramas que /metrics expone en el formato de texto de Prometheus. Las
+duraciones de la petición en curso se devuelven además en la cabecera
+Server-Timing.
+"""
+from typing import Dict, Any, List, Optional, Tuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+import time
+
+from starlette.datastructures import MutableHeaders
+
+# Límites (segundos) de los histogramas: de búsquedas en memoria a generaciones largas
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Etapas instrumentadas (orden de la cabecera Server-Timing)
+STAGES = (
+    "cache_lookup", "schema_analysis", "profiling", "query_analysis",
+    "prompt_build", "llm_generation", "sql_preflight", "sql_execution", "serialization"
+)
+
+# Duraciones (ms) por etapa de la petición en curso; las tareas y hilos
+# lanzados desde la petición heredan el mismo diccionario
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    """Histograma acumulativo con una etiqueta (formato de Prometheus)"""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series: Dict[str, Dict[str, Any]] = {}
+        # Se observa también desde hilos (asyncio.to_thread)
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, seconds: float) -> None:
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._series[label_value] = series
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series["counts"][index] += 1
+                    break
+            series["sum"] += seconds
+            series["count"] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, series in sorted(self._series.items()):
+                label = f'{self.label}="{label_value}"'
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {series["count"]}')
+                lines.append(f"{self.name}_sum{{{label}}} {series['sum']:.6f}")
+                lines.append(f"{self.name}_count{{{label}}} {series['count']}")
+        return lines
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                label_value: {
+                    "count": series["count"],
+                    "avg_ms": round(series["sum"] / series["count"] * 1000, 2) if series["count"] else 0.0
+                }
+                for label_value, series in self._series.items()
+            }
+
+
+class MetricsRegistry:
+    """Histogramas por etapa y por ruta HTTP, y tiempos de la petición en curso"""
+
+    def __init__(self):
+        self.stage_seconds = Histogram(
+            "chatbot_stage_duration_seconds", "Duración de cada etapa del pipeline de /chat", "stage"
+        )
+        self.request_seconds = Histogram(
+            "chatbot_request_duration_seconds", "Duración total de las peticiones HTTP", "path"
+        )
+
+    def begin_request(self) -> Dict[str, float]:
+        """Empezar a acumular las etapas de una petición (lo llama el middleware)"""
+        timings: Dict[str, float] = {}
+        _request_timings.set(timings)
+        return timings
+
+    def record_stage(self, stage: str, seconds: float) -> None:
+        self.stage_seconds.observe(stage, seconds)
+        timings = _request_timings.get()
+        if timings is not None:
+            # Etapas repetidas (candidatos en paralelo, reintentos) se suman
+            timings[stage] = timings.get(stage, 0.0) + seconds * 1000
+
+    @contextmanager
+    def stage(self, stage: str):
+        """Medir un bloque como una etapa (también si termina con excepción)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, time.perf_counter() - start)
+
+    @staticmethod
+    def server_timing(timings: Dict[str, float], total_ms: float = None) -> str:
+        """Valor de la cabecera Server-Timing: 'etapa;dur=ms, ...'"""
+        ordered = sorted(timings.items(), key=lambda item: STAGES.index(item[0]) if item[0] in STAGES else len(STAGES))
+        parts = [f"{stage};dur={ms:.1f}" for stage, ms in ordered]
+        if total_ms is not None:
+            parts.append(f"total;dur={total_ms:.1f}")
+        return ", ".join(parts)
+
+    def render_prometheus(self) -> str:
+        lines = self.stage_seconds.render() + self.request_seconds.render()
+        return "\n".join(lines) + "\n"
+
+
+class ServerTimingMiddleware:
+    """
+    Middleware ASGI: abre el registro de etapas de cada petición, añade la
+    cabecera Server-Timing a la respuesta y mide la duración por ruta.
+    """
+
+    def __init__(self, app, registry: MetricsRegistry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = self.registry.begin_request()
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                total_ms = (time.perf_counter() - start) * 1000
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", self.registry.server_timing(timings, total_ms))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            self.registry.request_seconds.observe(self._route_template(scope), time.perf_counter() - start)
+
+    @staticmethod
+    def _route_template(scope) -> str:
+        """
+        Plantilla de la ruta (no la URL) para acotar las series. La ruta de
+        un router incluido no lleva el prefijo: se toma de la URL.
+        """
+        template = getattr(scope.get("route"), "path", None)
+        if not template:
+            return "unmatched"
+        segments = scope["path"].rstrip("/").split("/")
+        prefix = segments[:len(segments) - (template.rstrip("/").count("/"))]
+        return "/".join(prefix) + template
+
+
+# Instancia global de métricas
+metrics = MetricsRegistry()
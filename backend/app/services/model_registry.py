@@ -0,0 +1,92 @@
+"""
+Registro en caché de metadatos de modelos de Ollama.
+La lista de modelos sale del chequeo periódico del pool (/api/tags de cada
+host) y /api/show se consulta una vez por modelo (y TTL), para conocer la
+ventana de contexto, el número de parámetros y la cuantización sin repetir
+llamadas en cada petición.
+"""
+from typing import Dict, Any, List, Optional
+from datetime import datetime, timedelta
+from app.services.ollama_pool import OllamaPool
+from app.services.structured_logging import get_logger
+
+logger = get_logger("models")
+
+
+class ModelRegistry:
+    """Caché de /api/show con expiración por TTL; lista de modelos del pool"""
+
+    def __init__(self, pool: OllamaPool, ttl_minutes: int = 10):
+        self.pool = pool
+        self._ttl = timedelta(minutes=ttl_minutes)
+        self._info: Dict[str, Dict[str, Any]] = {}
+
+    def _expired(self, fetched_at: Optional[datetime]) -> bool:
+        return fetched_at is None or datetime.now() - fetched_at >= self._ttl
+
+    async def list_models(self, force: bool = False) -> List[Dict[str, Any]]:
+        """Modelos instalados en los hosts del pool (/api/tags del último chequeo)"""
+        await self.pool.refresh(force)
+        return self.pool.list_models()
+
+    async def get_info(self, model: str) -> Dict[str, Any]:
+        """
+        Metadatos de un modelo (/api/show): context_length, parameter_size,
+        quantization_level, family y el num_ctx por defecto de su Modelfile.
+        Si Ollama no responde se devuelve lo último conocido (o {}).
+        """
+        info = self._info.get(model)
+        if info is not None and not self._expired(info["fetched_at"]):
+            return info
+
+        try:
+            response, _ = await self.pool.request("POST", "/api/show", model=model, json={"model": model})
+            if response.status_code != 200:
+                return info or {}
+            info = self._parse_show(model, response.json())
+            self._info[model] = info
+            logger.info(f"📇 [MODELS] {model}: contexto {info['context_length']}, "
+                        f"{info['parameter_size']}, {info['quantization_level']}")
+            return info
+        except Exception as e:
+            logger.warning(f"⚠️ [MODELS] No se pudo consultar /api/show para {model}: {str(e)}")
+            return info or {}
+
+    @staticmethod
+    def _parse_show(model: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        details = data.get("details", {})
+        model_info = data.get("model_info", {})
+
+        # La clave depende de la arquitectura: 'llama.context_length', 'qwen2.context_length', ...
+        context_length = next(
+            (value for key, value in model_info.items() if key.endswith(".context_length")),
+            None
+        )
+
+        default_num_ctx = None
+        for line in (data.get("parameters") or "").splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[0] == "num_ctx" and parts[1].isdigit():
+                default_num_ctx = int(parts[1])
+
+        return {
+            "name": model,
+            "context_length": context_length,
+            "default_num_ctx": default_num_ctx,
+            "parameter_size": details.get("parameter_size"),
+            "parameter_count": model_info.get("general.parameter_count"),
+            "quantization_level": details.get("quantization_level"),
+            "family": details.get("family"),
+            "fetched_at": datetime.now()
+        }
+
+    def cached_info(self, model: str) -> Dict[str, Any]:
+        """Metadatos ya conocidos de un modelo, sin consultar Ollama"""
+        return self._info.get(model, {})
+
+    def invalidate(self, model: str = None) -> None:
+        """Olvidar los metadatos de un modelo (o todos)"""
+        if model is None:
+            self._info.clear()
+        else:
+            self._info.pop(model, None)
@@ -0,0 +1,82 @@
+"""
+Enrutamiento en cascada por complejidad.
+Las preguntas simples (una tabla, complejidad baja) van a un modelo pequeño
+y rápido; el resto, al modelo elegido por el usuario. Si la respuesta del
+modelo rápido no produce SQL válido se escala al modelo grande.
+"""
+from typing import Dict, Any, List, Tuple
+from collections import deque
+import math
+import statistics
+
+
+class ModelRouter:
+    """
+    Decide qué modelos probar (en orden) para una pregunta y lleva
+    estadísticas de latencia y escalado por nivel ("fast" / "large").
+    Deshabilitado si no se configura un modelo rápido.
+    """
+
+    # Latencias guardadas por nivel para calcular percentiles
+    LATENCY_WINDOW = 500
+
+    def __init__(self, fast_model: str = "", fast_max_complexity: int = 2):
+        self.fast_model = fast_model
+        self.fast_max_complexity = fast_max_complexity
+        self._latencies: Dict[str, deque] = {
+            "fast": deque(maxlen=self.LATENCY_WINDOW),
+            "large": deque(maxlen=self.LATENCY_WINDOW)
+        }
+        self._requests = {"fast": 0, "large": 0}
+        self._failures = {"fast": 0, "large": 0}
+        self._escalations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.fast_model)
+
+    def plan(self, query_analysis: Dict[str, Any], requested_model: str) -> List[Tuple[str, str]]:
+        """
+        Modelos a probar, en orden: [(nivel, modelo), ...]. Una pregunta simple
+        sin JOINs empieza por el modelo rápido y escala al elegido.
+        """
+        simple = (
+            query_analysis["complexity_level"] <= self.fast_max_complexity
+            and not query_analysis.get("requires_joins")
+        )
+        if self.enabled and simple and self.fast_model != requested_model:
+            return [("fast", self.fast_model), ("large", requested_model)]
+        return [("large", requested_model)]
+
+    def record(self, tier: str, latency_ms: float, success: bool) -> None:
+        """Registrar el resultado de un intento"""
+        self._requests[tier] += 1
+        self._latencies[tier].append(latency_ms)
+        if not success:
+            self._failures[tier] += 1
+
+    def record_escalation(self) -> None:
+        self._escalations += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Latencias (mediana, p90) por nivel y tasa de escalado"""
+        tiers = {}
+        for tier, latencies in self._latencies.items():
+            ordered = sorted(latencies)
+            tiers[tier] = {
+                "requests": self._requests[tier],
+                "failures": self._failures[tier],
+                "median_ms": round(statistics.median(ordered), 1) if ordered else None,
+                "p90_ms": round(ordered[math.ceil(0.9 * len(ordered)) - 1], 1) if ordered else None
+            }
+
+        return {
+            "enabled": self.enabled,
+            "fast_model": self.fast_model or None,
+            "fast_max_complexity": self.fast_max_complexity,
+            "tiers": tiers,
+            "escalations": self._escalations,
+            "escalation_rate": (
+                round(self._escalations / self._requests["fast"], 3) if self._requests["fast"] else 0.0
+            )
+        }
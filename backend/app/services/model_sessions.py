@@ -0,0 +1,115 @@
+"""
+Registro de sesiones "aprendidas" por base de datos y modelo.
+Una sesión guarda el mensaje de sistema (prefijo del esquema) que se precargó
+en Ollama con /learn-database, para que las consultas siguientes lo reenvíen
+idéntico y Ollama reutilice su caché KV: solo la pregunta necesita prefill.
+"""
+from typing import Dict, Any, Optional, Tuple, Set
+from datetime import datetime, timedelta
+import os
+from app.services.structured_logging import get_logger
+
+logger = get_logger("sessions")
+
+
+class ModelSessionStore:
+    """
+    Sesiones en memoria con clave (huella de BD, modelo).
+
+    Política:
+      - Expiración: una sesión sin uso durante `ttl_minutes` se descarta.
+        Debe ser <= keep_alive de Ollama: al descargar el modelo su caché KV
+        se pierde y el prefijo tendría que volver a procesarse igualmente.
+      - Desalojo: como máximo `max_sessions`; al superar el límite se
+        elimina la usada hace más tiempo (LRU).
+      - Invalidación explícita al refrescar el contexto o desconectar.
+    """
+
+    def __init__(self, ttl_minutes: int = 30, max_sessions: int = 4):
+        self._sessions: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._ttl = timedelta(minutes=ttl_minutes)
+        self.max_sessions = max_sessions
+
+    def get(self, fingerprint: str, model: str) -> Optional[Dict[str, Any]]:
+        """Obtener la sesión vigente (y marcarla como usada)"""
+        key = (fingerprint, model)
+        session = self._sessions.get(key)
+        if session is None:
+            return None
+
+        if datetime.now() - session["last_used"] >= self._ttl:
+            logger.info(f"⏰ [SESSIONS] Sesión expirada: {session['database']} / {model}")
+            del self._sessions[key]
+            return None
+
+        session["last_used"] = datetime.now()
+        session["hits"] += 1
+        return session
+
+    def set(self,
+            fingerprint: str,
+            model: str,
+            database: str,
+            system_prompt: str,
+            covered_tables: Set[str],
+            prefill: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Registrar la sesión aprendida, desalojando la menos usada si hace falta"""
+        now = datetime.now()
+        session = {
+            "database": database,
+            "model": model,
+            "system_prompt": system_prompt,
+            "covered_tables": covered_tables,
+            "prefill": prefill or {},
+            "created_at": now,
+            "last_used": now,
+            "hits": 0
+        }
+        self._sessions[(fingerprint, model)] = session
+
+        while len(self._sessions) > self.max_sessions:
+            oldest = min(self._sessions, key=lambda k: self._sessions[k]["last_used"])
+            logger.info(f"🗑️ [SESSIONS] Desalojada (LRU): {self._sessions[oldest]['database']} / {oldest[1]}")
+            del self._sessions[oldest]
+
+        logger.info(f"💾 [SESSIONS] Sesión aprendida: {database} / {model}")
+        return session
+
+    def invalidate(self, fingerprint: str, model: str = None) -> int:
+        """Eliminar las sesiones de una BD (de un modelo o de todos)"""
+        keys = [k for k in self._sessions if k[0] == fingerprint and model in (None, k[1])]
+        for key in keys:
+            del self._sessions[key]
+        return len(keys)
+
+    def invalidate_model(self, model: str) -> int:
+        """Eliminar todas las sesiones de un modelo (p.ej. al descargarlo)"""
+        keys = [k for k in self._sessions if k[1] == model]
+        for key in keys:
+            del self._sessions[key]
+        return len(keys)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "total_sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "ttl_minutes": self._ttl.total_seconds() / 60,
+            "sessions": [
+                {
+                    "database": s["database"],
+                    "model": s["model"],
+                    "hits": s["hits"],
+                    "covered_tables": len(s["covered_tables"]),
+                    "created_at": s["created_at"].isoformat(),
+                    "last_used": s["last_used"].isoformat()
+                }
+                for s in self._sessions.values()
+            ]
+        }
+
+
+# Instancia global de sesiones aprendidas
+model_sessions = ModelSessionStore(
+    ttl_minutes=int(os.getenv("MODEL_SESSION_TTL_MINUTES", "30")),
+    max_sessions=int(os.getenv("MODEL_SESSION_MAX", "4"))
+)
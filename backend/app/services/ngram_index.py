@@ -0,0 +1,118 @@
+"""
+Índice invertido de trigramas de caracteres para búsqueda difusa de
+identificadores (tablas y columnas) en esquemas grandes.
+"""
+from typing import Dict, List, Set, Tuple, Iterable
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+
+class TrigramIndex:
+    """
+    Índice de trigramas sobre identificadores de la base de datos.
+
+    En lugar de comparar cada palabra contra todos los nombres (como hace
+    difflib.get_close_matches), primero se recuperan candidatos que comparten
+    trigramas con la palabra y solo esos se re-ordenan con la similitud exacta
+    de SequenceMatcher.
+    """
+
+    def __init__(self, max_candidates: int = 50):
+        """
+        Args:
+            max_candidates: Máximo de candidatos (por solapamiento de trigramas)
+                            que se re-evalúan con la similitud exacta
+        """
+        self.max_candidates = max_candidates
+        self._identifiers: List[str] = []
+        self._identifier_ids: Dict[str, int] = {}
+        self._gram_counts: List[int] = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        # identificador -> {(tipo, tabla)} donde tipo es 'table' o 'column'
+        self._owners: Dict[str, Set[Tuple[str, str]]] = defaultdict(set)
+
+    @staticmethod
+    def trigrams(text: str) -> Set[str]:
+        """
+        Obtener trigramas de un texto con relleno al inicio y al final.
+        Ejemplo: 'curso' -> {'  c', ' cu', 'cur', 'urs', 'rso', 'so '}
+        """
+        padded = f"  {text.lower()} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def add(self, identifier: str, kind: str, table_name: str) -> None:
+        """Agregar un identificador (tabla o columna) al índice"""
+        identifier = identifier.lower()
+        self._owners[identifier].add((kind, table_name.lower()))
+
+        if identifier in self._identifier_ids:
+            return
+
+        identifier_id = len(self._identifiers)
+        self._identifiers.append(identifier)
+        self._identifier_ids[identifier] = identifier_id
+
+        grams = self.trigrams(identifier)
+        self._gram_counts.append(len(grams))
+        for gram in grams:
+            self._postings[gram].append(identifier_id)
+
+    @classmethod
+    def from_schema(cls, tables: Iterable, max_candidates: int = 50) -> "TrigramIndex":
+        """Construir el índice con los nombres de tablas y columnas de un esquema"""
+        index = cls(max_candidates=max_candidates)
+        for table in tables:
+            index.add(table.table_name, "table", table.table_name)
+            for col in table.columns:
+                index.add(col["name"], "column", table.table_name)
+        return index
+
+    def candidates(self, word: str) -> List[Tuple[str, float]]:
+        """
+        Recuperar candidatos por solapamiento de trigramas.
+        Devuelve (identificador, coeficiente de Dice) ordenado de mayor a menor.
+        """
+        grams = self.trigrams(word)
+        if not grams:
+            return []
+
+        overlap: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for identifier_id in self._postings.get(gram, ()):
+                overlap[identifier_id] += 1
+
+        scored = [
+            (self._identifiers[i], 2.0 * shared / (len(grams) + self._gram_counts[i]))
+            for i, shared in overlap.items()
+        ]
+        scored.sort(key=lambda x: x[1], reverse=True)
+        return scored[:self.max_candidates]
+
+    def search(self, word: str, n: int = 2, cutoff: float = 0.6) -> List[Tuple[str, float]]:
+        """
+        Buscar los identificadores más parecidos a una palabra.
+        Equivalente a difflib.get_close_matches pero sobre los candidatos
+        del índice. Devuelve (identificador, similitud).
+        """
+        word = word.lower()
+        matcher = SequenceMatcher()
+        matcher.set_seq2(word)
+
+        results = []
+        for identifier, _ in self.candidates(word):
+            matcher.set_seq1(identifier)
+            if (matcher.real_quick_ratio() >= cutoff and
+                    matcher.quick_ratio() >= cutoff):
+                ratio = matcher.ratio()
+                if ratio >= cutoff:
+                    results.append((identifier, ratio))
+
+        results.sort(key=lambda x: x[1], reverse=True)
+        return results[:n]
+
+    def owners(self, identifier: str) -> Set[Tuple[str, str]]:
+        """Obtener (tipo, tabla) a los que pertenece un identificador"""
+        return self._owners.get(identifier.lower(), set())
+
+    def __len__(self) -> int:
+        return len(self._identifiers)
@@ -0,0 +1,426 @@
+"""
+Pool de servidores Ollama con balanceo de carga.
+Con varios hosts de inferencia (OLLAMA_BASE_URL con URLs separadas por comas)
+cada petición va al host con menos peticiones en curso, con preferencia por
+los que ya tienen el modelo cargado; si un host no responde se reintenta en
+otro. Un chequeo periódico (/api/tags y /api/ps) mantiene el estado de salud
+y el mapa de modelos instalados y cargados de cada host.
+
+Control de admisión: cada host acepta como mucho `max_concurrent`
+generaciones (o lotes de embeddings) a la vez; el resto espera en una cola
+con prioridad (el chat interactivo antes que /learn-database, las precargas
+y la indexación de embeddings). Si la espera
+estimada supera el plazo, la petición se rechaza (QueueFullError -> 429).
+"""
+from typing import Dict, Any, List, Optional, Tuple
+from collections import deque
+from datetime import datetime, timedelta
+import asyncio
+import heapq
+import itertools
+import math
+import statistics
+import time
+import httpx
+from app.services.structured_logging import get_logger
+
+logger = get_logger("pool")
+
+
+# Prioridades de la cola de generación (menor = antes)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class QueueFullError(Exception):
+    """La espera estimada en la cola de generación supera el plazo"""
+
+    def __init__(self, estimated_wait_s: float):
+        super().__init__(f"Servidores de Ollama saturados (espera estimada {estimated_wait_s:.0f} s)")
+        self.estimated_wait_s = estimated_wait_s
+        self.retry_after = max(1, math.ceil(estimated_wait_s))
+
+
+class OllamaPool:
+    """
+    Reparto de peticiones entre hosts de Ollama.
+
+    Coste de enviar una petición a un host (se elige el menor):
+      peticiones en curso
+      + LOAD_PENALTY si el host no tiene el modelo cargado
+      + PREFIX_PENALTY si la pregunta tiene su prefijo precargado en otro host
+    Los empates se resuelven por la latencia mediana del host. Las
+    generaciones solo van a hosts con hueco (menos de `max_concurrent`).
+    """
+
+    # Cargar un modelo cuesta lo que varias peticiones en cola
+    LOAD_PENALTY = 2
+    # Repetir el prefill de un prefijo aprendido en otro host
+    PREFIX_PENALTY = 1
+    # Latencias guardadas por host (solo generación)
+    LATENCY_WINDOW = 200
+    GENERATION_PATHS = ("/api/chat", "/api/generate")
+    # Peticiones que ocupan un hueco de la cola de admisión (usan la GPU)
+    ADMISSION_PATHS = GENERATION_PATHS + ("/api/embed",)
+    # Duración supuesta de una generación mientras no hay latencias medidas
+    DEFAULT_SERVICE_S = 20.0
+
+    def __init__(self,
+                 base_urls: List[str],
+                 health_interval_s: int = 15,
+                 max_concurrent: int = 2,
+                 queue_deadline_s: float = 120.0):
+        self.backends: List[Dict[str, Any]] = [
+            {
+                "url": url.rstrip("/"),
+                "healthy": True,
+                "outstanding": 0,
+                "requests": 0,
+                "failures": 0,
+                "latencies": deque(maxlen=self.LATENCY_WINDOW),
+                "tags": [],
+                "models": set(),
+                "loaded": set(),
+                # Modelos que este backend ha usado en el host (los únicos que descarga)
+                "served": set(),
+                "checked_at": None
+            }
+            for url in base_urls
+        ]
+        self._health_interval = timedelta(seconds=health_interval_s)
+        self._checked_at: Optional[datetime] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        # Chequeo periódico en segundo plano (start_health_checks al arrancar la app)
+        self._health_task: Optional[asyncio.Task] = None
+        self.max_concurrent = max_concurrent
+        self.queue_deadline_s = queue_deadline_s
+        # Cola de espera: [prioridad, orden de llegada, future, modelo, excluidos, preferido]
+        self._waiters: List[list] = []
+        self._arrival = itertools.count()
+        self._model_requests: Dict[str, int] = {}
+
+    @property
+    def primary_url(self) -> str:
+        return self.backends[0]["url"]
+
+    def in_use(self, model: str) -> bool:
+        """Si el modelo tiene peticiones en curso o esperando en la cola"""
+        return model in self._model_requests
+
+    def get_backend(self, url: str) -> Dict[str, Any]:
+        return next(b for b in self.backends if b["url"] == url)
+
+    async def _check(self, backend: Dict[str, Any], client: httpx.AsyncClient) -> None:
+        """Chequeo de salud de un host: modelos instalados y cargados"""
+        try:
+            tags = await client.get(f"{backend['url']}/api/tags")
+            ps = await client.get(f"{backend['url']}/api/ps")
+            tags.raise_for_status()
+            ps.raise_for_status()
+            backend["tags"] = tags.json().get("models", [])
+            backend["models"] = {m["name"] for m in backend["tags"]}
+            backend["loaded"] = {m["name"] for m in ps.json().get("models", [])}
+            if not backend["healthy"]:
+                logger.info(f"✅ [POOL] {backend['url']} vuelve a responder")
+            backend["healthy"] = True
+        except Exception as e:
+            if backend["healthy"]:
+                logger.warning(f"⚠️ [POOL] {backend['url']} no responde: {str(e)}")
+            backend["healthy"] = False
+        backend["checked_at"] = datetime.now()
+
+    async def refresh(self, force: bool = False) -> None:
+        """Chequear todos los hosts (como máximo una vez por intervalo)"""
+        if not force and self._checked_at is not None and datetime.now() - self._checked_at < self._health_interval:
+            return
+        self._checked_at = datetime.now()
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            await asyncio.gather(*(self._check(backend, client) for backend in self.backends))
+
+    async def _health_loop(self) -> None:
+        """Chequear los hosts cada intervalo, lleguen o no peticiones"""
+        while True:
+            try:
+                await self.refresh(force=True)
+            except Exception as e:
+                logger.warning(f"⚠️ [POOL] Error en el chequeo de salud: {str(e)}")
+            await asyncio.sleep(self._health_interval.total_seconds())
+
+    def start_health_checks(self) -> None:
+        """Arrancar el chequeo periódico (requiere un event loop en marcha)"""
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.create_task(self._health_loop())
+            logger.info(f"🩺 [POOL] Chequeo de salud cada {self._health_interval.total_seconds():.0f} s "
+                        f"({len(self.backends)} hosts)")
+
+    async def stop_health_checks(self) -> None:
+        """Parar el chequeo periódico (al apagar la app)"""
+        task, self._health_task = self._health_task, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _maybe_refresh(self) -> None:
+        """
+        Respaldo si no corre el chequeo periódico (p.ej. fuera de la app): el
+        primer chequeo se espera; los siguientes se lanzan en segundo plano
+        al vencer el intervalo, para no añadir su latencia a ninguna petición.
+        """
+        if self._health_task is not None and not self._health_task.done() and self._checked_at is not None:
+            # Ya lo mantiene el chequeo periódico
+            return
+        if self._checked_at is None:
+            await self.refresh()
+        elif datetime.now() - self._checked_at >= self._health_interval:
+            if self._refresh_task is None or self._refresh_task.done():
+                self._refresh_task = asyncio.create_task(self.refresh())
+
+    def list_models(self) -> List[Dict[str, Any]]:
+        """Modelos instalados en algún host sano (sin duplicados)"""
+        models = {}
+        for backend in self.backends:
+            if backend["healthy"]:
+                for model in backend["tags"]:
+                    models.setdefault(model["name"], model)
+        return list(models.values())
+
+    def pick(self,
+             model: str = None,
+             exclude: set = (),
+             prefer: str = None,
+             free_only: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Elegir host para una petición (None si no queda ninguno por probar o,
+        con `free_only`, si ninguno tiene hueco para otra generación)
+        """
+        candidates = [b for b in self.backends if b["healthy"] and b["url"] not in exclude]
+        if model:
+            # Solo hosts que tienen el modelo instalado (si alguno lo tiene)
+            with_model = [b for b in candidates if model in b["models"]]
+            candidates = with_model or candidates
+        if not candidates:
+            # Todos marcados como caídos: probar igualmente los que queden
+            candidates = [b for b in self.backends if b["url"] not in exclude]
+        if free_only:
+            candidates = [b for b in candidates if b["outstanding"] < self.max_concurrent]
+        if not candidates:
+            return None
+
+        def cost(backend: Dict[str, Any]) -> Tuple[int, float]:
+            value = backend["outstanding"]
+            if model and model not in backend["loaded"]:
+                value += self.LOAD_PENALTY
+            if prefer and backend["url"] != prefer:
+                value += self.PREFIX_PENALTY
+            latencies = backend["latencies"]
+            return value, statistics.median(latencies) if latencies else 0.0
+
+        return min(candidates, key=cost)
+
+    def _service_time_s(self) -> float:
+        """Duración mediana de una generación en el pool"""
+        latencies = [latency for b in self.backends for latency in b["latencies"]]
+        return statistics.median(latencies) / 1000 if latencies else self.DEFAULT_SERVICE_S
+
+    def estimate_wait(self, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """
+        Espera estimada (s) de una generación nueva con esta prioridad: las
+        que van delante en la cola, repartidas entre los huecos de los hosts
+        sanos, por la duración mediana de una generación.
+        """
+        ahead = sum(1 for waiter in self._waiters if waiter[0] <= priority)
+        if ahead == 0 and self.pick(free_only=True) is not None:
+            return 0.0
+        healthy = sum(1 for b in self.backends if b["healthy"]) or len(self.backends)
+        capacity = healthy * self.max_concurrent
+        return round((ahead + 1) / capacity * self._service_time_s(), 1)
+
+    def check_admission(self, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """Rechazar (QueueFullError) si la espera estimada supera el plazo"""
+        wait = self.estimate_wait(priority)
+        if wait > self.queue_deadline_s:
+            logger.warning(f"🚦 [POOL] Rechazada (prioridad {priority}): espera estimada {wait} s "
+                           f"> plazo {self.queue_deadline_s:.0f} s")
+            raise QueueFullError(wait)
+        return wait
+
+    async def _acquire(self,
+                       model: str,
+                       exclude: set,
+                       prefer: str,
+                       priority: int) -> Optional[Dict[str, Any]]:
+        """
+        Reservar un hueco de generación en un host (esperando en la cola si
+        todos están ocupados). None si no queda ningún host por probar.
+        """
+        if self.pick(model, exclude, prefer) is None:
+            return None
+
+        # Los huecos libres se reparten en orden de prioridad y llegada: si
+        # las esperas de delante no pueden usar el host libre de este modelo
+        # (sus hosts están llenos), el hueco es para esta petición
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._arrival), future, model, exclude, prefer]
+        heapq.heappush(self._waiters, entry)
+        self._wake()
+        if future.done():
+            return future.result()
+
+        # Sin hueco: admisión según las esperas que van delante (sin esta)
+        self._waiters.remove(entry)
+        heapq.heapify(self._waiters)
+        wait = self.check_admission(priority)
+        heapq.heappush(self._waiters, entry)
+        logger.info(f"⏳ [POOL] En cola (prioridad {priority}, {len(self._waiters)} esperando, ~{wait} s)")
+        try:
+            await asyncio.wait({future}, timeout=self.queue_deadline_s)
+        except asyncio.CancelledError:
+            self._abandon(entry)
+            raise
+        if not future.done():
+            self._abandon(entry)
+            raise QueueFullError(self.queue_deadline_s)
+        # _wake ya ha reservado el hueco
+        return future.result()
+
+    def _abandon(self, entry: list) -> None:
+        """Sacar una espera de la cola, devolviendo el hueco si ya se le había dado"""
+        future = entry[2]
+        if future.done() and not future.cancelled():
+            self._release(future.result())
+            return
+        future.cancel()
+        if entry in self._waiters:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+
+    def _release(self, backend: Dict[str, Any]) -> None:
+        backend["outstanding"] -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        """Dar los huecos libres a las esperas, por prioridad y orden de llegada"""
+        for entry in sorted(self._waiters):
+            _, _, future, model, exclude, prefer = entry
+            backend = self.pick(model, exclude, prefer, free_only=True)
+            if backend is None:
+                # Sus hosts están llenos; otra espera quizá quepa en otro host
+                continue
+            backend["outstanding"] += 1
+            self._waiters.remove(entry)
+            future.set_result(backend)
+        heapq.heapify(self._waiters)
+
+    async def request(self,
+                      method: str,
+                      path: str,
+                      model: str = None,
+                      prefer: str = None,
+                      url: str = None,
+                      priority: int = PRIORITY_INTERACTIVE,
+                      timeout: float = 30.0,
+                      **kwargs) -> Tuple[httpx.Response, str]:
+        """
+        Enviar una petición al mejor host y devolver (respuesta, host).
+        Las generaciones y los embeddings de un modelo pasan por la cola de
+        admisión con su `priority`. Ante un error de conexión el host se marca
+        como caído y se reintenta en el siguiente. Con `url` se fuerza un host concreto
+        (sin cola ni reintento).
+        """
+        # Peticiones en curso o en cola por modelo (no se descarga un modelo en uso)
+        if model:
+            self._model_requests[model] = self._model_requests.get(model, 0) + 1
+        try:
+            await self._maybe_refresh()
+            tried = set()
+            while True:
+                if url:
+                    backend = self.get_backend(url)
+                    backend["outstanding"] += 1
+                elif model and path in self.ADMISSION_PATHS:
+                    backend = await self._acquire(model, tried, prefer, priority)
+                else:
+                    backend = self.pick(model, tried, prefer)
+                    if backend is not None:
+                        backend["outstanding"] += 1
+                if backend is None:
+                    raise httpx.ConnectError(f"Ningún servidor de Ollama disponible ({len(tried)} probados)")
+
+                backend["requests"] += 1
+                start = time.perf_counter()
+                try:
+                    async with httpx.AsyncClient(timeout=timeout) as client:
+                        response = await client.request(method, f"{backend['url']}{path}", **kwargs)
+                except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                    backend["failures"] += 1
+                    backend["healthy"] = False
+                    tried.add(backend["url"])
+                    if url:
+                        raise
+                    logger.warning(f"🔀 [POOL] {backend['url']} sin conexión ({str(e)}), probando otro servidor")
+                    continue
+                finally:
+                    self._release(backend)
+
+                if self._is_generation(path, kwargs.get("json")):
+                    backend["latencies"].append((time.perf_counter() - start) * 1000)
+                if path in self.GENERATION_PATHS:
+                    if model and response.status_code == 200:
+                        backend["loaded"].add(model)
+                        backend["served"].add(model)
+                if response.status_code >= 500:
+                    backend["failures"] += 1
+                return response, backend["url"]
+        finally:
+            if model:
+                self._model_requests[model] -= 1
+                if not self._model_requests[model]:
+                    del self._model_requests[model]
+
+    @staticmethod
+    def _is_generation(path: str, payload: Optional[Dict[str, Any]]) -> bool:
+        """
+        Generación real (cuenta para la latencia y la espera estimada): no lo
+        son las precargas sin prompt ni las descargas (keep_alive 0) de /api/generate
+        """
+        if path == "/api/chat":
+            return True
+        return path == "/api/generate" and bool((payload or {}).get("prompt"))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Cola (peticiones en curso) y latencia por host"""
+        backends = []
+        for backend in self.backends:
+            ordered = sorted(backend["latencies"])
+            backends.append({
+                "url": backend["url"],
+                "healthy": backend["healthy"],
+                "outstanding": backend["outstanding"],
+                "requests": backend["requests"],
+                "failures": backend["failures"],
+                "median_ms": round(statistics.median(ordered), 1) if ordered else None,
+                "p90_ms": round(ordered[math.ceil(0.9 * len(ordered)) - 1], 1) if ordered else None,
+                "models": len(backend["models"]),
+                "loaded": sorted(backend["loaded"]),
+                "checked_at": backend["checked_at"].isoformat() if backend["checked_at"] else None
+            })
+        return {
+            "health_interval_s": self._health_interval.total_seconds(),
+            "max_concurrent_per_backend": self.max_concurrent,
+            "queue": {
+                "waiting": {
+                    "interactive": sum(1 for w in self._waiters if w[0] == PRIORITY_INTERACTIVE),
+                    "background": sum(1 for w in self._waiters if w[0] != PRIORITY_INTERACTIVE)
+                },
+                "deadline_s": self.queue_deadline_s,
+                "estimated_wait_s": {
+                    "interactive": self.estimate_wait(PRIORITY_INTERACTIVE),
+                    "background": self.estimate_wait(PRIORITY_BACKGROUND)
+                }
+            },
+            "backends": backends
+        }
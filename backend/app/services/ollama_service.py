@@ -1,39 +1,234 @@
-import httpx
+import asyncio
+import hashlib
 import json
+import os
 import re
-from typing import List, Dict, Any, Optional
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable
 from app.models.database import DatabaseSchema, OllamaModel
 from app.services.query_analyzer import QueryAnalyzer
+from app.services.schema_embeddings import SchemaEmbeddingIndex
+from app.services.prompt_assembler import (
+    PromptAssembler, token_budget_for_model, num_ctx_for_prompt, estimate_tokens, get_output_format,
+    RESPONSE_TOKEN_RESERVE, MIN_NUM_CTX
+)
+from app.services.model_registry import ModelRegistry
+from app.services.ollama_pool import OllamaPool, QueueFullError, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from app.services.model_router import ModelRouter
+from app.services.model_sessions import model_sessions
+from app.services.sql_lexer import analyze_sql
+from app.services.metrics import metrics
+from app.services.generation_stats import generation_stats
+from app.services.structured_logging import get_logger
+
+logger = get_logger("ollama")
+
+# Esquema JSON de la respuesta en el modo de salida estructurada (campo `format` de Ollama)
+SQL_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "sql": {"type": "string"},
+        "explanation": {"type": "string"}
+    },
+    "required": ["sql", "explanation"]
+}
+# Bloque de código alrededor del SQL (algunos modelos lo añaden dentro del JSON)
+CODE_FENCE = re.compile(r'^\s*```(?:sql)?|```\s*$', re.IGNORECASE)
 
 class OllamaService:
     def __init__(self, base_url: str = "http://localhost:11434"):
-        self.base_url = base_url
+        # Uno o varios hosts de Ollama ("http://a:11434,http://b:11434")
+        self.pool = OllamaPool(
+            [url.strip() for url in base_url.split(",") if url.strip()],
+            health_interval_s=int(os.getenv("OLLAMA_HEALTH_INTERVAL_S", "15")),
+            # Control de admisión: generaciones simultáneas por host y plazo de cola
+            max_concurrent=int(os.getenv("OLLAMA_MAX_CONCURRENT", "2")),
+            queue_deadline_s=float(os.getenv("OLLAMA_QUEUE_DEADLINE_S", "120"))
+        )
+        self.base_url = self.pool.primary_url
+        # Cascada por complejidad: preguntas simples a un modelo pequeño
+        self.router = ModelRouter(
+            fast_model=os.getenv("OLLAMA_FAST_MODEL", ""),
+            fast_max_complexity=int(os.getenv("FAST_MODEL_MAX_COMPLEXITY", "2"))
+        )
+        # Generación con cobertura (hedging): varios candidatos en paralelo,
+        # gana el primero que supera extracción, validación y EXPLAIN
+        self.hedge_fanout = max(1, int(os.getenv("OLLAMA_HEDGE_FANOUT", "1")))
+        self.hedge_delay = int(os.getenv("OLLAMA_HEDGE_DELAY_MS", "1500")) / 1000
+        # Modelos alternativos para los candidatos extra (vacío = mismo modelo, otra semilla)
+        self.hedge_models = [m.strip() for m in os.getenv("OLLAMA_HEDGE_MODELS", "").split(",") if m.strip()]
+        # Salida estructurada: "json" (format con esquema JSON) o "text" (solo regex);
+        # el PromptAssembler pide al modelo el mismo formato
+        self.output_format = get_output_format()
+        # Mantener el modelo (y su caché KV) cargado entre preguntas
+        self.keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+        # keep_alive por modelo: "qwen2.5-coder:7b=1h,llama3:8b=10m"
+        self.model_keep_alive = self._parse_keep_alive(os.getenv("OLLAMA_MODEL_KEEP_ALIVE", ""))
+        # Máximo de modelos cargados por este backend (el host es compartido)
+        # (con cascada hacen falta el modelo rápido y el elegido, y con
+        # hedging entre modelos, también los alternativos)
+        default_resident = 1 + self.router.enabled + (len(self.hedge_models) if self.hedge_fanout > 1 else 0)
+        self.max_resident_models = int(
+            os.getenv("OLLAMA_MAX_RESIDENT_MODELS", str(default_resident))
+        )
+        # Modelos cargados por este backend, del usado hace más tiempo al más reciente
+        self._resident: "OrderedDict[str, datetime]" = OrderedDict()
+        # Hash del último mensaje de sistema enviado por modelo
+        self._last_prefix: Dict[str, str] = {}
+        # num_ctx con el que está cargado cada modelo: las peticiones no lo
+        # reducen (cambiarlo obliga a Ollama a recargar el modelo)
+        self._num_ctx: Dict[str, int] = {}
+        # Metadatos de modelos (/api/tags, /api/show) en caché
+        self.registry = ModelRegistry(self.pool, ttl_minutes=int(os.getenv("MODEL_REGISTRY_TTL_MINUTES", "10")))
+        # (esquema, {tabla: {columnas}}) de la última validación
+        self._schema_lookup = (None, {})
     
-    async def get_available_models(self) -> List[OllamaModel]:
-        """Obtener lista de modelos disponibles en Ollama"""
+    @staticmethod
+    def _parse_keep_alive(spec: str) -> Dict[str, str]:
+        overrides = {}
+        for entry in spec.split(","):
+            if "=" in entry:
+                model, duration = entry.rsplit("=", 1)
+                overrides[model.strip()] = duration.strip()
+        return overrides
+    
+    def keep_alive_for(self, model: str) -> str:
+        """keep_alive de un modelo (override por modelo o valor general)"""
+        return self.model_keep_alive.get(model, self.keep_alive)
+    
+    async def ensure_resident(self, model: str) -> None:
+        """
+        Registrar que se va a usar `model` y, si con él se supera el máximo de
+        modelos residentes, descargar los usados hace más tiempo. Solo se
+        descargan modelos cargados por este backend, nunca los de otros equipos,
+        y no los que tienen peticiones en curso (de otro usuario): esos se
+        descargan en una llamada posterior, cuando estén libres.
+        """
+        self._resident[model] = datetime.now()
+        self._resident.move_to_end(model)
+        excess = len(self._resident) - self.max_resident_models
+        idle = [m for m in self._resident if m != model and not self.pool.in_use(m)]
+        for oldest in idle[:max(excess, 0)]:
+            await self.unload_model(oldest)
+        if len(self._resident) > self.max_resident_models:
+            logger.info(f"📌 [MODELS] {len(self._resident)} modelos residentes (máximo "
+                        f"{self.max_resident_models}): los demás siguen en uso")
+    
+    async def preload_model(self, model: str) -> Dict[str, Any]:
+        """
+        Cargar el modelo en memoria antes de la primera pregunta: una petición
+        sin prompt hace que Ollama lo cargue y lo mantenga keep_alive. Se
+        carga con el num_ctx que ya tenga o con el mínimo (MIN_NUM_CTX): las
+        preguntas lo suben solo si su prompt no cabe, así que un prompt corto
+        no paga la caché KV de la ventana completa.
+        """
+        await self.ensure_resident(model)
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(f"{self.base_url}/api/tags")
+            self._num_ctx.setdefault(model, MIN_NUM_CTX)
+            payload = {
+                "model": model,
+                "keep_alive": self.keep_alive_for(model),
+                "options": {"num_ctx": self._num_ctx[model]}
+            }
+            response, backend = await self.pool.request(
+                "POST", "/api/generate", model=model, json=payload,
+                priority=PRIORITY_BACKGROUND, timeout=1000.0
+            )
+            if response.status_code != 200:
+                return {"success": False, "error": f"Error Ollama: {response.status_code}"}
+            
+            load_ms = round(response.json().get("load_duration", 0) / 1e6, 1)
+            logger.info(f"🔥 [MODELS] Modelo precargado: {model} en {backend} ({load_ms} ms)")
+            return {"success": True, "model": model, "backend": backend, "load_ms": load_ms}
+        except Exception as e:
+            logger.warning(f"⚠️ [MODELS] No se pudo precargar {model}: {str(e)}")
+            return {"success": False, "error": str(e)}
+    
+    async def unload_model(self, model: str) -> bool:
+        """
+        Descargar el modelo de memoria (keep_alive=0) en los hosts donde lo
+        ha usado este backend y, si se descargó, olvidar sus sesiones (su
+        prefijo ya no está en la caché KV). No se descarga un modelo con
+        peticiones en curso o en cola.
+        """
+        if self.pool.in_use(model):
+            logger.info(f"📌 [MODELS] {model} sigue en uso: no se descarga")
+            return False
+        self._resident.pop(model, None)
+        
+        unloaded = False
+        for backend in self.pool.backends:
+            if model not in backend["served"]:
+                continue
+            try:
+                response, _ = await self.pool.request(
+                    "POST", "/api/generate", url=backend["url"], json={"model": model, "keep_alive": 0}
+                )
+                backend["served"].discard(model)
+                backend["loaded"].discard(model)
+                logger.info(f"⏏️ [MODELS] Modelo descargado: {model} en {backend['url']}")
+                unloaded = unloaded or response.status_code == 200
+            except Exception as e:
+                logger.warning(f"⚠️ [MODELS] No se pudo descargar {model} en {backend['url']}: {str(e)}")
+        
+        if unloaded:
+            self._last_prefix.pop(model, None)
+            self._num_ctx.pop(model, None)
+            model_sessions.invalidate_model(model)
+        return unloaded
+    
+    async def get_loaded_models(self) -> Dict[str, Any]:
+        """Modelos cargados en cada host (/api/ps) y los gestionados por este backend"""
+        loaded = []
+        for backend in self.pool.backends:
+            try:
+                response, _ = await self.pool.request("GET", "/api/ps", url=backend["url"], timeout=10.0)
                 if response.status_code == 200:
-                    data = response.json()
-                    models = []
-                    for model in data.get("models", []):
-                        # Convertir tamaño de bytes a formato legible
-                        size_bytes = model.get("size", 0)
-                        size_str = self._format_size(size_bytes)
-                        
-                        # Formatear fecha
-                        modified_at = model.get("modified_at", "")
-                        
-                        models.append(OllamaModel(
-                            name=model["name"],
-                            size=size_str,
-                            modified_at=modified_at
-                        ))
-                    return models
-                return []
+                    loaded.extend(
+                        {
+                            "name": m["name"],
+                            "backend": backend["url"],
+                            "size": self._format_size(m.get("size", 0)),
+                            "size_vram": self._format_size(m.get("size_vram", 0)),
+                            "expires_at": m.get("expires_at")
+                        }
+                        for m in response.json().get("models", [])
+                    )
+            except Exception as e:
+                logger.warning(f"⚠️ [MODELS] No se pudo consultar /api/ps en {backend['url']}: {str(e)}")
+        
+        return {
+            "loaded": loaded,
+            "managed": list(self._resident),
+            "max_resident_models": self.max_resident_models
+        }
+    
+    async def get_available_models(self) -> List[OllamaModel]:
+        """Obtener lista de modelos disponibles en Ollama (vía el registro en caché)"""
+        try:
+            models = []
+            for model in await self.registry.list_models():
+                # Convertir tamaño de bytes a formato legible
+                size_bytes = model.get("size", 0)
+                size_str = self._format_size(size_bytes)
+                
+                # Formatear fecha
+                modified_at = model.get("modified_at", "")
+                
+                details = model.get("details", {})
+                models.append(OllamaModel(
+                    name=model["name"],
+                    size=size_str,
+                    modified_at=modified_at,
+                    parameter_size=details.get("parameter_size"),
+                    quantization_level=details.get("quantization_level"),
+                    context_length=self.registry.cached_info(model["name"]).get("context_length")
+                ))
+            return models
         except Exception as e:
-            print(f"Error al obtener modelos de Ollama: {str(e)}")
+            logger.error(f"Error al obtener modelos de Ollama: {str(e)}")
             return []
     
     def _format_size(self, size_bytes: int) -> str:
@@ -52,225 +247,464 @@ class OllamaService:
                                 model: str, 
                                 schema: DatabaseSchema,
                                 sample_data: Dict[str, list] = None,
-                                data_profile: Dict[str, Any] = None) -> Dict[str, Any]:
-        """Generar consulta SQL con contexto FOCALIZADO usando QueryAnalyzer"""
+                                data_profile: Dict[str, Any] = None,
+                                analyzer: QueryAnalyzer = None,
+                                embedding_index: SchemaEmbeddingIndex = None,
+                                prompt_assembler: PromptAssembler = None,
+                                learned_session: Dict[str, Any] = None,
+                                dry_run: Callable[[str], Awaitable[Dict[str, Any]]] = None,
+                                mysql: bool = False) -> Dict[str, Any]:
+        """
+        Generar consulta SQL con contexto FOCALIZADO usando QueryAnalyzer.
+        `dry_run` (opcional) comprueba el SQL contra la BD real (EXPLAIN) en
+        el modo con cobertura, antes de dar un candidato por bueno.
+        `mysql` indica el motor de la conexión, para validar el SQL con las
+        mismas reglas léxicas que DatabaseService._is_safe_query.
+        Lanza QueueFullError si los servidores están saturados (-> 429).
+        """
+        # Rechazar antes de analizar nada si la cola ya supera el plazo
+        self.pool.check_admission(PRIORITY_INTERACTIVE)
         try:
-            print(f"🔍 [SQL-GEN] Analizando query: {message}")
+            logger.info(f"🔍 [SQL-GEN] Analizando query: {message}")
+            analysis_start = time.perf_counter()
             
             # 🆕 PASO 1: Analizar la query del usuario
-            analyzer = QueryAnalyzer(schema)
-            query_analysis = analyzer.analyze_query(message)
+            # (se reutiliza el del caché para no reconstruir sus índices)
+            if analyzer is None:
+                analyzer = QueryAnalyzer(schema, data_profile)
+            
+            # Recuperación semántica (si hay índice de embeddings del esquema)
+            semantic_scores = None
+            if embedding_index is not None:
+                try:
+                    semantic_scores = await embedding_index.table_scores(message)
+                except Exception as e:
+                    logger.warning(f"⚠️ [SQL-GEN] Búsqueda semántica no disponible: {str(e)}")
             
-            print(f"📊 [SQL-GEN] Tablas relevantes: {query_analysis['relevant_tables']}")
-            print(f"📊 [SQL-GEN] Tipo: {query_analysis['query_type']}")
-            print(f"📊 [SQL-GEN] Complejidad: {query_analysis['complexity_level']}/5")
+            query_analysis = analyzer.analyze_query(message, semantic_scores=semantic_scores)
+            
+            logger.info(f"📊 [SQL-GEN] Tablas relevantes: {query_analysis['relevant_tables']}")
+            logger.info(f"📊 [SQL-GEN] Tipo: {query_analysis['query_type']}")
+            logger.info(f"📊 [SQL-GEN] Complejidad: {query_analysis['complexity_level']}/5")
             
             # 🆕 PASO 2: Obtener contexto focalizado
             focused_context = analyzer.get_focused_context(query_analysis)
             
-            print(f"🎯 [SQL-GEN] Contexto focalizado: {focused_context['focused_table_count']}/{focused_context['total_tables_in_db']} tablas")
+            logger.info(f"🎯 [SQL-GEN] Contexto focalizado: {focused_context['focused_table_count']}/{focused_context['total_tables_in_db']} tablas")
             
             # 🆕 PASO 3: Generar ejemplos contextuales
             example_queries = analyzer.generate_example_queries(query_analysis)
+            metrics.record_stage("query_analysis", time.perf_counter() - analysis_start)
             
-            # 🆕 PASO 4: Crear prompt MEJORADO con contexto focalizado
-            prompt = self._create_focused_sql_prompt(
-                schema,
-                message,
-                data_profile,
-                focused_context,
-                query_analysis,
-                example_queries
-            )
-            
-            print(f"📝 [SQL-GEN] Longitud prompt: {len(prompt)} caracteres")
-            
-            # Ajustar temperatura según complejidad
-            temperature = 0.05 if query_analysis['complexity_level'] <= 2 else 0.1
-            
-            async with httpx.AsyncClient(timeout=1000.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/api/generate",
-                    json={
-                        "model": model,
-                        "prompt": prompt,
-                        "stream": False,
-                        "options": {
-                            "temperature": temperature,
-                            "top_p": 0.8,
-                            "top_k": 20,
-                            "repeat_penalty": 1.1,
-                            "num_predict": 5000
-                        }
-                    }
+            # Generar con un modelo concreto (semilla/temperatura para el modo con cobertura)
+            async def generate(candidate_model: str,
+                               seed: int = None,
+                               temperature: float = None,
+                               priority: int = PRIORITY_INTERACTIVE):
+                return await self._generate_with_model(
+                    candidate_model,
+                    message,
+                    schema,
+                    data_profile,
+                    focused_context,
+                    query_analysis,
+                    example_queries,
+                    prompt_assembler,
+                    # La sesión aprendida es del modelo elegido por el usuario
+                    learned_session if candidate_model == model else None,
+                    seed=seed,
+                    temperature=temperature,
+                    priority=priority,
+                    mysql=mysql
                 )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    ai_response = result.get("response", "")
-                    
-                    sql_query = self._extract_sql_query(ai_response)
-                    explanation = self._extract_explanation(ai_response)
-                    
-                    if not sql_query:
-                        return {
-                            "success": False,
-                            "error": "No se pudo extraer consulta SQL",
-                            "full_response": ai_response
-                        }
-                    
-                    # Validar SQL
-                    validation_result = self._validate_sql_query(sql_query, schema)
-                    if not validation_result["valid"]:
-                        return {
-                            "success": False,
-                            "error": f"SQL inválido: {validation_result['error']}",
-                            "sql_query": sql_query
-                        }
-                    
-                    return {
-                        "success": True,
-                        "sql_query": sql_query,
-                        "explanation": explanation,
-                        "full_response": ai_response,
-                        "analysis": query_analysis
-                    }
+            
+            # 🆕 PASO 4: Enrutar por complejidad (modelo rápido y, si falla, el elegido)
+            attempts = self.router.plan(query_analysis, model)
+            for position, (tier, attempt_model) in enumerate(attempts):
+                start = time.perf_counter()
+                if self.hedge_fanout > 1:
+                    result = await self._generate_hedged(attempt_model, generate, dry_run)
                 else:
-                    return {
-                        "success": False,
-                        "error": f"Error Ollama: {response.status_code}"
-                    }
+                    result = await generate(attempt_model)
+                result.setdefault("model_used", attempt_model)
+                self.router.record(tier, (time.perf_counter() - start) * 1000, result["success"])
+                result["tier"] = tier
+                
+                if result["success"] or position == len(attempts) - 1:
+                    return result
+                
+                self.router.record_escalation()
+                logger.info(f"↗️ [SQL-GEN] Escalando de {attempt_model} a {attempts[position + 1][1]}: {result['error']}")
         
+        except QueueFullError:
+            raise
         except Exception as e:
-            print(f"💥 [SQL-GEN] Error: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"💥 [SQL-GEN] Error: {str(e)}")
             return {
                 "success": False,
                 "error": f"Error generando SQL: {str(e)}"
             }
     
-    def _create_focused_sql_prompt(self,
+    async def _generate_with_model(self,
+                                   model: str,
+                                   message: str,
                                    schema: DatabaseSchema,
-                                   user_message: str,
                                    data_profile: Dict[str, Any],
                                    focused_context: Dict[str, Any],
                                    query_analysis: Dict[str, Any],
-                                   example_queries: List[str]) -> str:
-        """
-        🆕 Crear prompt FOCALIZADO con solo información relevante
-        """
+                                   example_queries: List[str],
+                                   prompt_assembler: PromptAssembler = None,
+                                   learned_session: Dict[str, Any] = None,
+                                   seed: int = None,
+                                   temperature: float = None,
+                                   priority: int = PRIORITY_INTERACTIVE,
+                                   mysql: bool = False) -> Dict[str, Any]:
+        """Construir el prompt para un modelo, llamar a Ollama y validar el SQL"""
+        # Ventana de contexto real del modelo (consultada una vez y cacheada)
+        model_info = await self.registry.get_info(model)
+        context_length = model_info.get("context_length")
         
-        prompt = f"""# 🎯 CONTEXTO FOCALIZADO PARA CONSULTA SQL
-
-Base de datos: **{schema.database_name}**
-Tablas en BD: {focused_context['total_tables_in_db']}
-Tablas relevantes para esta query: {focused_context['focused_table_count']}
-Complejidad: Nivel {query_analysis['complexity_level']}/5
-Tipo: {query_analysis['query_type']}
-
----
-
-## 📋 TABLAS RELEVANTES (Solo estas son importantes para esta consulta)
-
-"""
+        # Mensajes con prefijo estable (esquema) + pregunta al final
+        with metrics.stage("prompt_build"):
+            messages, prompt_stats = self._create_focused_sql_messages(
+                schema,
+                message,
+                data_profile,
+                focused_context,
+                query_analysis,
+                example_queries,
+                token_budget=token_budget_for_model(model, context_length),
+                prompt_assembler=prompt_assembler,
+                learned_session=learned_session
+            )
         
-        # Solo mostrar tablas focalizadas
-        for table in focused_context["tables"]:
-            prompt += f"\n### 🔹 TABLA: `{table.table_name}`\n"
-            
-            # Obtener perfil si existe
-            table_profile = None
-            if data_profile and "tables" in data_profile:
-                table_profile = data_profile["tables"].get(table.table_name, {})
+        dropped = prompt_stats["dropped"]
+        logger.info(f"📝 [SQL-GEN] Prompt: ~{prompt_stats['estimated_tokens']}/{prompt_stats['token_budget']} tokens, "
+                    f"prefijo estable ~{prompt_stats['prefix_tokens']} ({prompt_stats['prefix_mode']}) "
+                    f"(descartadas: {len(dropped['tables'])} tablas, "
+                    f"{len(dropped['columns'])} columnas, {dropped['value_lists']} listas de valores)")
+        
+        # Ajustar temperatura según complejidad (los candidatos extra del modo
+        # con cobertura usan una propia para no repetir la misma respuesta)
+        if temperature is None:
+            temperature = 0.05 if query_analysis['complexity_level'] <= 2 else 0.1
+        
+        num_ctx = self._request_num_ctx(model, prompt_stats["estimated_tokens"], context_length, learned_session)
+        prompt_stats["num_ctx"] = num_ctx
+        
+        await self.ensure_resident(model)
+        
+        options = {
+            "temperature": temperature,
+            "top_p": 0.8,
+            "top_k": 20,
+            "repeat_penalty": 1.1,
+            "num_ctx": num_ctx,
+            "num_predict": min(5000, max(num_ctx - prompt_stats["estimated_tokens"],
+                                         RESPONSE_TOKEN_RESERVE))
+        }
+        if seed is not None:
+            options["seed"] = seed
+        
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": False,
+            "keep_alive": self.keep_alive_for(model),
+            "options": options
+        }
+        if self.output_format == "json":
+            # Respuesta restringida a {"sql", "explanation"} (las instrucciones
+            # del prompt ya piden ese JSON)
+            payload["format"] = SQL_RESPONSE_SCHEMA
+        
+        # Preferir el host donde se precargó el prefijo aprendido (caché KV)
+        with metrics.stage("llm_generation"):
+            response, _ = await self.pool.request(
+                "POST",
+                "/api/chat",
+                model=model,
+                prefer=(learned_session or {}).get("prefill", {}).get("backend"),
+                priority=priority,
+                timeout=1000.0,
+                json=payload
+            )
+        
+        if response.status_code == 200:
+            result = response.json()
+            ai_response = result.get("message", {}).get("content", "")
+            prefill = self._track_prefill(model, messages[0]["content"], prompt_stats, result)
+            generation_stats.record(model, schema.database_name, result)
             
-            if table_profile and "row_count" in table_profile:
-                prompt += f"  📊 Registros: {table_profile['row_count']}\n"
+            # Un json.loads; los patrones regex quedan como respaldo
+            structured = self._parse_structured_response(ai_response) if self.output_format == "json" else None
+            if structured is not None:
+                sql_query, explanation = structured
+                extraction = "json"
+            else:
+                sql_query = self._extract_sql_query(ai_response)
+                explanation = self._extract_explanation(ai_response)
+                extraction = "regex"
+            prompt_stats["extraction"] = extraction
             
-            prompt += "\n**COLUMNAS:**\n"
+            if not sql_query:
+                return {
+                    "success": False,
+                    "error": "No se pudo extraer consulta SQL",
+                    "full_response": ai_response
+                }
             
-            # Resaltar columnas mencionadas en la query
-            mentioned_cols = query_analysis.get("mentioned_columns", {}).get(table.table_name, [])
+            # Validar SQL
+            validation_result = self._validate_sql_query(sql_query, schema, mysql=mysql)
+            if not validation_result["valid"]:
+                return {
+                    "success": False,
+                    "error": f"SQL inválido: {validation_result['error']}",
+                    "sql_query": sql_query
+                }
             
-            for col in table.columns:
-                col_name = col['name']
-                col_type = col['type']
-                
-                # Marcar si fue mencionada
-                mention_mark = " ⭐ [MENCIONADA]" if col_name.lower() in mentioned_cols else ""
-                
-                col_info = f"  • `{col_name}` ({col_type}){mention_mark}"
-                
-                if col_name in table.primary_keys:
-                    col_info += " 🔑 [PK]"
-                if not col['nullable']:
-                    col_info += " [NOT NULL]"
+            return {
+                "success": True,
+                "sql_query": sql_query,
+                "explanation": explanation,
+                "full_response": ai_response,
+                "analysis": query_analysis,
+                "prompt_stats": prompt_stats,
+                "prefill": prefill
+            }
+        else:
+            return {
+                "success": False,
+                "error": f"Error Ollama: {response.status_code}"
+            }
+    
+    # Temperatura de los candidatos extra sobre el mismo modelo
+    HEDGE_TEMPERATURE = 0.3
+    
+    def _request_num_ctx(self,
+                         model: str,
+                         prompt_tokens: int,
+                         context_length: int = None,
+                         learned_session: Dict[str, Any] = None) -> int:
+        """
+        num_ctx de una pregunta según el tamaño estimado de su prompt. Solo
+        sube el del modelo cargado (precarga o preguntas anteriores) cuando el
+        prompt no cabe, y nunca baja del num_ctx del prefijo aprendido:
+        cambiarlo obliga a Ollama a recargar el modelo.
+        """
+        num_ctx = num_ctx_for_prompt(
+            prompt_tokens, model, context_length,
+            floor=max(self._num_ctx.get(model, 0),
+                      (learned_session or {}).get("prefill", {}).get("num_ctx") or 0)
+        )
+        self._num_ctx[model] = num_ctx
+        return num_ctx
+    
+    def _hedge_candidates(self, model: str) -> List[Tuple[str, Optional[int], Optional[float]]]:
+        """
+        Candidatos del modo con cobertura, en orden de lanzamiento:
+        [(modelo, semilla, temperatura), ...]. El primero es la petición
+        normal; los demás alternan los modelos de OLLAMA_HEDGE_MODELS o,
+        si no hay, repiten el modelo con otra semilla.
+        """
+        candidates = [(model, None, None)]
+        alternatives = [m for m in self.hedge_models if m != model]
+        for index in range(1, self.hedge_fanout):
+            if alternatives:
+                candidates.append((alternatives[(index - 1) % len(alternatives)], None, None))
+            else:
+                candidates.append((model, index, self.HEDGE_TEMPERATURE))
+        return candidates
+    
+    async def _generate_hedged(self,
+                               model: str,
+                               generate: Callable[..., Awaitable[Dict[str, Any]]],
+                               dry_run: Callable[[str], Awaitable[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        Lanzar candidatos escalonados y devolver el primero válido.
+        
+        Se lanza un candidato; si en `hedge_delay` segundos no hay respuesta
+        válida se lanza el siguiente (o de inmediato si uno falla), hasta
+        `hedge_fanout`. Cada respuesta se valida al llegar (extracción,
+        validación y EXPLAIN) y, con la primera que pasa, se cancelan las
+        demás: httpx cierra la conexión y Ollama deja de generar.
+        """
+        candidates = self._hedge_candidates(model)
+        pending: Dict[asyncio.Task, Tuple[int, str]] = {}
+        launched = 0
+        last_result = {"success": False, "error": "Ningún candidato generó SQL"}
+        
+        def launch():
+            nonlocal launched
+            candidate_model, seed, temperature = candidates[launched]
+            # Los candidatos extra no se cuelan por delante de otras preguntas
+            priority = PRIORITY_INTERACTIVE if launched == 0 else PRIORITY_BACKGROUND
+            task = asyncio.create_task(generate(candidate_model, seed, temperature, priority))
+            pending[task] = (launched, candidate_model)
+            launched += 1
+            if launched > 1:
+                logger.info(f"🛡️ [SQL-GEN] Candidato {launched}/{len(candidates)}: {candidate_model}"
+                            + (f" (semilla {seed})" if seed is not None else ""))
+        
+        launch()
+        try:
+            while pending:
+                timeout = self.hedge_delay if launched < len(candidates) else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
                 
-                prompt += col_info + "\n"
+                if not done:
+                    # Sin respuesta a tiempo: lanzar otro candidato en paralelo
+                    launch()
+                    continue
                 
-                # VALORES PERMITIDOS del perfil
-                if table_profile and "columns_profile" in table_profile:
-                    col_profile = table_profile["columns_profile"].get(col_name)
-                    if col_profile and col_profile.get("unique_values"):
-                        values = col_profile["unique_values"]
-                        formatted = [f"'{v}'" if isinstance(v, str) else str(v) for v in values]
-                        prompt += f"    ⚠️  VALORES PERMITIDOS: {', '.join(formatted)}\n"
-            
-            prompt += "\n"
-        
-        # MAPA DE RELACIONES
-        if focused_context["relationships"]:
-            prompt += "\n## 🔗 RELACIONES (Usa estas para JOINs)\n\n"
-            for rel in focused_context["relationships"]:
-                prompt += f"  • `{rel['from_table']}.{rel['from_column']}` → `{rel['to_table']}.{rel['to_column']}`\n"
-            prompt += "\n"
-        
-        # EJEMPLOS CONTEXTUALES
-        if example_queries:
-            prompt += "\n## 💡 EJEMPLOS DE QUERIES SIMILARES\n\n"
-            for i, example in enumerate(example_queries, 1):
-                prompt += f"{i}. ```sql\n{example}\n```\n\n"
-        
-        # HINTS ESPECÍFICOS
-        hints = query_analysis.get("filter_hints", {})
-        if hints.get("exact_values") or hints.get("boolean_keywords"):
-            prompt += "\n## 🎯 HINTS PARA ESTA CONSULTA\n\n"
-            
-            if hints.get("exact_values"):
-                prompt += f"  • Valores exactos mencionados: {', '.join([f'\'{v}\'' for v in hints['exact_values']])}\n"
-            
-            if hints.get("boolean_keywords"):
-                for keyword, value in hints["boolean_keywords"]:
-                    prompt += f"  • '{keyword}' probablemente significa: {value}\n"
+                for task in done:
+                    index, candidate_model = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        result = {"success": False, "error": f"Error Ollama: {str(e)}"}
+                    
+                    if result["success"] and dry_run is not None:
+                        check = await dry_run(result["sql_query"])
+                        if not check["valid"]:
+                            result = {
+                                "success": False,
+                                "error": check["error"],
+                                "sql_query": result["sql_query"]
+                            }
+                    
+                    if result["success"]:
+                        result["model_used"] = candidate_model
+                        result["hedge"] = {"candidates_launched": launched, "winner": index}
+                        if launched > 1:
+                            logger.info(f"🏁 [SQL-GEN] Gana el candidato {index + 1} ({candidate_model}), "
+                                        f"se cancelan {len(pending)}")
+                        return result
+                    
+                    logger.warning(f"❌ [SQL-GEN] Candidato {index + 1} ({candidate_model}) descartado: {result['error']}")
+                    last_result = result
+                    # Sustituir el candidato fallido sin esperar al retardo
+                    if launched < len(candidates):
+                        launch()
             
-            prompt += "\n"
+            last_result["hedge"] = {"candidates_launched": launched, "winner": None}
+            return last_result
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+    
+    def _create_focused_sql_messages(self,
+                                     schema: DatabaseSchema,
+                                     user_message: str,
+                                     data_profile: Dict[str, Any],
+                                     focused_context: Dict[str, Any],
+                                     query_analysis: Dict[str, Any],
+                                     example_queries: List[str],
+                                     token_budget: int = None,
+                                     prompt_assembler: PromptAssembler = None,
+                                     learned_session: Dict[str, Any] = None) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+        """
+        Crear los mensajes de /api/chat: el esquema en un mensaje de sistema
+        determinista (prefijo estable que Ollama reutiliza de su caché KV) y
+        la parte propia de la pregunta en el mensaje de usuario. Con una
+        sesión aprendida se reenvía exactamente el prefijo ya precargado.
+        """
+        if prompt_assembler is None:
+            prompt_assembler = PromptAssembler(data_profile, output_format=self.output_format)
         
-        # PREGUNTA E INSTRUCCIONES
-        prompt += f"""
----
-
-## 🎯 PREGUNTA DEL USUARIO:
-**"{user_message}"**
-
----
-
-## 📝 INSTRUCCIONES CRÍTICAS:
-
-1. **USA SOLO LAS TABLAS MOSTRADAS ARRIBA** (no inventes nombres)
-2. **PARA JOINS**: Usa EXACTAMENTE las relaciones del mapa
-3. **PARA VALORES**: Si hay "VALORES PERMITIDOS", usa esos exactos
-4. **COLUMNAS MENCIONADAS**: Prioriza las marcadas con ⭐
-5. **GENERA SOLO SELECT**: Nunca INSERT/UPDATE/DELETE
-
-## 🎯 FORMATO DE RESPUESTA (OBLIGATORIO):
-
-SQL: [tu consulta SELECT aquí]
-EXPLICACIÓN: [explicación breve]
-
-## 🚀 GENERA TU RESPUESTA AHORA:
-"""
+        return prompt_assembler.assemble_chat(
+            schema.database_name,
+            user_message,
+            focused_context,
+            query_analysis,
+            example_queries,
+            token_budget or token_budget_for_model(None),
+            schema_tables=schema.tables,
+            learned_session=learned_session
+        )
+    
+    async def learn_schema(self, model: str, system_prompt: str) -> Dict[str, Any]:
+        """
+        Precargar el prefijo del esquema en el modelo: Ollama procesa el
+        mensaje de sistema una vez y lo conserva en su caché KV mientras el
+        modelo siga cargado (keep_alive) en ese host. La respuesta se limita
+        a unos tokens.
+        El num_ctx deja sitio para la parte de cada pregunta, de modo que las
+        consultas posteriores usen el mismo valor y no recarguen el modelo.
+        """
+        model_info = await self.registry.get_info(model)
+        num_ctx = num_ctx_for_prompt(
+            int(estimate_tokens(system_prompt) / PromptAssembler.PREFIX_BUDGET_SHARE),
+            model, model_info.get("context_length")
+        )
+        self._num_ctx[model] = num_ctx
+        await self.ensure_resident(model)
+        response, backend = await self.pool.request(
+            "POST",
+            "/api/chat",
+            model=model,
+            # Detrás de las preguntas interactivas
+            priority=PRIORITY_BACKGROUND,
+            timeout=1000.0,
+            json={
+                "model": model,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": "Confirma en una frase que conoces el esquema."}
+                ],
+                "stream": False,
+                "keep_alive": self.keep_alive_for(model),
+                "options": {"temperature": 0.1, "num_predict": 48, "num_ctx": num_ctx}
+            }
+        )
         
-        return prompt
+        if response.status_code != 200:
+            return {"success": False, "error": f"Error Ollama: {response.status_code}"}
+        
+        result = response.json()
+        self._last_prefix[model] = hashlib.sha1(system_prompt.encode()).hexdigest()
+        return {
+            "success": True,
+            "response": result.get("message", {}).get("content", ""),
+            "prefill": {
+                "prompt_eval_count": result.get("prompt_eval_count", 0),
+                "prompt_eval_ms": round(result.get("prompt_eval_duration", 0) / 1e6, 1),
+                "load_ms": round(result.get("load_duration", 0) / 1e6, 1),
+                "num_ctx": num_ctx,
+                # Las preguntas de esta sesión prefieren el host con el prefijo en caché
+                "backend": backend
+            }
+        }
+    
+    def _track_prefill(self,
+                       model: str,
+                       system_prompt: str,
+                       prompt_stats: Dict[str, Any],
+                       result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Registrar cuánto del prompt tuvo que procesar Ollama. `prompt_eval_count`
+        solo cuenta los tokens evaluados, así que cuando el prefijo se reutiliza
+        de la caché KV queda muy por debajo del tamaño estimado del prompt.
+        """
+        prefix_hash = hashlib.sha1(system_prompt.encode()).hexdigest()
+        same_prefix = self._last_prefix.get(model) == prefix_hash
+        self._last_prefix[model] = prefix_hash
+        
+        evaluated = result.get("prompt_eval_count", 0)
+        estimated = prompt_stats["estimated_tokens"]
+        prefill = {
+            "prompt_eval_count": evaluated,
+            "prompt_eval_ms": round(result.get("prompt_eval_duration", 0) / 1e6, 1),
+            "estimated_prompt_tokens": estimated,
+            "same_prefix": same_prefix,
+            "reused_ratio": round(max(0.0, 1 - evaluated / estimated), 3) if estimated else 0.0
+        }
+        logger.info(f"⚡ [SQL-GEN] Prefill: {evaluated} tokens evaluados de ~{estimated} "
+                    f"({prefill['prompt_eval_ms']} ms, prefijo {'repetido' if same_prefix else 'nuevo'}, "
+                    f"~{prefill['reused_ratio']:.0%} reutilizado)")
+        return prefill
     
     def _create_schema_context(self, schema: DatabaseSchema) -> str:
         """Crear contexto del esquema de la base de datos"""
@@ -339,9 +773,25 @@ EXPLICACIÓN: [explicación detallada de la consulta]
 
 ## RESPUESTA:"""
     
+    @staticmethod
+    def _parse_structured_response(response: str) -> Optional[Tuple[str, Optional[str]]]:
+        """(sql, explicación) de una respuesta con format JSON, o None si no lo es"""
+        try:
+            data = json.loads(response, strict=False)
+        except ValueError:
+            return None
+        if not isinstance(data, dict) or not isinstance(data.get("sql"), str):
+            return None
+        
+        sql = CODE_FENCE.sub("", data["sql"]).strip()
+        if not sql:
+            return None
+        explanation = data.get("explanation")
+        return sql, explanation.strip() if isinstance(explanation, str) and explanation.strip() else None
+    
     def _extract_sql_query(self, response: str) -> Optional[str]:
         """Extraer consulta SQL de la respuesta de la IA con múltiples patrones"""
-        print(f"🔍 [DEBUG] Extrayendo SQL de respuesta de {len(response)} caracteres")
+        logger.debug(f"🔍 [DEBUG] Extrayendo SQL de respuesta de {len(response)} caracteres")
         
         patterns = [
             # Patrón 1: SQL: seguido de consulta hasta nueva línea o EXPLICACIÓN
@@ -368,11 +818,11 @@ EXPLICACIÓN: [explicación detallada de la consulta]
                     
                     # Validar que sea una consulta SQL válida
                     if sql and sql.upper().startswith('SELECT') and len(sql) > 10:
-                        print(f"✅ [DEBUG] SQL encontrado con patrón {i}: {sql[:100]}...")
+                        logger.debug(f"✅ [DEBUG] SQL encontrado con patrón {i}: {sql[:100]}...")
                         return sql
         
-        print(f"❌ [DEBUG] No se encontró SQL válido en la respuesta")
-        print(f"📄 [DEBUG] Respuesta completa: {response}")
+        logger.debug(f"❌ [DEBUG] No se encontró SQL válido en la respuesta")
+        logger.debug(f"📄 [DEBUG] Respuesta completa: {response}")
         return None
     
     async def _create_enhanced_context(self, schema: DatabaseSchema, sample_data: Dict[str, list] = None) -> str:
@@ -572,31 +1022,43 @@ EXPLICACIÓN: [explica brevemente qué hace la consulta]
         
         return prompt
     
-    def _validate_sql_query(self, sql_query: str, schema: DatabaseSchema) -> Dict[str, Any]:
-        """Validar consulta SQL contra el esquema"""
+    def _schema_columns(self, schema: DatabaseSchema) -> Dict[str, set]:
+        """{tabla: {columnas}} en minúsculas, reutilizado mientras el esquema sea el mismo objeto"""
+        cached_schema, lookup = self._schema_lookup
+        if cached_schema is not schema:
+            lookup = {
+                table.table_name.lower(): {col["name"].lower() for col in table.columns}
+                for table in schema.tables
+            }
+            self._schema_lookup = (schema, lookup)
+        return lookup
+    
+    def _validate_sql_query(self, sql_query: str, schema: DatabaseSchema, mysql: bool = False) -> Dict[str, Any]:
+        """Validar consulta SQL contra el esquema (con el léxico del motor: `mysql`)"""
         if not sql_query:
             return {"valid": False, "error": "Consulta SQL vacía"}
         
-        sql_upper = sql_query.upper().strip()
+        # Una pasada: tipo de sentencia, palabras prohibidas, tablas y columnas
+        analysis = analyze_sql(sql_query, mysql=mysql)
         
-        # Verificar que sea SELECT
-        if not sql_upper.startswith('SELECT'):
+        # Verificar que sea SELECT (también WITH ... SELECT) y una sola sentencia
+        if analysis["main_statement"] != "SELECT":
             return {"valid": False, "error": "Solo se permiten consultas SELECT"}
+        if analysis["statement_count"] > 1:
+            return {"valid": False, "error": "Solo se permite una sentencia"}
+        
+        # Palabras prohibidas (fuera de literales y comentarios)
+        if analysis["forbidden"]:
+            return {"valid": False, "error": f"Operación prohibida: {', '.join(sorted(analysis['forbidden']))}"}
         
-        # Verificar palabras prohibidas usando word boundaries (palabras completas)
-        forbidden = ['INSERT', 'UPDATE', 'DELETE', 'DROP', 'CREATE', 'ALTER', 'TRUNCATE']
-        for word in forbidden:
-            # Usar regex para buscar palabra completa, no subcadena
-            # Esto evita que "created_at" active el filtro "CREATE"
-            pattern = r'\b' + word + r'\b'
-            if re.search(pattern, sql_upper):
-                return {"valid": False, "error": f"Operación prohibida: {word}"}
-        
-        # Verificar que las tablas existen
-        table_names = [table.table_name for table in schema.tables]
-        for table_name in table_names:
-            if f' {table_name.upper()}' in sql_upper or f' {table_name.upper()} ' in sql_upper:
-                continue  # Tabla encontrada
+        # Verificar que las tablas y columnas cualificadas existen
+        lookup = self._schema_columns(schema)
+        for table_name in sorted(analysis["tables"]):
+            if table_name not in lookup:
+                return {"valid": False, "error": f"Tabla inexistente: {table_name}"}
+        for table_name, column in sorted(analysis["columns"]):
+            if column != "*" and table_name in lookup and column not in lookup[table_name]:
+                return {"valid": False, "error": f"Columna inexistente: {table_name}.{column}"}
         
         return {"valid": True, "error": None}
     
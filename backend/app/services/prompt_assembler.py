@@ -0,0 +1,873 @@
+"""
+Ensamblador de prompts con presupuesto de tokens.
+Las tablas, columnas y listas de valores del contexto focalizado reciben un
+score de relevancia y se incluyen de mayor a menor score hasta llenar el
+presupuesto del modelo.
+"""
+from abc import ABC, abstractmethod
+from typing import Dict, List, Any, Tuple, Set
+import math
+import os
+
+
+# Ventana de contexto aproximada por familia de modelo (prefijo del nombre)
+MODEL_CONTEXT_TOKENS = {
+    "deepseek-coder": 16384,
+    "deepseek-r1": 32768,
+    "qwen2.5": 32768,
+    "gemma2": 8192,
+    "llama3": 8192,
+    "mistral": 32768,
+    "codellama": 16384,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+
+# Tokens reservados para la respuesta del modelo
+RESPONSE_TOKEN_RESERVE = 1024
+
+# Caracteres por token (estimación conservadora para español + SQL)
+CHARS_PER_TOKEN = 3.5
+
+# Aunque el modelo admita ventanas mayores (p.ej. 128k), en CPU no compensa
+MAX_CONTEXT_TOKENS = 32768
+
+# num_ctx mínimo y margen sobre la estimación de tokens del prompt
+MIN_NUM_CTX = 2048
+NUM_CTX_MARGIN = 1.1
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimar el número de tokens de un texto"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def context_tokens_for_model(model: str, context_length: int = None) -> int:
+    """
+    Ventana de contexto utilizable de un modelo: la informada por Ollama
+    (/api/show) si se conoce, o la de su familia; limitada a MAX_CONTEXT_TOKENS.
+    """
+    if context_length:
+        return min(context_length, MAX_CONTEXT_TOKENS)
+
+    model_name = (model or "").lower()
+    for family, tokens in MODEL_CONTEXT_TOKENS.items():
+        if model_name.startswith(family):
+            return tokens
+    return DEFAULT_CONTEXT_TOKENS
+
+
+def token_budget_for_model(model: str, context_length: int = None) -> int:
+    """
+    Presupuesto de tokens del prompt para un modelo: su ventana de contexto
+    menos la reserva para la respuesta y el margen de num_ctx_for_prompt,
+    de modo que un prompt dentro del presupuesto nunca pida un num_ctx mayor
+    que la ventana (Ollama truncaría el principio del prompt).
+    PROMPT_TOKEN_BUDGET lo sobrescribe.
+    """
+    override = os.getenv("PROMPT_TOKEN_BUDGET")
+    if override:
+        return int(override)
+
+    window = context_tokens_for_model(model, context_length)
+    return max(int((window - RESPONSE_TOKEN_RESERVE) / NUM_CTX_MARGIN), 512)
+
+
+def num_ctx_for_prompt(prompt_tokens: int, model: str, context_length: int = None, floor: int = None) -> int:
+    """
+    num_ctx para una petición: tokens estimados del prompt (con margen) más la
+    reserva de respuesta, redondeado a potencia de 2 para que prompts de
+    tamaño parecido compartan valor (cambiar num_ctx obliga a Ollama a
+    recargar el modelo y perder su caché KV). Nunca supera la ventana del
+    modelo ni baja de `floor` (p.ej. el num_ctx con el que se precargó un
+    prefijo aprendido).
+    """
+    needed = int(prompt_tokens * NUM_CTX_MARGIN) + RESPONSE_TOKEN_RESERVE
+    num_ctx = max(MIN_NUM_CTX, floor or 0)
+    while num_ctx < needed:
+        num_ctx *= 2
+    return min(num_ctx, context_tokens_for_model(model, context_length))
+
+
+class SchemaDialect(ABC):
+    """
+    Formato de serialización del esquema en el prompt (clase base abstracta).
+    Cada tabla se escribe como `header + separator.join(columnas) + footer`.
+    """
+
+    def __init__(self, name: str, mention_mark: str, max_values: int = None):
+        self.name = name
+        self.mention_mark = mention_mark
+        self.mention_mark_tokens = estimate_tokens(mention_mark)
+        self.max_values = max_values
+
+    @abstractmethod
+    def table_parts(self, table_name: str, table_profile: Dict[str, Any]) -> Tuple[str, str, str]:
+        """(header, separator, footer) de una tabla"""
+
+    @abstractmethod
+    def column_parts(self, col: Dict[str, Any], flags: List[str]) -> Tuple[str, str]:
+        """(prefix, suffix) de una columna; la marca de mención va entre ambos"""
+
+    @abstractmethod
+    def values(self, values: List[Any]) -> str:
+        """Lista de valores permitidos de una columna"""
+
+    @abstractmethod
+    def relationship(self, rel: Dict[str, str]) -> str:
+        """Línea de una relación FK (from_table.from_column -> to_table.to_column)"""
+
+    @abstractmethod
+    def example(self, sql: str) -> str:
+        """Consulta de ejemplo"""
+
+    def format_values(self, values: List[Any]) -> str:
+        shown = values if self.max_values is None else values[:self.max_values]
+        formatted = ", ".join(f"'{v}'" if isinstance(v, str) else str(v) for v in shown)
+        if len(shown) < len(values):
+            formatted += ", ..."
+        return formatted
+
+
+class MarkdownDialect(SchemaDialect):
+    """Formato original: encabezados con emojis y una viñeta por columna"""
+
+    tables_title = "## 📋 TABLAS RELEVANTES (Solo estas son importantes para esta consulta)\n\n"
+    relationships_title = "\n## 🔗 RELACIONES (Usa estas para JOINs)\n\n"
+    examples_title = "\n## 💡 EJEMPLOS DE QUERIES SIMILARES\n\n"
+    values_instruction = 'Si hay "VALORES PERMITIDOS", usa esos exactos'
+
+    def __init__(self):
+        super().__init__("markdown", " ⭐ [MENCIONADA]")
+
+    def table_parts(self, table_name, table_profile):
+        header = f"\n### 🔹 TABLA: `{table_name}`\n"
+        if "row_count" in table_profile:
+            header += f"  📊 Registros: {table_profile['row_count']}\n"
+        header += "\n**COLUMNAS:**\n"
+        return header, "", "\n"
+
+    def column_parts(self, col, flags):
+        labels = {"pk": " 🔑 [PK]", "fk": " [FK]", "nn": " [NOT NULL]"}
+        return f"  • `{col['name']}` ({col['type']})", "".join(labels[f] for f in flags) + "\n"
+
+    def values(self, values):
+        return f"    ⚠️  VALORES PERMITIDOS: {self.format_values(values)}\n"
+
+    def relationship(self, rel):
+        return f"  • `{rel['from_table']}.{rel['from_column']}` → `{rel['to_table']}.{rel['to_column']}`\n"
+
+    def example(self, sql):
+        return f"```sql\n{sql}\n```\n\n"
+
+
+class CompactDialect(SchemaDialect):
+    """
+    Formato compacto tipo DDL: una línea por tabla
+    `tabla(col tipo PK, col tipo NN IN('a','b'), ...)`, FKs como flechas y
+    listas de valores cortas. Usa bastantes menos tokens por columna.
+    """
+
+    tables_title = ("## TABLAS\nFormato: tabla(columna tipo [PK] [FK] [NN] [IN(valores permitidos)]); "
+                    "* = columna mencionada\n\n")
+    relationships_title = "\n## RELACIONES (JOINs)\n"
+    examples_title = "\n## EJEMPLOS\n"
+    values_instruction = "Si la columna tiene IN(...), usa esos valores exactos"
+
+    # Tipos largos más comunes abreviados
+    TYPE_ALIASES = {
+        "character varying": "varchar",
+        "timestamp without time zone": "timestamp",
+        "timestamp with time zone": "timestamptz",
+        "double precision": "double",
+        "integer": "int",
+        "boolean": "bool",
+    }
+
+    def __init__(self, max_values: int = 10):
+        super().__init__("compact", "*", max_values)
+
+    def table_parts(self, table_name, table_profile):
+        footer = ")"
+        if "row_count" in table_profile:
+            footer += f" -- {table_profile['row_count']} filas"
+        return f"{table_name}(", ", ", footer + "\n"
+
+    def column_parts(self, col, flags):
+        col_type = self.TYPE_ALIASES.get(col["type"].lower(), col["type"])
+        return f"{col['name']} {col_type}", "".join(f" {f.upper()}" for f in flags)
+
+    def values(self, values):
+        return f" IN({self.format_values(values)})"
+
+    def relationship(self, rel):
+        return f"{rel['from_table']}.{rel['from_column']} -> {rel['to_table']}.{rel['to_column']}\n"
+
+    def example(self, sql):
+        return " ".join(sql.split()) + "\n"
+
+
+SCHEMA_DIALECTS = {
+    "markdown": MarkdownDialect(),
+    "compact": CompactDialect(),
+}
+DEFAULT_SCHEMA_FORMAT = "markdown"
+
+
+def get_dialect(schema_format: str = None) -> SchemaDialect:
+    """
+    Dialecto de serialización del esquema. Si no se indica, se usa
+    PROMPT_SCHEMA_FORMAT ('markdown' o 'compact').
+    """
+    name = (schema_format or os.getenv("PROMPT_SCHEMA_FORMAT") or DEFAULT_SCHEMA_FORMAT).lower()
+    if name not in SCHEMA_DIALECTS:
+        raise ValueError(f"Formato de esquema desconocido: {name} "
+                         f"(opciones: {', '.join(SCHEMA_DIALECTS)})")
+    return SCHEMA_DIALECTS[name]
+
+
+# Formato de la respuesta del modelo: instrucciones del mensaje de sistema y
+# recordatorio al final del mensaje de usuario
+RESPONSE_FORMATS = {
+    "json": (
+        'Responde solo con JSON: {"sql": "<consulta SELECT>", "explanation": "<explicación breve>"}\n',
+        'solo JSON {"sql", "explanation"}'
+    ),
+    "text": (
+        "SQL: [tu consulta SELECT aquí]\nEXPLICACIÓN: [explicación breve]\n",
+        "formato SQL: / EXPLICACIÓN:"
+    ),
+}
+DEFAULT_OUTPUT_FORMAT = "json"
+
+
+def get_output_format(output_format: str = None) -> str:
+    """
+    Formato de la respuesta del modelo. Si no se indica, se usa
+    OLLAMA_OUTPUT_FORMAT ('json' o 'text').
+    """
+    name = (output_format or os.getenv("OLLAMA_OUTPUT_FORMAT") or DEFAULT_OUTPUT_FORMAT).lower()
+    if name not in RESPONSE_FORMATS:
+        raise ValueError(f"Formato de respuesta desconocido: {name} "
+                         f"(opciones: {', '.join(RESPONSE_FORMATS)})")
+    return name
+
+
+class PromptItem:
+    """
+    Elemento opcional del prompt con su score y los elementos de los que
+    depende. `bundle` son los ids que entran junto con él (sus tokens ya
+    están incluidos en `tokens`).
+    """
+
+    __slots__ = ("kind", "key", "id", "text", "score", "parents", "tokens", "bundle")
+
+    def __init__(self, kind: str, key: str, text: str, score: float,
+                 parents: Tuple[str, ...] = (), tokens: int = None, bundle: Tuple[str, ...] = ()):
+        self.kind = kind
+        self.key = key
+        self.id = f"{kind}:{key}"
+        self.text = text
+        self.score = score
+        self.parents = parents
+        self.tokens = estimate_tokens(text) if tokens is None else tokens
+        self.bundle = bundle
+
+
+class ColumnFragment:
+    """Línea pre-renderizada de una columna (y su lista de valores permitidos)"""
+
+    __slots__ = ("name", "name_lower", "key", "is_key", "prefix", "suffix", "line", "tokens",
+                 "values_text", "values_tokens")
+
+    def __init__(self, name: str, key: str, is_key: bool, prefix: str, suffix: str, values_text: str,
+                 separator: str = ""):
+        self.name = name
+        self.name_lower = name.lower()
+        self.key = key
+        self.is_key = is_key
+        self.prefix = prefix
+        self.suffix = suffix
+        self.line = prefix + suffix
+        self.tokens = estimate_tokens(self.line + separator)
+        self.values_text = values_text
+        self.values_tokens = estimate_tokens(values_text)
+
+    def marked_line(self, mark: str) -> str:
+        """Línea con una marca por petición (p.ej. ⭐) entre el tipo y las restricciones"""
+        return self.prefix + mark + self.suffix
+
+
+class TableFragment:
+    """Bloque pre-renderizado de una tabla: encabezado + columnas + cierre"""
+
+    __slots__ = ("key", "header", "separator", "footer", "header_tokens", "columns", "total_tokens")
+
+    def __init__(self, key: str, header: str, columns: List[ColumnFragment],
+                 separator: str = "", footer: str = ""):
+        self.key = key
+        self.header = header
+        self.separator = separator
+        self.footer = footer
+        self.header_tokens = estimate_tokens(header + footer)
+        self.columns = columns
+        self.total_tokens = self.header_tokens + sum(c.tokens + c.values_tokens for c in columns)
+
+    def join(self, columns: List[str]) -> str:
+        """Unir las columnas (ya renderizadas) de la tabla"""
+        return self.header + self.separator.join(columns) + self.footer
+
+
+class PromptAssembler:
+    """
+    Construye el prompt focalizado respetando un presupuesto de tokens.
+
+    Las partes fijas (encabezado, hints, pregunta e instrucciones) siempre se
+    incluyen y se descuentan del presupuesto antes de elegir. El resto se
+    llena de forma voraz por score: primero cada tabla junto con sus columnas
+    mencionadas, PKs y FKs, luego relaciones, listas de valores de esas
+    columnas, el resto de columnas y al final los ejemplos con lo que sobre.
+    """
+
+    # Score base por tipo de elemento (se suma la relevancia de la tabla, 0-10)
+    SCORE_TABLE = 100
+    SCORE_MENTIONED_COLUMN = 90
+    SCORE_KEY_COLUMN = 80
+    SCORE_MENTIONED_VALUES = 75
+    SCORE_RELATIONSHIP = 70
+    SCORE_COLUMN = 50
+    SCORE_VALUES = 40
+    SCORE_EXAMPLE = 30
+
+    # Fracción del presupuesto que puede ocupar el prefijo aprendido
+    PREFIX_BUDGET_SHARE = 0.6
+
+    def __init__(self, data_profile: Dict[str, Any] = None, schema_format: str = None,
+                 output_format: str = None):
+        """
+        Se crea una instancia por versión de esquema/perfil (se guarda en el
+        caché de contexto) para que los fragmentos por tabla se rendericen
+        una sola vez y se reutilicen entre peticiones. Las instrucciones de
+        formato de respuesta siguen `output_format` (ver get_output_format).
+        """
+        self.data_profile = data_profile
+        self.dialect = get_dialect(schema_format)
+        self.output_format = get_output_format(output_format)
+        self._fragments: Dict[str, TableFragment] = {}
+        self._system_prompt: str = None
+
+    def assemble_chat(self,
+                      database_name: str,
+                      user_message: str,
+                      focused_context: Dict[str, Any],
+                      query_analysis: Dict[str, Any],
+                      example_queries: List[str],
+                      token_budget: int,
+                      schema_tables: List = None,
+                      learned_session: Dict[str, Any] = None) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+        """
+        Ensamblar los mensajes para /api/chat con un prefijo estable.
+
+        El mensaje de sistema contiene solo el esquema (sin marcas por
+        pregunta) y las instrucciones fijas, en orden determinista, para que
+        Ollama reutilice su caché KV entre preguntas sobre la misma base. Si
+        el esquema completo (`schema_tables`) cabe en el presupuesto se usa
+        siempre el mismo mensaje de sistema; si no, las tablas focalizadas
+        ordenadas por nombre. Todo lo que depende de la pregunta (análisis,
+        columnas mencionadas, hints, ejemplos y la pregunta) va al final, en
+        el mensaje de usuario. La parte fija del mensaje de usuario se
+        descuenta del presupuesto antes de elegir el esquema, y los ejemplos
+        solo entran en lo que queda.
+
+        Con una sesión aprendida (ver learned_system_prompt) se reenvía su
+        mensaje de sistema tal cual y las tablas focalizadas que no cubre se
+        agregan al mensaje de usuario.
+        """
+        budget = token_budget - estimate_tokens(
+            self._render_user_turn(focused_context, query_analysis, "", user_message)
+        )
+        extra_tables = ""
+
+        if learned_session is not None and estimate_tokens(learned_session["system_prompt"]) <= budget:
+            system_content, prefix_mode = learned_session["system_prompt"], "learned"
+            extra_tables, dropped = self._render_uncovered_tables(
+                focused_context, query_analysis, learned_session["covered_tables"],
+                budget - estimate_tokens(system_content)
+            )
+        elif schema_tables and estimate_tokens(self._full_system_prompt(database_name, schema_tables)) <= budget:
+            system_content = self._full_system_prompt(database_name, schema_tables)
+            dropped, prefix_mode = [], "full_schema"
+        else:
+            fragments = [self.get_fragment(table) for table in focused_context["tables"]]
+            relevance = self._table_relevance(fragments)
+            fragments.sort(key=lambda f: f.key)
+            header = self._render_system_header(database_name, focused_context["total_tables_in_db"])
+            footer = self._render_system_footer()
+            body, dropped = self._render_schema(
+                fragments,
+                sorted(focused_context["relationships"], key=self._relationship_key),
+                query_analysis.get("mentioned_columns", {}),
+                relevance,
+                budget - estimate_tokens(header) - estimate_tokens(footer),
+                mark=False
+            )
+            system_content = "".join([header] + body + [footer])
+            prefix_mode = "focused"
+
+        # Los ejemplos solo usan lo que dejó libre el esquema
+        examples, dropped_examples = self._render_examples(
+            example_queries, budget - estimate_tokens(system_content) - estimate_tokens(extra_tables)
+        )
+        user_content = extra_tables + self._render_user_turn(focused_context, query_analysis, examples, user_message)
+        return self._chat_result(system_content, user_content, token_budget, dropped + dropped_examples, prefix_mode)
+
+    def _chat_result(self,
+                     system_content: str,
+                     user_content: str,
+                     token_budget: int,
+                     dropped: List[PromptItem],
+                     prefix_mode: str) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+        messages = [
+            {"role": "system", "content": system_content},
+            {"role": "user", "content": user_content},
+        ]
+        prefix_tokens = estimate_tokens(system_content)
+        stats = self._stats(token_budget, prefix_tokens + estimate_tokens(user_content), dropped)
+        stats["prefix_mode"] = prefix_mode
+        stats["prefix_tokens"] = prefix_tokens
+        return messages, stats
+
+    def learned_system_prompt(self,
+                              database_name: str,
+                              schema_tables: List,
+                              token_budget: int) -> Tuple[str, Set[str]]:
+        """
+        Mensaje de sistema para precargar en el modelo (/learn-database).
+        Si el esquema completo no cabe en PREFIX_BUDGET_SHARE del presupuesto
+        se incluyen tablas completas priorizando las más referenciadas por
+        FKs (las relaciones pueden exceder un poco esa fracción). Devuelve
+        (mensaje, tablas incluidas).
+        """
+        full_system = self._full_system_prompt(database_name, schema_tables)
+        prefix_budget = int(token_budget * self.PREFIX_BUDGET_SHARE)
+        if estimate_tokens(full_system) <= prefix_budget:
+            return full_system, {table.table_name.lower() for table in schema_tables}
+
+        # Tablas completas, de la más referenciada por FKs a la menos
+        references: Dict[str, int] = {}
+        for table in schema_tables:
+            for fk in table.foreign_keys:
+                target = fk["referenced_table"].lower()
+                references[target] = references.get(target, 0) + 1
+
+        header = self._render_system_header(database_name, len(schema_tables))
+        footer = self._render_system_footer()
+        remaining = prefix_budget - estimate_tokens(header) - estimate_tokens(footer)
+        fragments = []
+        for fragment in sorted((self.get_fragment(table) for table in schema_tables),
+                               key=lambda f: (-references.get(f.key, 0), f.key)):
+            if fragment.total_tokens <= remaining:
+                fragments.append(fragment)
+                remaining -= fragment.total_tokens
+
+        covered = {f.key for f in fragments}
+        relationships = [
+            rel for rel in self._schema_relationships(schema_tables)
+            if rel["from_table"].lower() in covered and rel["to_table"].lower() in covered
+        ]
+        body, _ = self._render_schema(
+            sorted(fragments, key=lambda f: f.key),
+            sorted(relationships, key=self._relationship_key),
+            {}, {}, math.inf
+        )
+        return "".join([header] + body + [footer]), covered
+
+    def _render_uncovered_tables(self,
+                                 focused_context: Dict[str, Any],
+                                 query_analysis: Dict[str, Any],
+                                 covered_tables: Set[str],
+                                 budget: int) -> Tuple[str, List[PromptItem]]:
+        """Tablas focalizadas que no están en el prefijo aprendido"""
+        fragments = [self.get_fragment(table) for table in focused_context["tables"]]
+        relevance = self._table_relevance(fragments)
+        fragments = [f for f in fragments if f.key not in covered_tables]
+        if not fragments:
+            return "", []
+
+        title = "## TABLAS ADICIONALES PARA ESTA PREGUNTA\n"
+        body, dropped = self._render_schema(
+            fragments,
+            [],
+            query_analysis.get("mentioned_columns", {}),
+            relevance,
+            budget - estimate_tokens(title + "\n")
+        )
+        if not body:
+            return "", dropped
+        return "".join([title] + body) + "\n", dropped
+
+    def _full_system_prompt(self, database_name: str, schema_tables: List) -> str:
+        """Mensaje de sistema con el esquema completo (se renderiza una vez)"""
+        if self._system_prompt is None:
+            fragments = [self.get_fragment(table) for table in schema_tables]
+            relationships = sorted(self._schema_relationships(schema_tables), key=self._relationship_key)
+            body, _ = self._render_schema(fragments, relationships, {}, {}, math.inf)
+            self._system_prompt = "".join(
+                [self._render_system_header(database_name, len(schema_tables))] + body + [self._render_system_footer()]
+            )
+        return self._system_prompt
+
+    @staticmethod
+    def _schema_relationships(schema_tables: List) -> List[Dict[str, str]]:
+        return [
+            {
+                "from_table": table.table_name,
+                "from_column": fk["column"],
+                "to_table": fk["referenced_table"],
+                "to_column": fk["referenced_column"]
+            }
+            for table in schema_tables
+            for fk in table.foreign_keys
+        ]
+
+    @staticmethod
+    def _relationship_key(rel: Dict[str, str]) -> Tuple[str, str]:
+        return rel["from_table"].lower(), rel["from_column"]
+
+    def _render_schema(self,
+                       fragments: List[TableFragment],
+                       relationships: List[Dict[str, str]],
+                       mentioned: Dict[str, List[str]],
+                       relevance: Dict[str, float],
+                       budget: int,
+                       mark: bool = True) -> Tuple[List[str], List[PromptItem]]:
+        """
+        Renderizar tablas y relaciones dentro del presupuesto (incluido el
+        título de las relaciones). Devuelve (partes del texto, elementos
+        descartados). Con mark=False las columnas mencionadas conservan su
+        prioridad pero no llevan marca.
+        """
+        extra_items = self._build_relationship_items(relationships, relevance)
+        marked = mentioned if mark else {}
+        if extra_items:
+            budget -= estimate_tokens(self.dialect.relationships_title + "\n")
+
+        full_tokens = (
+            sum(f.total_tokens for f in fragments)
+            + sum(len(marked.get(f.key, ())) for f in fragments) * self.dialect.mention_mark_tokens
+            + sum(item.tokens for item in extra_items)
+        )
+
+        parts = []
+        if full_tokens <= budget:
+            # Caso común: todo cabe; se concatenan los fragmentos directamente
+            self._render_tables(fragments, marked, parts)
+            selected = {f"table:{f.key}" for f in fragments}
+            selected.update(item.id for item in extra_items
+                            if all(parent in selected for parent in item.parents))
+            items = extra_items
+        else:
+            items = self._build_table_items(fragments, mentioned, relevance, mark) + extra_items
+            selected = self._select(items, budget)
+            self._render_selected_tables(fragments, items, selected, parts)
+
+        self._render_relationships(extra_items, selected, parts)
+        return parts, [item for item in items if item.id not in selected]
+
+    @staticmethod
+    def _stats(token_budget: int, estimated_tokens: int, dropped: List[PromptItem]) -> Dict[str, Any]:
+        return {
+            "token_budget": token_budget,
+            "estimated_tokens": estimated_tokens,
+            "dropped": {
+                "tables": [i.key for i in dropped if i.kind == "table"],
+                "columns": [i.key for i in dropped if i.kind == "column"],
+                "value_lists": len([i for i in dropped if i.kind == "values"]),
+                "relationships": len([i for i in dropped if i.kind == "relationship"]),
+                "examples": len([i for i in dropped if i.kind == "example"]),
+            }
+        }
+
+    def _table_relevance(self, fragments: List[TableFragment]) -> Dict[str, float]:
+        """Relevancia 0-10 de cada tabla según su posición en el contexto focalizado"""
+        count = max(len(fragments), 1)
+        return {
+            fragment.key: 10.0 * (1 - position / count)
+            for position, fragment in enumerate(fragments)
+        }
+
+    def get_fragment(self, table) -> TableFragment:
+        """Obtener (o renderizar y guardar) el fragmento de una tabla"""
+        fragment = self._fragments.get(table.table_name)
+        if fragment is None:
+            fragment = self._render_fragment(table)
+            self._fragments[table.table_name] = fragment
+        return fragment
+
+    def _render_fragment(self, table) -> TableFragment:
+        """Renderizar una tabla en el dialecto configurado (sin marcas por petición)"""
+        table_name = table.table_name
+        table_profile = (self.data_profile or {}).get("tables", {}).get(table_name, {})
+        columns_profile = table_profile.get("columns_profile", {})
+        fk_columns = {fk["column"] for fk in table.foreign_keys}
+        header, separator, footer = self.dialect.table_parts(table_name, table_profile)
+
+        columns = []
+        for col in table.columns:
+            col_name = col["name"]
+            flags = []
+            if col_name in table.primary_keys:
+                flags.append("pk")
+            if col_name in fk_columns:
+                flags.append("fk")
+            if not col["nullable"]:
+                flags.append("nn")
+
+            values_text = ""
+            col_profile = columns_profile.get(col_name)
+            if col_profile and col_profile.get("unique_values"):
+                values_text = self.dialect.values(col_profile["unique_values"])
+
+            prefix, suffix = self.dialect.column_parts(col, flags)
+            columns.append(ColumnFragment(
+                name=col_name,
+                key=f"{table_name}.{col_name}",
+                is_key=col_name in table.primary_keys or col_name in fk_columns,
+                prefix=prefix,
+                suffix=suffix,
+                values_text=values_text,
+                separator=separator
+            ))
+
+        return TableFragment(table_name.lower(), header, columns, separator, footer)
+
+    def _build_table_items(self,
+                           fragments: List[TableFragment],
+                           mentioned: Dict[str, List[str]],
+                           relevance: Dict[str, float],
+                           mark: bool = True) -> List[PromptItem]:
+        """
+        Crear elementos con score (tablas, columnas, valores) a partir de los
+        fragmentos cacheados; la marca de mención se aplica como overlay.
+        Cada tabla lleva en su bundle sus PKs/FKs y columnas mencionadas (o
+        la primera columna si no tiene ninguna) para no listar tablas vacías.
+        """
+        items = []
+
+        for fragment in fragments:
+            table_score = relevance[fragment.key]
+            table_item = PromptItem("table", fragment.key, fragment.header, self.SCORE_TABLE + table_score)
+            items.append(table_item)
+            parents = (table_item.id,)
+            mentioned_cols = mentioned.get(fragment.key, ())
+            anchors = []
+            first_column = None
+
+            for col in fragment.columns:
+                if col.name_lower in mentioned_cols:
+                    if mark:
+                        text = col.marked_line(self.dialect.mention_mark)
+                        tokens = col.tokens + self.dialect.mention_mark_tokens
+                    else:
+                        text, tokens = col.line, col.tokens
+                    column_item = PromptItem("column", col.key, text,
+                                             self.SCORE_MENTIONED_COLUMN + table_score, parents,
+                                             tokens=tokens)
+                    values_score = self.SCORE_MENTIONED_VALUES
+                else:
+                    score = self.SCORE_KEY_COLUMN if col.is_key else self.SCORE_COLUMN
+                    column_item = PromptItem("column", col.key, col.line, score + table_score,
+                                             parents, tokens=col.tokens)
+                    values_score = self.SCORE_VALUES
+                items.append(column_item)
+                if col.is_key or col.name_lower in mentioned_cols:
+                    anchors.append(column_item)
+                elif first_column is None:
+                    first_column = column_item
+
+                if col.values_text:
+                    items.append(PromptItem("values", col.key, col.values_text,
+                                            values_score + table_score, (column_item.id,),
+                                            tokens=col.values_tokens))
+
+            if not anchors and first_column is not None:
+                anchors.append(first_column)
+            table_item.tokens = fragment.header_tokens + sum(item.tokens for item in anchors)
+            table_item.bundle = tuple(item.id for item in anchors)
+
+        return items
+
+    def _build_relationship_items(self,
+                                  relationships: List[Dict[str, str]],
+                                  relevance: Dict[str, float]) -> List[PromptItem]:
+        """Crear elementos de relaciones"""
+        items = []
+
+        for rel in relationships:
+            # Solo relaciones entre tablas que aparecen en el prompt
+            items.append(PromptItem(
+                "relationship", f"{rel['from_table']}.{rel['from_column']}",
+                self.dialect.relationship(rel),
+                self.SCORE_RELATIONSHIP + relevance.get(rel["from_table"].lower(), 0.0),
+                parents=(f"table:{rel['from_table'].lower()}", f"table:{rel['to_table'].lower()}")
+            ))
+
+        return items
+
+    def _select(self, items: List[PromptItem], budget: int) -> set:
+        """
+        Selección voraz por score. Un elemento solo entra si entraron los
+        elementos de los que depende (una lista de valores necesita su
+        columna y ésta su tabla); una tabla entra junto con sus columnas
+        clave o mencionadas (su `bundle`). Devuelve los ids seleccionados.
+        """
+        selected = set()
+        remaining = budget
+
+        for item in sorted(items, key=lambda i: i.score, reverse=True):
+            if item.id in selected:
+                continue
+            if item.tokens > remaining or any(parent not in selected for parent in item.parents):
+                continue
+            selected.add(item.id)
+            selected.update(item.bundle)
+            remaining -= item.tokens
+
+        return selected
+
+    def _render_tables(self, fragments: List[TableFragment], mentioned: Dict[str, List[str]], parts: List[str]) -> None:
+        """Agregar todas las tablas completas (sin recorte) aplicando las marcas"""
+        mark = self.dialect.mention_mark
+        for fragment in fragments:
+            mentioned_cols = mentioned.get(fragment.key, ())
+            parts.append(fragment.join([
+                (col.marked_line(mark) if col.name_lower in mentioned_cols else col.line) + col.values_text
+                for col in fragment.columns
+            ]))
+
+    def _render_selected_tables(self,
+                                fragments: List[TableFragment],
+                                items: List[PromptItem],
+                                selected: set,
+                                parts: List[str]) -> None:
+        """Agregar las tablas/columnas/valores seleccionados en orden estructural"""
+        columns_by_table: Dict[str, List[str]] = {}
+        columns = None
+
+        for item in items:
+            if item.id not in selected:
+                continue
+            if item.kind == "table":
+                columns = columns_by_table[item.key] = []
+            elif item.kind == "column":
+                columns.append(item.text)
+            elif item.kind == "values":
+                columns[-1] += item.text
+
+        for fragment in fragments:
+            if fragment.key in columns_by_table:
+                parts.append(fragment.join(columns_by_table[fragment.key]))
+
+    def _render_relationships(self, extra_items: List[PromptItem], selected: set, parts: List[str]) -> None:
+        """Agregar las relaciones seleccionadas"""
+        relationships = [item.text for item in extra_items
+                         if item.kind == "relationship" and item.id in selected]
+        if relationships:
+            parts.append(self.dialect.relationships_title)
+            parts.extend(relationships)
+            parts.append("\n")
+
+    def _render_system_header(self, database_name: str, total_tables: int) -> str:
+        return f"""# ASISTENTE SQL
+
+Base de datos: **{database_name}**
+Tablas en BD: {total_tables}
+
+---
+
+{self.dialect.tables_title}"""
+
+    def _render_system_footer(self) -> str:
+        return f"""
+---
+
+## 📝 INSTRUCCIONES CRÍTICAS:
+
+1. **USA SOLO LAS TABLAS MOSTRADAS ARRIBA** (no inventes nombres)
+2. **PARA JOINS**: Usa EXACTAMENTE las relaciones del mapa
+3. **PARA VALORES**: {self.dialect.values_instruction}
+4. **COLUMNAS MENCIONADAS**: Prioriza las que se indiquen en la pregunta
+5. **GENERA SOLO SELECT**: Nunca INSERT/UPDATE/DELETE
+
+## 🎯 FORMATO DE RESPUESTA (OBLIGATORIO):
+
+{RESPONSE_FORMATS[self.output_format][0]}"""
+
+    def _render_user_turn(self,
+                          focused_context: Dict[str, Any],
+                          query_analysis: Dict[str, Any],
+                          examples: str,
+                          user_message: str) -> str:
+        """Parte variable por pregunta (va al final, después del prefijo estable)"""
+        focused = {table.table_name.lower() for table in focused_context["tables"]}
+        parts = [
+            f"Tipo: {query_analysis['query_type']} | Complejidad: Nivel {query_analysis['complexity_level']}/5\n",
+            "Tablas relevantes: " + ", ".join(f"`{t.table_name}`" for t in focused_context["tables"]) + "\n"
+        ]
+
+        mentioned = [
+            f"`{table}.{column}`"
+            for table, columns in query_analysis.get("mentioned_columns", {}).items()
+            if table in focused
+            for column in columns
+        ]
+        if mentioned:
+            parts.append("Columnas mencionadas: " + ", ".join(mentioned) + "\n")
+
+        parts.append(self._render_hints(query_analysis, focused))
+        parts.append(examples)
+        parts.append(f"""
+## 🎯 PREGUNTA DEL USUARIO:
+**"{user_message}"**
+
+## 🚀 GENERA TU RESPUESTA AHORA ({RESPONSE_FORMATS[self.output_format][1]}):
+""")
+        return "".join(parts)
+
+    def _render_examples(self, example_queries: List[str], budget: int) -> Tuple[str, List[PromptItem]]:
+        """Ejemplos que caben en el presupuesto, en orden. Devuelve (texto, descartados)"""
+        items = [PromptItem("example", str(position), f"{position}. {self.dialect.example(example)}",
+                            self.SCORE_EXAMPLE - position)
+                 for position, example in enumerate(example_queries, 1)]
+        remaining = budget - estimate_tokens(self.dialect.examples_title)
+        shown = 0
+        for item in items:
+            if item.tokens > remaining:
+                break
+            remaining -= item.tokens
+            shown += 1
+
+        if not shown:
+            return "", items
+        return self.dialect.examples_title + "".join(item.text for item in items[:shown]), items[shown:]
+
+    def _render_hints(self, query_analysis: Dict[str, Any], focused: Set[str]) -> str:
+        """Hints de filtros; las coincidencias de valores solo de las tablas focalizadas"""
+        hints = query_analysis.get("filter_hints", {})
+        value_matches = [m for m in hints.get("value_matches", []) if m["table"].lower() in focused]
+        if not (hints.get("exact_values") or hints.get("boolean_keywords") or value_matches):
+            return ""
+
+        parts = ["\n## 🎯 HINTS PARA ESTA CONSULTA\n\n"]
+
+        for match in value_matches:
+            parts.append(f"  • Filtro exacto: `{match['table']}.{match['column']}` = '{match['value']}'\n")
+
+        if hints.get("exact_values"):
+            quoted_values = ", ".join(f"'{v}'" for v in hints["exact_values"])
+            parts.append(f"  • Valores exactos mencionados: {quoted_values}\n")
+
+        for keyword, value in hints.get("boolean_keywords", []):
+            parts.append(f"  • '{keyword}' probablemente significa: {value}\n")
+
+        parts.append("\n")
+        return "".join(parts)
@@ -4,8 +4,35 @@ No asume nombres de tablas específicos.
 """
 from typing import List, Dict, Set, Any, Tuple
 import re
-from difflib import get_close_matches
 from app.models.database import DatabaseSchema, TableSchema
+from app.services.ngram_index import TrigramIndex
+from app.services.table_ranker import BM25TableRanker
+from app.services.value_index import ValueIndex
+
+
+class IntentMatcher:
+    """
+    Matcher multi-patrón compilado: los patrones de cada grupo se unen en
+    una sola expresión regular (alternancia), compilada una vez. Cada grupo
+    recorre el mensaje por separado, así que un grupo nunca oculta los hits
+    de otro (un texto entre comillas sigue contando para la intención) y el
+    resultado es el mismo que buscar patrón a patrón.
+    """
+    
+    def __init__(self, groups: Dict[str, List[str]]):
+        """
+        Args:
+            groups: Nombre del grupo -> lista de patrones regex.
+        """
+        self.group_names = list(groups.keys())
+        self._regexes = {
+            name: re.compile("|".join(patterns), re.IGNORECASE)
+            for name, patterns in groups.items()
+        }
+    
+    def match(self, message: str) -> Dict[str, List[str]]:
+        """Devolver los hits del mensaje por grupo"""
+        return {name: [m.group(0) for m in regex.finditer(message)] for name, regex in self._regexes.items()}
 
 
 class QueryAnalyzer:
@@ -46,8 +73,46 @@ class QueryAnalyzer:
         r'\b(ascendente|descendente|asc|desc)\b'
     ]
     
-    def __init__(self, schema: DatabaseSchema):
+    # Palabras que suelen representar valores booleanos en filtros
+    BOOLEAN_KEYWORDS = {
+        'activo': True, 'inactivo': False,
+        'si': True, 'no': False,
+        'verdadero': True, 'falso': False,
+        'habilitado': True, 'deshabilitado': False,
+        'vigente': True, 'vencido': False
+    }
+    
+    # Un matcher compilado para intención, valores y números
+    INTENT_MATCHER = IntentMatcher({
+        "quoted": [r"['\"][^'\"]+['\"]"],
+        "aggregation": AGGREGATION_PATTERNS,
+        "top_n": ORDER_PATTERNS,
+        "join": JOIN_PATTERNS,
+        "boolean": [r'\b(' + '|'.join(BOOLEAN_KEYWORDS) + r')s?\b'],
+        "filter": FILTER_PATTERNS,
+        "number": [r'\b\d+(?:\.\d+)?\b'],
+    })
+    
+    # Prioridad de tipos de query (de más a menos específico)
+    QUERY_TYPE_PRIORITY = ["aggregation", "top_n", "join", "filter"]
+    
+    # Máximo de tablas que puede aportar una columna encontrada por similitud
+    # difusa (evita que columnas comunes como 'nombre' seleccionen todo)
+    MAX_FUZZY_COLUMN_OWNERS = 3
+    
+    # Un valor perfilado presente en más tablas que esto se considera ambiguo
+    # (p.ej. 'activo' en todas las columnas `estado`)
+    MAX_VALUE_MATCH_TABLES = 3
+    
+    # Máximo de tablas que se envían en el contexto focalizado
+    MAX_FOCUSED_TABLES = 10
+    
+    # Constante de Reciprocal Rank Fusion (ranking léxico + semántico)
+    RRF_K = 60
+    
+    def __init__(self, schema: DatabaseSchema, data_profile: Dict[str, Any] = None):
         self.schema = schema
+        self.data_profile = data_profile
         self.table_names = [table.table_name.lower() for table in schema.tables]
         self.table_dict = {table.table_name.lower(): table for table in schema.tables}
         
@@ -56,6 +121,15 @@ class QueryAnalyzer:
         
         # Crear índice de palabras clave de todas las tablas/columnas
         self.keyword_index = self._build_keyword_index()
+        
+        # Índice de trigramas para búsqueda difusa de tablas y columnas
+        self.trigram_index = TrigramIndex.from_schema(schema.tables)
+        
+        # Ranker BM25 (nombre de tabla + columnas + valores perfilados)
+        self.table_ranker = BM25TableRanker.from_schema(schema.tables, data_profile)
+        
+        # Índice invertido valor perfilado -> (tabla, columna, valor)
+        self.value_index = ValueIndex.from_profile(data_profile)
     
     def _build_column_index(self) -> Dict[str, List[str]]:
         """Construir índice de columnas por tabla"""
@@ -114,23 +188,41 @@ class QueryAnalyzer:
         
         return [w for w in words if w]  # Remover vacíos
     
-    def analyze_query(self, user_message: str) -> Dict[str, Any]:
+    def analyze_query(self, user_message: str, semantic_scores: Dict[str, float] = None) -> Dict[str, Any]:
         """
         Analizar la query del usuario de forma DINÁMICA.
+        
+        Args:
+            user_message: Pregunta del usuario
+            semantic_scores: Similitud por tabla del índice de embeddings
+                             (opcional, se fusiona con el ranking BM25)
         """
         message_lower = user_message.lower()
         
+        # Una sola pasada sobre el mensaje para todos los patrones
+        intent_hits = self.INTENT_MATCHER.match(message_lower)
+        
+        # Puntuar tablas con BM25 para poder ordenarlas y recortarlas
+        table_scores = dict(self.table_ranker.rank(message_lower))
+        if semantic_scores:
+            table_scores = self._fuse_scores(table_scores, semantic_scores)
+        
+        # Valores perfilados mencionados ('Cochabamba', 'activo'...)
+        value_matches = self.value_index.lookup(message_lower)
+        
         # 1. Detectar tablas relevantes usando múltiples estrategias
-        relevant_tables = self._extract_relevant_tables_dynamic(message_lower)
+        relevant_tables = self._extract_relevant_tables_dynamic(message_lower, table_scores, value_matches)
         
         # 2. Determinar tipo de query
-        query_type = self._determine_query_type(message_lower)
+        query_type = self._determine_query_type(message_lower, intent_hits)
         
         # 3. Detectar columnas mencionadas
-        mentioned_columns = self._extract_mentioned_columns(message_lower, relevant_tables)
+        mentioned_columns = self._extract_mentioned_columns(message_lower, relevant_tables, value_matches)
         
         # 4. Extraer hints de filtros (valores específicos)
-        filter_hints = self._extract_filter_hints_dynamic(message_lower, relevant_tables)
+        filter_hints = self._extract_filter_hints_dynamic(
+            message_lower, relevant_tables, intent_hits, value_matches
+        )
         
         # 5. Calcular complejidad
         complexity_level = self._calculate_complexity(
@@ -141,24 +233,46 @@ class QueryAnalyzer:
         
         analysis = {
             "relevant_tables": relevant_tables,
+            "table_scores": table_scores,
             "mentioned_columns": mentioned_columns,
             "query_type": query_type,
             "complexity_level": complexity_level,
             "filter_hints": filter_hints,
+            "intent_hits": intent_hits,
             "requires_joins": len(relevant_tables) > 1,
             "aggregation_needed": query_type == "aggregation"
         }
         
         return analysis
     
-    def _extract_relevant_tables_dynamic(self, message: str) -> Set[str]:
+    def _fuse_scores(self, lexical_scores: Dict[str, float], semantic_scores: Dict[str, float]) -> Dict[str, float]:
+        """
+        Fusionar ranking léxico (BM25) y semántico (embeddings) con
+        Reciprocal Rank Fusion, ya que sus escalas no son comparables.
+        Devuelve un dict ordenado de mayor a menor score.
+        """
+        fused: Dict[str, float] = {}
+        for scores in (lexical_scores, semantic_scores):
+            ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+            for rank, (table_name, _) in enumerate(ranked):
+                if table_name in self.table_dict:
+                    fused[table_name] = fused.get(table_name, 0.0) + 1.0 / (self.RRF_K + rank + 1)
+        
+        return dict(sorted(fused.items(), key=lambda x: (-x[1], x[0])))
+    
+    def _extract_relevant_tables_dynamic(self,
+                                         message: str,
+                                         table_scores: Dict[str, float] = None,
+                                         value_matches: List[Dict[str, Any]] = None) -> Set[str]:
         """
         Extraer tablas relevantes usando 4 estrategias:
         1. Coincidencia exacta de nombres de tabla
-        2. Coincidencia de palabras clave en índice
+        2. Coincidencia de palabras clave en índice (+ mejores tablas BM25
+           + tablas que contienen un valor perfilado mencionado)
         3. Similitud difusa (fuzzy matching)
-        4. Análisis de contexto semántico
+        4. Valores perfilados ambiguos (y, como último recurso, tablas centrales)
         """
+        value_tables = self._group_value_matches(value_matches or [])
         relevant = set()
         
         # Estrategia 1: Coincidencia exacta
@@ -181,29 +295,66 @@ class QueryAnalyzer:
             if word in self.keyword_index:
                 relevant.update(self.keyword_index[word])
         
+        # Incluir las tablas mejor puntuadas por BM25 (plurales, valores perfilados)
+        if table_scores:
+            relevant.update(list(table_scores)[:self.MAX_FOCUSED_TABLES])
+        
+        # Valores perfilados que identifican sin ambigüedad su tabla
+        for tables in value_tables.values():
+            if len(tables) <= self.MAX_VALUE_MATCH_TABLES:
+                relevant.update(tables)
+        
         # Estrategia 3: Similitud difusa (para typos o variaciones)
         if not relevant:
             # Extraer "sustantivos" potenciales (palabras largas)
             potential_nouns = [w for w in message.split() if len(w) >= 4]
             
             for noun in potential_nouns:
-                # Buscar coincidencias cercanas en nombres de tablas
-                matches = get_close_matches(
-                    noun.lower(), 
-                    self.table_names, 
-                    n=2, 
-                    cutoff=0.6
-                )
-                relevant.update(matches)
+                relevant.update(self._fuzzy_match_tables(noun))
         
-        # Estrategia 4: Si aún no hay tablas, usar relaciones FK
+        # Estrategia 4: Si aún no hay tablas, usar también los valores ambiguos
+        # (get_focused_context los recorta por score)
+        if not relevant:
+            for tables in value_tables.values():
+                relevant.update(tables)
+        
+        # Último recurso: tablas centrales por relaciones FK
         if not relevant:
-            # Buscar tablas que tienen más relaciones (probablemente principales)
             central_tables = self._get_central_tables()
-            relevant.update(central_tables[:3])  # Top 3 tablas centrales
+            relevant.update(central_tables[:3])
         
         return relevant
     
+    def _group_value_matches(self, value_matches: List[Dict[str, Any]]) -> Dict[str, Set[str]]:
+        """Agrupar coincidencias de valores por mención -> tablas que la contienen"""
+        grouped: Dict[str, Set[str]] = {}
+        for match in value_matches:
+            if match["table"] in self.table_dict:
+                grouped.setdefault(match["mention"], set()).add(match["table"])
+        return grouped
+    
+    def _fuzzy_match_tables(self, word: str) -> Set[str]:
+        """
+        Buscar tablas por similitud difusa usando el índice de trigramas.
+        Considera nombres de tablas y de columnas; una columna aporta las
+        tablas que la contienen.
+        """
+        matched = set()
+        
+        for identifier, _ in self.trigram_index.search(word.lower(), n=2, cutoff=0.6):
+            owners = self.trigram_index.owners(identifier)
+            owner_tables = {table for kind, table in owners if kind == "table"}
+            
+            if owner_tables:
+                matched.update(owner_tables)
+                continue
+            
+            column_tables = {table for kind, table in owners if kind == "column"}
+            if len(column_tables) <= self.MAX_FUZZY_COLUMN_OWNERS:
+                matched.update(column_tables)
+        
+        return matched
+    
     def _get_central_tables(self) -> List[str]:
         """
         Obtener tablas "centrales" basándose en número de relaciones FK.
@@ -232,9 +383,13 @@ class QueryAnalyzer:
         
         return [t[0] for t in sorted_tables]
     
-    def _extract_mentioned_columns(self, message: str, relevant_tables: Set[str]) -> Dict[str, List[str]]:
+    def _extract_mentioned_columns(self,
+                                   message: str,
+                                   relevant_tables: Set[str],
+                                   value_matches: List[Dict[str, Any]] = None) -> Dict[str, List[str]]:
         """
         Detectar columnas mencionadas en el mensaje para cada tabla relevante.
+        Una columna cuyo valor perfilado aparece en el mensaje también cuenta.
         """
         mentioned = {}
         
@@ -254,63 +409,69 @@ class QueryAnalyzer:
                         mentioned_cols.append(col)
                         break
             
+            for match in value_matches or []:
+                col = match["column"].lower()
+                if match["table"] == table_name and col not in mentioned_cols:
+                    mentioned_cols.append(col)
+            
             if mentioned_cols:
                 mentioned[table_name] = mentioned_cols
         
         return mentioned
     
-    def _determine_query_type(self, message: str) -> str:
+    def _determine_query_type(self, message: str, intent_hits: Dict[str, List[str]] = None) -> str:
         """Determinar tipo de query basándose en patrones genéricos"""
+        if intent_hits is None:
+            intent_hits = self.INTENT_MATCHER.match(message)
         
         # Verificar cada tipo en orden de especificidad
-        for pattern in self.AGGREGATION_PATTERNS:
-            if re.search(pattern, message, re.IGNORECASE):
-                return "aggregation"
-        
-        for pattern in self.ORDER_PATTERNS:
-            if re.search(pattern, message, re.IGNORECASE):
-                return "top_n"
-        
-        for pattern in self.JOIN_PATTERNS:
-            if re.search(pattern, message, re.IGNORECASE):
-                return "join"
-        
-        for pattern in self.FILTER_PATTERNS:
-            if re.search(pattern, message, re.IGNORECASE):
-                return "filter"
+        for query_type in self.QUERY_TYPE_PRIORITY:
+            if intent_hits.get(query_type):
+                return query_type
         
         return "simple_select"
     
-    def _extract_filter_hints_dynamic(self, message: str, relevant_tables: Set[str]) -> Dict[str, Any]:
+    def _extract_filter_hints_dynamic(self,
+                                      message: str,
+                                      relevant_tables: Set[str],
+                                      intent_hits: Dict[str, List[str]] = None,
+                                      value_matches: List[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Extraer hints de filtros de forma dinámica buscando valores específicos.
         """
+        if intent_hits is None:
+            intent_hits = self.INTENT_MATCHER.match(message)
+        
         hints = {
             "exact_values": [],  # Valores entre comillas
             "numeric_values": [],  # Números mencionados
-            "boolean_keywords": []  # activo/inactivo, si/no, verdadero/falso
+            "boolean_keywords": [],  # activo/inactivo, si/no, verdadero/falso
+            "value_matches": []  # Valores perfilados mencionados: tabla.columna = valor
         }
         
-        # Extraer valores entre comillas
-        quoted = re.findall(r"['\"]([^'\"]+)['\"]", message)
-        hints["exact_values"] = quoted
-        
-        # Extraer números
-        numbers = re.findall(r'\b\d+(?:\.\d+)?\b', message)
-        hints["numeric_values"] = [float(n) if '.' in n else int(n) for n in numbers]
-        
-        # Detectar palabras booleanas
-        boolean_keywords = {
-            'activo': True, 'inactivo': False,
-            'si': True, 'no': False,
-            'verdadero': True, 'falso': False,
-            'habilitado': True, 'deshabilitado': False,
-            'vigente': True, 'vencido': False
-        }
-        
-        for keyword, value in boolean_keywords.items():
-            if keyword in message:
-                hints["boolean_keywords"].append((keyword, value))
+        # Valores entre comillas (sin las comillas)
+        hints["exact_values"] = [quoted[1:-1] for quoted in intent_hits["quoted"]]
+        
+        # Números
+        hints["numeric_values"] = [
+            float(n) if '.' in n else int(n) for n in intent_hits["number"]
+        ]
+        
+        # Palabras booleanas (palabras completas: 'no' ya no coincide con 'nombre')
+        seen = set()
+        for hit in intent_hits["boolean"]:
+            # Admitir plurales: 'activos' -> 'activo'
+            keyword = hit if hit in self.BOOLEAN_KEYWORDS else hit[:-1]
+            if keyword not in seen:
+                seen.add(keyword)
+                hints["boolean_keywords"].append((keyword, self.BOOLEAN_KEYWORDS[keyword]))
+        
+        # Valores perfilados exactos, solo de las tablas seleccionadas
+        hints["value_matches"] = [
+            {"table": m["table"], "column": m["column"], "value": m["value"]}
+            for m in value_matches or []
+            if m["table"] in relevant_tables
+        ]
         
         return hints
     
@@ -337,18 +498,35 @@ class QueryAnalyzer:
         
         return min(complexity, 5)
     
-    def get_focused_context(self, analysis: Dict[str, Any]) -> Dict[str, Any]:
+    def get_focused_context(self, analysis: Dict[str, Any], max_tables: int = None) -> Dict[str, Any]:
         """
         Generar contexto focalizado con solo información relevante.
+        Las tablas se ordenan por score BM25 y se recortan a `max_tables`
+        (primero las relevantes y luego las relacionadas vía FK).
         """
+        if max_tables is None:
+            max_tables = self.MAX_FOCUSED_TABLES
+        
         relevant_tables = analysis["relevant_tables"]
+        table_scores = analysis.get("table_scores", {})
+        
+        def by_score(table_name: str):
+            return (-table_scores.get(table_name, 0.0), table_name)
         
-        # Expandir con tablas relacionadas vía FK
-        expanded_tables = self._expand_with_related_tables(relevant_tables)
+        primary_tables = sorted(relevant_tables, key=by_score)[:max_tables]
+        
+        # Expandir con tablas relacionadas vía FK (hasta completar el cupo)
+        related_tables = sorted(
+            self._expand_with_related_tables(set(primary_tables)) - set(primary_tables),
+            key=by_score
+        )
+        expanded_tables = primary_tables + related_tables[:max(0, max_tables - len(primary_tables))]
         
         focused_schema = {
             "tables": [],
             "relationships": [],
+            "table_scores": {t: table_scores.get(t, 0.0) for t in expanded_tables},
+            "dropped_tables": len(relevant_tables) + len(related_tables) - len(expanded_tables),
             "total_tables_in_db": len(self.schema.tables),
             "focused_table_count": len(expanded_tables)
         }
@@ -396,7 +574,12 @@ class QueryAnalyzer:
         """
         examples = []
         query_type = analysis["query_type"]
-        relevant_tables = list(analysis["relevant_tables"])
+        table_scores = analysis.get("table_scores", {})
+        # La tabla con mayor score BM25 es la base de los ejemplos
+        relevant_tables = sorted(
+            analysis["relevant_tables"],
+            key=lambda t: (-table_scores.get(t, 0.0), t)
+        )
         
         if not relevant_tables:
             return []
@@ -0,0 +1,135 @@
+"""
+Plazos de extremo a extremo para /chat.
+Cada petición lleva un plazo total y un límite por etapa (contexto,
+generación, ejecución). Al vencer el plazo, o si el cliente se desconecta,
+se cancela la etapa en curso: la petición a Ollama (httpx cierra la conexión
+y Ollama deja de generar) o la consulta en la base de datos. El trabajo de
+las peticiones abandonadas queda registrado para poder medirlo.
+"""
+from typing import Dict, Any, Awaitable, Callable, Optional
+from collections import deque
+from datetime import datetime
+import asyncio
+import inspect
+import os
+import time
+from app.services.structured_logging import get_logger
+
+logger = get_logger("chat")
+
+
+class DeadlineExceeded(Exception):
+    """Se agotó el plazo de la petición (o el de una etapa)"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Tiempo agotado en la etapa '{stage}'")
+        self.stage = stage
+
+
+class RequestDeadline:
+    """Plazo total de una petición y límites por etapa"""
+
+    def __init__(self, total_s: float, stage_limits: Dict[str, float] = None):
+        self.total_s = total_s
+        self.stage_limits = stage_limits or {}
+        self.started = time.perf_counter()
+        # Etapa en curso y duración (ms) de las terminadas
+        self.stage: Optional[str] = None
+        self.completed: Dict[str, float] = {}
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def remaining(self) -> float:
+        return self.total_s - self.elapsed_ms() / 1000
+
+    async def run(self, stage: str, awaitable: Awaitable):
+        """
+        Ejecutar una etapa con el menor entre su límite y lo que queda del
+        plazo total. Si se agota, la etapa se cancela y se lanza DeadlineExceeded.
+        """
+        self.stage = stage
+        limit = min(self.stage_limits.get(stage, self.total_s), self.remaining())
+        if limit <= 0:
+            if inspect.iscoroutine(awaitable):
+                awaitable.close()
+            raise DeadlineExceeded(stage)
+
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(awaitable, timeout=limit)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(stage) from None
+        self.completed[stage] = round((time.perf_counter() - start) * 1000, 1)
+        self.stage = None
+        return result
+
+
+async def cancel_on_disconnect(task: asyncio.Task,
+                               is_disconnected: Callable[[], Awaitable[bool]],
+                               poll_s: float = 0.5) -> bool:
+    """
+    Esperar a `task` comprobando cada `poll_s` si el cliente sigue conectado.
+    Si se desconecta, se cancela la tarea y se devuelve True.
+    """
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=poll_s)
+        if done:
+            return False
+        if await is_disconnected():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return True
+
+
+class AbandonedRequestLog:
+    """Registro del trabajo hecho para peticiones abandonadas (desconexión o plazo)"""
+
+    def __init__(self, max_entries: int = 100):
+        self._entries = deque(maxlen=max_entries)
+        self._by_reason: Dict[str, int] = {}
+        self._by_stage: Dict[str, int] = {}
+        self._wasted_ms = 0.0
+
+    def record(self, reason: str, deadline: RequestDeadline, detail: str = "") -> None:
+        stage = deadline.stage or "response"
+        elapsed = round(deadline.elapsed_ms(), 1)
+        self._by_reason[reason] = self._by_reason.get(reason, 0) + 1
+        self._by_stage[stage] = self._by_stage.get(stage, 0) + 1
+        self._wasted_ms += elapsed
+        self._entries.append({
+            "reason": reason,
+            "stage": stage,
+            "elapsed_ms": elapsed,
+            "completed_stages": dict(deadline.completed),
+            "detail": detail,
+            "at": datetime.now().isoformat()
+        })
+        logger.warning(f"🪦 [CHAT] Petición abandonada ({reason}) en '{stage}' tras {elapsed:.0f} ms",
+                       extra={"fields": {"reason": reason, "stage": stage, "elapsed_ms": elapsed,
+                                         "completed_stages": dict(deadline.completed)}})
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "total": sum(self._by_reason.values()),
+            "by_reason": dict(self._by_reason),
+            "by_stage": dict(self._by_stage),
+            "wasted_ms": round(self._wasted_ms, 1),
+            "recent": list(self._entries)
+        }
+
+
+def chat_deadline() -> RequestDeadline:
+    """Plazo de una petición de /chat según la configuración"""
+    return RequestDeadline(
+        float(os.getenv("CHAT_DEADLINE_S", "300")),
+        {
+            "context": float(os.getenv("CHAT_CONTEXT_TIMEOUT_S", "120")),
+            "generation": float(os.getenv("CHAT_GENERATION_TIMEOUT_S", "240")),
+            "execution": float(os.getenv("CHAT_EXECUTION_TIMEOUT_S", "60"))
+        }
+    )
+
+
+# Instancia global del registro de peticiones abandonadas
+abandoned_requests = AbandonedRequestLog()
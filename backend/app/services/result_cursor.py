@@ -0,0 +1,61 @@
+"""
+Tokens de continuación para paginar resultados de /chat.
+El token lleva el estado de la paginación (consulta, desplazamiento, tamaño
+de página y BD) firmado con HMAC, de modo que las páginas siguientes se
+piden sin volver a llamar al modelo y sin guardar estado en el servidor.
+La firma impide que un cliente ejecute SQL propio a través del token.
+"""
+from typing import Dict, Any
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+
+
+class InvalidCursorError(Exception):
+    """Token de continuación mal formado, alterado o caducado"""
+
+
+class ResultCursorCodec:
+    """Codificar y verificar tokens de continuación firmados"""
+
+    def __init__(self, secret: str, ttl_minutes: int = 30):
+        self._secret = secret.encode()
+        self._ttl_s = ttl_minutes * 60
+
+    def _sign(self, payload: bytes) -> str:
+        digest = hmac.new(self._secret, payload, hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+    def encode(self, state: Dict[str, Any]) -> str:
+        """Token 'payload.firma' para el estado dado (con caducidad)"""
+        body = dict(state, exp=int(time.time()) + self._ttl_s)
+        payload = base64.urlsafe_b64encode(
+            json.dumps(body, separators=(",", ":")).encode()
+        ).decode().rstrip("=")
+        return f"{payload}.{self._sign(payload.encode())}"
+
+    def decode(self, token: str) -> Dict[str, Any]:
+        """Verificar la firma y la caducidad y devolver el estado"""
+        try:
+            payload, signature = token.split(".", 1)
+        except ValueError:
+            raise InvalidCursorError("Token de continuación mal formado")
+
+        if not hmac.compare_digest(signature, self._sign(payload.encode())):
+            raise InvalidCursorError("Token de continuación no válido")
+
+        state = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        if state.get("exp", 0) < time.time():
+            raise InvalidCursorError("Token de continuación caducado; repite la pregunta")
+        return state
+
+
+# Instancia global (sin secreto configurado, los tokens valen hasta reiniciar)
+result_cursors = ResultCursorCodec(
+    os.getenv("RESULT_CURSOR_SECRET") or secrets.token_hex(32),
+    ttl_minutes=int(os.getenv("RESULT_CURSOR_TTL_MINUTES", "30"))
+)
@@ -0,0 +1,258 @@
+"""
+Índice de embeddings del esquema para recuperación semántica (RAG).
+Cada tabla, y cada columna con sus valores perfilados, se embebe una sola vez
+con el endpoint de embeddings de Ollama, a través del pool de hosts (con su
+cola de admisión: la indexación en segundo plano cede el paso a las
+preguntas del chat). Los vectores se guardan en una
+matriz float32 contigua por huella de base de datos, persistida en disco.
+"""
+from typing import Dict, List, Any, Optional, Tuple
+import hashlib
+import json
+import os
+import numpy as np
+from app.models.database import DatabaseSchema, TableSchema
+from app.services.ollama_pool import OllamaPool, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from app.services.structured_logging import get_logger
+
+logger = get_logger("embeddings")
+
+
+class SchemaEmbeddingIndex:
+    """
+    Índice semántico de los elementos (tablas y columnas) de UNA base de datos.
+    Solo se recalculan los embeddings de las tablas cuya definición cambió.
+    """
+
+    EMBED_BATCH_SIZE = 64
+
+    def __init__(self, fingerprint: str, model: str, pool: OllamaPool, storage_dir: str):
+        self.fingerprint = fingerprint
+        self.model = model
+        self.pool = pool
+        self.storage_dir = storage_dir
+
+        # Fila i de la matriz <-> elements[i] = {"table", "column", "text"}
+        self.elements: List[Dict[str, Optional[str]]] = []
+        self.table_hashes: Dict[str, str] = {}
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+
+    @property
+    def _matrix_path(self) -> str:
+        return os.path.join(self.storage_dir, f"{self.fingerprint}.npy")
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.storage_dir, f"{self.fingerprint}.json")
+
+    def load(self) -> bool:
+        """Cargar índice persistido (si existe y es del mismo modelo)"""
+        if not (os.path.exists(self._matrix_path) and os.path.exists(self._meta_path)):
+            return False
+
+        with open(self._meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        if meta.get("model") != self.model:
+            return False
+
+        self.elements = meta["elements"]
+        self.table_hashes = meta["table_hashes"]
+        self.matrix = np.ascontiguousarray(np.load(self._matrix_path), dtype=np.float32)
+        return True
+
+    def save(self) -> None:
+        """Persistir matriz y metadatos en disco"""
+        os.makedirs(self.storage_dir, exist_ok=True)
+        np.save(self._matrix_path, self.matrix)
+        with open(self._meta_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "model": self.model,
+                "elements": self.elements,
+                "table_hashes": self.table_hashes
+            }, f, ensure_ascii=False)
+
+    @staticmethod
+    def table_hash(table: TableSchema, table_profile: Dict[str, Any]) -> str:
+        """Hash de la definición de una tabla (columnas, claves y valores perfilados)"""
+        payload = {
+            "table": table.dict(),
+            "values": {
+                col: profile.get("unique_values")
+                for col, profile in table_profile.get("columns_profile", {}).items()
+            }
+        }
+        return hashlib.sha1(
+            json.dumps(payload, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    @staticmethod
+    def table_elements(table: TableSchema, table_profile: Dict[str, Any]) -> List[Dict[str, Optional[str]]]:
+        """Textos a embeber para una tabla: la tabla completa y cada columna"""
+        column_names = ", ".join(col["name"] for col in table.columns)
+        elements = [{
+            "table": table.table_name.lower(),
+            "column": None,
+            "text": f"tabla {table.table_name}: {column_names}"
+        }]
+
+        columns_profile = table_profile.get("columns_profile", {})
+        for col in table.columns:
+            text = f"columna {col['name']} ({col['type']}) de la tabla {table.table_name}"
+            values = (columns_profile.get(col["name"]) or {}).get("unique_values")
+            if values:
+                text += ": " + ", ".join(str(v) for v in values)
+            elements.append({
+                "table": table.table_name.lower(),
+                "column": col["name"],
+                "text": text
+            })
+
+        return elements
+
+    async def _embed(self, texts: List[str], priority: int = PRIORITY_INTERACTIVE) -> np.ndarray:
+        """Obtener embeddings normalizados (L2) en lotes desde Ollama"""
+        vectors = []
+        for start in range(0, len(texts), self.EMBED_BATCH_SIZE):
+            response, _ = await self.pool.request(
+                "POST",
+                "/api/embed",
+                model=self.model,
+                priority=priority,
+                timeout=300.0,
+                json={"model": self.model, "input": texts[start:start + self.EMBED_BATCH_SIZE]}
+            )
+            response.raise_for_status()
+            vectors.extend(response.json()["embeddings"])
+
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    async def sync(self, schema: DatabaseSchema, data_profile: Dict[str, Any] = None) -> int:
+        """
+        Sincronizar el índice con el esquema actual.
+        Solo embebe las tablas nuevas o modificadas; elimina las que ya no existen.
+        Devuelve el número de elementos embebidos.
+        """
+        profile_tables = (data_profile or {}).get("tables", {})
+
+        current_hashes = {}
+        changed_elements = []
+        for table in schema.tables:
+            table_profile = profile_tables.get(table.table_name, {})
+            name = table.table_name.lower()
+            current_hashes[name] = self.table_hash(table, table_profile)
+            if self.table_hashes.get(name) != current_hashes[name]:
+                changed_elements.extend(self.table_elements(table, table_profile))
+
+        changed_tables = {e["table"] for e in changed_elements}
+        if not changed_elements and set(current_hashes) == set(self.table_hashes):
+            return 0
+
+        # Conservar filas de tablas sin cambios
+        keep_rows = [
+            i for i, element in enumerate(self.elements)
+            if element["table"] in current_hashes and element["table"] not in changed_tables
+        ]
+        kept_elements = [self.elements[i] for i in keep_rows]
+        kept_matrix = self.matrix[keep_rows] if keep_rows else None
+
+        # Indexación masiva: detrás de las generaciones interactivas
+        new_matrix = (await self._embed([e["text"] for e in changed_elements], PRIORITY_BACKGROUND)
+                      if changed_elements else None)
+
+        blocks = [m for m in (kept_matrix, new_matrix) if m is not None and len(m)]
+        self.matrix = np.ascontiguousarray(
+            np.vstack(blocks) if blocks else np.zeros((0, 0)), dtype=np.float32
+        )
+        self.elements = kept_elements + changed_elements
+        self.table_hashes = current_hashes
+        self.save()
+
+        logger.info(f"🧠 [EMBEDDINGS] {len(changed_elements)} elementos embebidos "
+                    f"({len(changed_tables)} tablas nuevas/modificadas, {len(self.elements)} en total)")
+        return len(changed_elements)
+
+    async def search(self, message: str, top_k: int = 20) -> List[Tuple[str, Optional[str], float]]:
+        """
+        Buscar los elementos más similares a un mensaje.
+        Devuelve (tabla, columna o None, similitud coseno).
+        """
+        if not len(self.elements):
+            return []
+
+        query = (await self._embed([message]))[0]
+        scores = self.matrix @ query
+
+        top_k = min(top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (self.elements[i]["table"], self.elements[i]["column"], float(scores[i]))
+            for i in top
+        ]
+
+    async def table_scores(self, message: str, top_k: int = 20) -> Dict[str, float]:
+        """Similitud máxima por tabla entre los elementos recuperados"""
+        scores: Dict[str, float] = {}
+        for table, _, score in await self.search(message, top_k):
+            scores[table] = max(score, scores.get(table, float("-inf")))
+        return scores
+
+
+class SchemaEmbeddingStore:
+    """
+    Registro de índices de embeddings por huella de base de datos.
+    Deshabilitado si no se configura un modelo de embeddings o mientras no
+    tenga pool de Ollama (lo asigna routes con el de OllamaService).
+    """
+
+    def __init__(self, pool: Optional[OllamaPool] = None, model: str = "", storage_dir: str = ".embeddings"):
+        self.pool = pool
+        self.model = model
+        self.storage_dir = storage_dir
+        self._indexes: Dict[str, SchemaEmbeddingIndex] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.model) and self.pool is not None
+
+    def get_index(self, fingerprint: str) -> SchemaEmbeddingIndex:
+        """Obtener (o cargar de disco) el índice de una base de datos"""
+        if fingerprint not in self._indexes:
+            index = SchemaEmbeddingIndex(fingerprint, self.model, self.pool, self.storage_dir)
+            index.load()
+            self._indexes[fingerprint] = index
+        return self._indexes[fingerprint]
+
+    async def sync(self, fingerprint: str,
+                   schema: DatabaseSchema,
+                   data_profile: Dict[str, Any] = None) -> Optional[SchemaEmbeddingIndex]:
+        """
+        Sincronizar el índice de una base de datos. Si falla (p.ej. el modelo
+        de embeddings no está instalado) se devuelve None y se usa solo la
+        recuperación léxica.
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            index = self.get_index(fingerprint)
+            await index.sync(schema, data_profile)
+            return index
+        except Exception as e:
+            logger.warning(f"⚠️ [EMBEDDINGS] No se pudo sincronizar el índice: {str(e)}")
+            return None
+
+    def drop(self, fingerprint: str) -> None:
+        """Olvidar el índice en memoria (los archivos en disco se conservan)"""
+        self._indexes.pop(fingerprint, None)
+
+
+# Instancia global del registro de embeddings (el pool se asigna en routes)
+schema_embeddings = SchemaEmbeddingStore(
+    model=os.getenv("EMBEDDING_MODEL", ""),
+    storage_dir=os.getenv("EMBEDDINGS_DIR", ".embeddings")
+)
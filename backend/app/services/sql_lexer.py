@@ -0,0 +1,424 @@
+"""
+Análisis léxico de SQL en una sola pasada.
+Recorre la consulta una vez, saltando literales de cadena, identificadores
+entre comillas y comentarios, y a la vez clasifica la sentencia, detecta
+palabras prohibidas y extrae las tablas y columnas (cualificadas) que usa.
+Sustituye a las búsquedas con regex sobre el SQL en mayúsculas, que daban
+falsos positivos con palabras dentro de literales ('DELETE me') y no
+comprobaban de verdad las tablas.
+"""
+from typing import Dict, Any, Iterator, Optional, Tuple, Set
+from collections import OrderedDict
+import hashlib
+import re
+
+# Palabras que no pueden aparecer en una consulta de solo lectura
+FORBIDDEN_KEYWORDS = frozenset({
+    "INSERT", "UPDATE", "DELETE", "DROP", "CREATE", "ALTER", "TRUNCATE",
+    "EXEC", "EXECUTE", "CALL", "GRANT", "REVOKE", "MERGE", "REPLACE",
+    "LOAD", "COPY", "BULK", "INTO", "OUTFILE", "DUMPFILE"
+})
+# Prohibidas como sentencia pero válidas como función: REPLACE(col, 'a', 'b')
+FUNCTION_KEYWORDS = frozenset({"REPLACE", "INSERT"})
+
+# Palabras reservadas que no son nombres de tabla ni alias
+RESERVED = frozenset({
+    "SELECT", "FROM", "WHERE", "GROUP", "ORDER", "BY", "HAVING", "LIMIT", "OFFSET",
+    "UNION", "INTERSECT", "EXCEPT", "ALL", "DISTINCT", "AS", "ON", "USING", "JOIN",
+    "INNER", "LEFT", "RIGHT", "FULL", "OUTER", "CROSS", "NATURAL", "STRAIGHT_JOIN",
+    "LATERAL", "WINDOW", "FETCH", "FOR", "WITH", "RECURSIVE", "AND", "OR", "NOT",
+    "IN", "IS", "NULL", "LIKE", "ILIKE", "BETWEEN", "CASE", "WHEN", "THEN", "ELSE",
+    "END", "ASC", "DESC", "EXISTS", "ONLY", "VALUES", "SET", "RETURNING", "FIRST",
+    "ROWS", "ROW", "NEXT", "TRUE", "FALSE"
+})
+# Palabras que cierran la lista de tablas del FROM
+FROM_TERMINATORS = frozenset({
+    "WHERE", "GROUP", "ORDER", "HAVING", "LIMIT", "OFFSET", "UNION", "INTERSECT",
+    "EXCEPT", "WINDOW", "FETCH", "FOR", "ON", "USING", "RETURNING"
+})
+
+DOLLAR_QUOTE = re.compile(r'\$([A-Za-z_]\w*)?\$')
+# Lista de valores ya normalizados: "? , ? , ?"
+VALUE_LIST = re.compile(r'\?(?: , \?)+')
+
+# Resultados memorizados por hash del SQL
+ANALYSIS_CACHE_SIZE = 1024
+_analysis_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+def _skip_quoted(sql: str, i: int, quote: str, backslash: bool) -> int:
+    """Posición tras el cierre de un literal que empieza en i (la comilla doblada escapa)"""
+    j, n = i + 1, len(sql)
+    while j < n:
+        if backslash and sql[j] == "\\":
+            j += 2
+        elif sql[j] == quote:
+            if j + 1 < n and sql[j + 1] == quote:
+                j += 2
+            else:
+                return j + 1
+        else:
+            j += 1
+    return n
+
+
+def tokenize(sql: str, mysql: bool = False) -> Iterator[Tuple[str, str]]:
+    """
+    Tokens (tipo, valor) del SQL: "word" (palabra clave o identificador),
+    "ident" (identificador entre comillas), "number" y "punct". Los literales
+    de cadena se emiten como ("string", "") y los comentarios se descartan.
+
+    Las reglas siguen al motor (`mysql`), porque un desacuerdo sobre dónde
+    acaba un literal o un comentario podría esconder una sentencia:
+      - PostgreSQL: '...' sin escape con barra, "..." es un identificador,
+        $$...$$ es un literal, '#' es un operador y '--' siempre comenta.
+      - MySQL: '...' y "..." son literales con escape con barra, '#' comenta,
+        '-- ' solo comenta seguido de espacio y /*! ... */ se ejecuta.
+    """
+    for kind, value, _, _ in tokenize_spans(sql, mysql):
+        yield kind, value
+
+
+def tokenize_spans(sql: str, mysql: bool = False) -> Iterator[Tuple[str, str, int, int]]:
+    """Tokens de `tokenize` con su posición en el SQL: (tipo, valor, inicio, fin)"""
+    i, n = 0, len(sql)
+    while i < n:
+        c = sql[i]
+        if c.isspace():
+            i += 1
+        elif (c == "-" and sql.startswith("--", i)
+              and (not mysql or i + 2 >= n or sql[i + 2].isspace())) or (c == "#" and mysql):
+            end = sql.find("\n", i)
+            i = n if end < 0 else end + 1
+        elif c == "/" and sql.startswith("/*", i):
+            if mysql and sql.startswith(("/*!", "/*+"), i):
+                # Comentario ejecutable de MySQL: su contenido cuenta como SQL
+                i += 3
+                continue
+            end = sql.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+        elif c == "'" or (c == '"' and mysql):
+            end = _skip_quoted(sql, i, c, backslash=mysql)
+            yield "string", "", i, end
+            i = end
+        elif c == '"' or c == "`":
+            end = _skip_quoted(sql, i, c, backslash=False)
+            yield "ident", sql[i + 1:end - 1].replace(c + c, c), i, end
+            i = end
+        elif c == "$" and not mysql and DOLLAR_QUOTE.match(sql, i):
+            # Cadena de PostgreSQL con $$...$$ o $tag$...$tag$
+            tag = DOLLAR_QUOTE.match(sql, i).group(0)
+            end = sql.find(tag, i + len(tag))
+            end = n if end < 0 else end + len(tag)
+            yield "string", "", i, end
+            i = end
+        elif c.isalpha() or c == "_":
+            j = i + 1
+            while j < n and (sql[j].isalnum() or sql[j] in "_$"):
+                j += 1
+            yield "word", sql[i:j], i, j
+            i = j
+        elif c.isdigit():
+            j = i + 1
+            while j < n and (sql[j].isalnum() or sql[j] == "."):
+                j += 1
+            yield "number", sql[i:j], i, j
+            i = j
+        else:
+            yield "punct", c, i, i + 1
+            i += 1
+
+
+def _is_name(kind: str, value: str) -> bool:
+    return kind == "ident" or (kind == "word" and value.upper() not in RESERVED)
+
+
+def analyze_sql(sql: str, mysql: bool = False) -> Dict[str, Any]:
+    """
+    Analizar una consulta en una pasada (resultado memorizado por hash):
+      statement_type   primera palabra de la primera sentencia (SELECT, WITH...)
+      main_statement   tipo de la sentencia principal tras los CTE de WITH
+      statement_count  número de sentencias separadas por ';'
+      forbidden        palabras prohibidas usadas como sentencia o cláusula
+      tables           tablas referenciadas (minúsculas, sin esquema ni CTE)
+      columns          columnas cualificadas (tabla, columna), resolviendo alias
+    """
+    key = hashlib.sha1(f"{mysql}:{sql}".encode()).hexdigest()
+    cached = _analysis_cache.get(key)
+    if cached is not None:
+        _analysis_cache.move_to_end(key)
+        return cached
+
+    result = _analyze(sql, mysql)
+    _analysis_cache[key] = result
+    if len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+        _analysis_cache.popitem(last=False)
+    return result
+
+
+def _analyze(sql: str, mysql: bool) -> Dict[str, Any]:
+    statement_type = None
+    main_statement = None
+    statement_count = 0
+    in_statement = False
+    forbidden: Set[str] = set()
+    pending_forbidden = None
+
+    tables: Set[str] = set()
+    ctes: Set[str] = set()
+    aliases: Dict[str, Any] = {}
+    qualified = []
+
+    depth = 0
+    select_depths: Set[int] = set()
+    from_depths: Set[int] = set()
+    # Lectura de tablas: None, "table", "name", "dot", "alias", "alias_as"
+    state = None
+    table_parts = []
+    current_table = None
+    # Profundidad de las subconsultas / funciones del FROM (su alias va tras el ')')
+    derived = []
+
+    def commit_table():
+        table = table_parts[-1].lower()
+        if table not in ctes:
+            tables.add(table)
+        return table
+
+    prev = prev2 = ("", "")
+    for kind, value in tokenize(sql, mysql):
+        upper = value.upper() if kind == "word" else ""
+
+        # Palabra prohibida pendiente: si va seguida de '(' era una función
+        if pending_forbidden is not None:
+            if value != "(":
+                forbidden.add(pending_forbidden)
+            pending_forbidden = None
+
+        if value == ";" and kind == "punct":
+            if state == "name":
+                commit_table()
+            if in_statement:
+                statement_count += 1
+            in_statement = False
+            state = None
+            prev = prev2 = ("", "")
+            continue
+
+        if not in_statement:
+            in_statement = True
+            if statement_type is None:
+                statement_type = upper or value
+        if main_statement is None and depth == 0 and upper in ("SELECT", "INSERT", "UPDATE", "DELETE",
+                                                               "MERGE", "REPLACE", "CREATE", "DROP", "ALTER",
+                                                               "TRUNCATE", "CALL", "EXEC", "EXECUTE",
+                                                               "COPY", "GRANT", "REVOKE", "LOAD"):
+            main_statement = upper
+
+        if upper in FORBIDDEN_KEYWORDS:
+            if upper in FUNCTION_KEYWORDS:
+                pending_forbidden = upper
+            else:
+                forbidden.add(upper)
+
+        # --- Lectura de nombres de tabla tras FROM / JOIN ---
+        consumed = False
+        if state == "table":
+            if value == "(":
+                # Subconsulta (o función) en el FROM: su alias llega tras el ')'
+                derived.append(depth)
+                state = None
+            elif upper in ("LATERAL", "ONLY"):
+                consumed = True
+            elif _is_name(kind, value):
+                table_parts = [value]
+                state, consumed = "name", True
+        elif state == "name":
+            if value == ".":
+                state, consumed = "dot", True
+            elif value == "(":
+                # Función de tabla (generate_series(...)): no es una tabla
+                derived.append(depth)
+                state = None
+            else:
+                current_table = commit_table()
+                state = "alias"
+        elif state == "dot":
+            if kind in ("word", "ident"):
+                table_parts.append(value)
+                state, consumed = "name", True
+            else:
+                state = None
+
+        if not consumed and state in ("alias", "alias_as"):
+            if upper == "AS" and state == "alias":
+                state, consumed = "alias_as", True
+            elif _is_name(kind, value):
+                aliases[value.lower()] = current_table
+                state, consumed = None, True
+            else:
+                state = None
+
+        if not consumed:
+            if value == "(" and kind == "punct":
+                # CTE: nombre AS ( ... ) o nombre (columnas) AS ( ... )
+                if depth == 0 and statement_type == "WITH" and main_statement is None:
+                    if prev[1].upper() == "AS" and prev2[0] in ("word", "ident"):
+                        ctes.add(prev2[1].lower())
+                    elif _is_name(*prev) and prev2[1].upper() in ("WITH", "RECURSIVE", ","):
+                        ctes.add(prev[1].lower())
+                depth += 1
+            elif value == ")" and kind == "punct":
+                select_depths.discard(depth)
+                from_depths.discard(depth)
+                depth = max(0, depth - 1)
+                if derived and derived[-1] == depth:
+                    derived.pop()
+                    current_table, state = None, "alias"
+            elif value == "," and kind == "punct" and depth in from_depths and state is None:
+                state = "table"
+            elif upper == "SELECT":
+                select_depths.add(depth)
+            elif upper == "FROM" and depth in select_depths:
+                # FROM de una consulta (no EXTRACT(... FROM ...) ni TRIM(... FROM ...))
+                from_depths.add(depth)
+                state = "table"
+            elif upper == "JOIN" or upper == "STRAIGHT_JOIN":
+                state = "table"
+            elif upper in FROM_TERMINATORS:
+                from_depths.discard(depth)
+            elif state is None and kind in ("word", "ident") and prev == ("punct", ".") \
+                    and prev2[0] in ("word", "ident"):
+                # Referencia cualificada: alias.columna
+                qualified.append((prev2[1].lower(), value.lower()))
+
+        prev2, prev = prev, (kind, value)
+
+    if pending_forbidden is not None:
+        forbidden.add(pending_forbidden)
+    if state == "name":
+        commit_table()
+    if in_statement:
+        statement_count += 1
+
+    # Resolver alias (pueden definirse después de usarse en el SELECT)
+    columns = set()
+    for qualifier, column in qualified:
+        table = aliases.get(qualifier, qualifier if qualifier in tables else None)
+        if table is not None:
+            columns.add((table, column))
+
+    return {
+        "statement_type": statement_type,
+        "main_statement": main_statement,
+        "statement_count": statement_count,
+        "forbidden": frozenset(forbidden),
+        "tables": frozenset(tables - ctes),
+        "ctes": frozenset(ctes),
+        "columns": frozenset(columns)
+    }
+
+
+def fingerprint_sql(sql: str, mysql: bool = False) -> str:
+    """
+    Forma normalizada de una consulta para agrupar sus ejecuciones: literales
+    y números como '?', listas '(?, ?, ?)' como '(?+)', palabras clave en
+    mayúsculas, nombres en minúsculas y sin comentarios ni espacios extra.
+    """
+    parts = []
+    for kind, value in tokenize(sql, mysql):
+        if kind in ("string", "number"):
+            parts.append("?")
+        elif kind == "word":
+            upper = value.upper()
+            parts.append(upper if upper in RESERVED or upper in FORBIDDEN_KEYWORDS else value.lower())
+        elif kind == "ident":
+            parts.append(value.lower())
+        elif value != ";":
+            parts.append(value)
+    return VALUE_LIST.sub("?+", " ".join(parts))
+
+
+# Palabras de la cláusula de límite final (LIMIT / OFFSET / FETCH FIRST)
+ROW_LIMIT_WORDS = frozenset({"LIMIT", "OFFSET", "FETCH", "FIRST", "NEXT", "ROW", "ROWS", "ONLY", "ALL"})
+
+
+def split_row_limit(sql: str, mysql: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Separar la cláusula de límite exterior de una consulta (la del final,
+    fuera de paréntesis): LIMIT n [OFFSET m], LIMIT m, n (MySQL), OFFSET m
+    [ROWS] y FETCH FIRST|NEXT n ROWS ONLY. Devuelve
+      body    la consulta sin esa cláusula, sin ';' ni comentarios finales
+      limit   filas de la cláusula (None si no hay límite)
+      offset  filas saltadas (0 si no hay)
+    o None si al final hay una cláusula que no se sabe reescribir (LIMIT ?).
+    """
+    tokens = [token for token in tokenize_spans(sql, mysql)]
+    while tokens and tokens[-1][:2] == ("punct", ";"):
+        tokens.pop()
+    if not tokens:
+        return {"body": "", "limit": None, "offset": 0}
+
+    # Inicio de la cláusula: primera palabra de límite a profundidad 0 tras
+    # la que solo quedan palabras de límite, números y comas
+    depth, start = 0, None
+    # Última palabra de límite y último SELECT exteriores
+    last_clause = last_select = -1
+    for index, (kind, value, _, _) in enumerate(tokens):
+        upper = value.upper() if kind == "word" else ""
+        if depth == 0 and upper in ("LIMIT", "OFFSET", "FETCH"):
+            last_clause = index
+        elif depth == 0 and upper == "SELECT":
+            last_select = index
+        if value in ("(", ")") and kind == "punct":
+            depth += 1 if value == "(" else -1
+            start = None
+        elif depth == 0 and upper in ROW_LIMIT_WORDS:
+            if start is None and upper in ("LIMIT", "OFFSET", "FETCH"):
+                start = index
+        elif not (kind == "number" or (kind == "punct" and value == ",")):
+            start = None
+
+    if start is None:
+        if last_clause > last_select:
+            # Límite con parámetros o expresiones, o seguido de otra cláusula
+            return None
+        return {"body": sql[:tokens[-1][3]], "limit": None, "offset": 0}
+
+    clause = [value.upper() for _, value, _, _ in tokens[start:]]
+    limit, offset, position = None, 0, 0
+
+    def number_at(index: int) -> Optional[int]:
+        value = clause[index] if index < len(clause) else ""
+        return int(value) if value.isdigit() else None
+
+    while position < len(clause):
+        word = clause[position]
+        if word == "LIMIT" and clause[position + 1:position + 2] == ["ALL"]:
+            position += 2
+        elif word == "LIMIT" and number_at(position + 1) is not None:
+            if clause[position + 2:position + 3] == [","] and number_at(position + 3) is not None:
+                offset, limit = number_at(position + 1), number_at(position + 3)
+                position += 4
+            else:
+                limit = number_at(position + 1)
+                position += 2
+        elif word == "OFFSET" and number_at(position + 1) is not None:
+            offset = number_at(position + 1)
+            position += 2
+            if clause[position:position + 1] in (["ROW"], ["ROWS"]):
+                position += 1
+        elif word == "FETCH" and clause[position + 1:position + 2] in (["FIRST"], ["NEXT"]):
+            position += 2
+            limit = number_at(position)
+            if limit is None:
+                limit = 1
+            else:
+                position += 1
+            if clause[position:position + 2] not in (["ROW", "ONLY"], ["ROWS", "ONLY"]):
+                return None
+            position += 2
+        else:
+            return None
+
+    return {"body": sql[:tokens[start - 1][3]] if start else "", "limit": limit, "offset": offset}
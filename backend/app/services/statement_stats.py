@@ -0,0 +1,146 @@
+"""
+Estadísticas de las consultas SQL generadas.
+Agrupa las ejecuciones por huella (SQL normalizado sin literales) y guarda
+llamadas, tiempo total y p95, filas devueltas y bytes serializados, de modo
+que se pueda ver qué consultas pesan más sobre las bases de datos. Las
+ejecuciones lentas se guardan aparte con la pregunta y el modelo que las
+originaron.
+"""
+from typing import Dict, Any, List
+from collections import OrderedDict, deque
+from datetime import datetime
+import hashlib
+import math
+import os
+
+from app.services.sql_lexer import fingerprint_sql
+from app.services.structured_logging import get_logger
+
+logger = get_logger("db")
+
+
+class StatementStats:
+    """Acumulados por huella de SQL (LRU acotado) y registro de consultas lentas"""
+
+    # Duraciones guardadas por huella para el p95
+    DURATION_WINDOW = 200
+    ORDER_FIELDS = ("total_ms", "calls", "p95_ms", "rows", "bytes")
+
+    def __init__(self, slow_ms: float = 1000, max_statements: int = 500, slow_log_size: int = 100):
+        self.slow_ms = slow_ms
+        self.max_statements = max_statements
+        self._statements: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._slow_log = deque(maxlen=slow_log_size)
+
+    def record(self,
+               sql: str,
+               elapsed_ms: float,
+               rows: int = 0,
+               bytes_serialized: int = 0,
+               success: bool = True,
+               database: str = None,
+               question: str = None,
+               model: str = None) -> str:
+        """Registrar una ejecución; devuelve el id de su huella"""
+        normalized = fingerprint_sql(sql)
+        statement_id = hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+        entry = self._statements.get(statement_id)
+        if entry is None:
+            entry = {
+                "fingerprint": normalized,
+                "example": sql,
+                "databases": set(),
+                "calls": 0,
+                "errors": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "rows": 0,
+                "bytes": 0,
+                "durations": deque(maxlen=self.DURATION_WINDOW),
+                "last_seen": None
+            }
+            self._statements[statement_id] = entry
+            if len(self._statements) > self.max_statements:
+                self._statements.popitem(last=False)
+        self._statements.move_to_end(statement_id)
+
+        entry["calls"] += 1
+        entry["errors"] += not success
+        entry["total_ms"] += elapsed_ms
+        entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+        entry["rows"] += rows
+        entry["bytes"] += bytes_serialized
+        entry["durations"].append(elapsed_ms)
+        entry["last_seen"] = datetime.now().isoformat()
+        if database:
+            entry["databases"].add(database)
+
+        if elapsed_ms >= self.slow_ms:
+            self._slow_log.append({
+                "statement_id": statement_id,
+                "sql": sql,
+                "elapsed_ms": round(elapsed_ms, 1),
+                "rows": rows,
+                "bytes": bytes_serialized,
+                "success": success,
+                "database": database,
+                "question": question,
+                "model": model,
+                "at": entry["last_seen"]
+            })
+            logger.warning(f"🐢 [DB] Consulta lenta ({elapsed_ms:.0f} ms, {rows} filas): {sql[:200]}",
+                           extra={"fields": {"statement_id": statement_id, "elapsed_ms": round(elapsed_ms, 1),
+                                             "database": database, "model": model}})
+        return statement_id
+
+    @staticmethod
+    def _summary(statement_id: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        durations = sorted(entry["durations"])
+        calls = entry["calls"]
+        return {
+            "statement_id": statement_id,
+            "fingerprint": entry["fingerprint"],
+            "example": entry["example"],
+            "databases": sorted(entry["databases"]),
+            "calls": calls,
+            "errors": entry["errors"],
+            "total_ms": round(entry["total_ms"], 1),
+            "avg_ms": round(entry["total_ms"] / calls, 1),
+            "p95_ms": round(durations[math.ceil(0.95 * len(durations)) - 1], 1),
+            "max_ms": round(entry["max_ms"], 1),
+            "rows": entry["rows"],
+            "avg_rows": round(entry["rows"] / calls, 1),
+            "bytes": entry["bytes"],
+            "last_seen": entry["last_seen"]
+        }
+
+    def top(self, limit: int = 20, order_by: str = "total_ms") -> List[Dict[str, Any]]:
+        """Las `limit` consultas con mayor `order_by` (total_ms, calls, p95_ms, rows o bytes)"""
+        if order_by not in self.ORDER_FIELDS:
+            order_by = "total_ms"
+        summaries = [self._summary(statement_id, entry) for statement_id, entry in self._statements.items()]
+        summaries.sort(key=lambda summary: summary[order_by], reverse=True)
+        return summaries[:limit]
+
+    def get_stats(self, limit: int = 20, order_by: str = "total_ms") -> Dict[str, Any]:
+        """Top-N de consultas y registro de consultas lentas (la más reciente primero)"""
+        return {
+            "tracked_statements": len(self._statements),
+            "slow_threshold_ms": self.slow_ms,
+            "order_by": order_by if order_by in self.ORDER_FIELDS else "total_ms",
+            "top": self.top(limit, order_by),
+            "slow_queries": list(reversed(self._slow_log))
+        }
+
+    def clear(self) -> None:
+        self._statements.clear()
+        self._slow_log.clear()
+
+
+# Instancia global de estadísticas de consultas
+statement_stats = StatementStats(
+    slow_ms=float(os.getenv("SLOW_QUERY_MS", "1000")),
+    max_statements=int(os.getenv("STATEMENT_STATS_MAX", "500")),
+    slow_log_size=int(os.getenv("SLOW_QUERY_LOG_SIZE", "100"))
+)
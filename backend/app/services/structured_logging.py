@@ -0,0 +1,87 @@
+"""
+Logging con niveles para el backend (sustituye a los print).
+Los registros se encolan y un hilo aparte los escribe en stdout, de modo que
+el camino de cada petición no espera a la escritura. Con LOG_LEVEL=OFF no se
+escribe nada y con LOG_FORMAT=json cada línea es un objeto JSON con los
+campos pasados en `extra={"fields": {...}}`.
+"""
+from typing import Dict, Any
+from datetime import datetime
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+ROOT_LOGGER = "chatbot"
+_listener: logging.handlers.QueueListener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro: ts, level, logger, msg y los campos extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Mensaje tal cual (con sus marcas [SQL-GEN], [DB]...) y los campos extra como clave=valor"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        fields = getattr(record, "fields", None)
+        if fields:
+            message += " | " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return message
+
+
+def configure_logging(level: str = None, log_format: str = None) -> None:
+    """Configurar el logger raíz del backend (LOG_LEVEL, LOG_FORMAT)"""
+    global _listener
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    log_format = (log_format or os.getenv("LOG_FORMAT", "text")).lower()
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.propagate = False
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    if level == "OFF":
+        # Por encima de CRITICAL: los componentes no llegan a crear registros
+        root.setLevel(logging.CRITICAL + 1)
+        return
+    root.setLevel(getattr(logging, level, logging.INFO))
+
+    # La escritura en stdout la hace el hilo del QueueListener
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+
+
+@atexit.register
+def _flush_logs() -> None:
+    if _listener is not None:
+        _listener.stop()
+
+
+def get_logger(component: str) -> logging.Logger:
+    """Logger de un componente ("sql_gen", "db", "pool"...) bajo el logger del backend"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{component}")
+
+
+configure_logging()
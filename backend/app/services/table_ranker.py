@@ -0,0 +1,128 @@
+"""
+Ranking BM25 de tablas para seleccionar el contexto relevante de una pregunta.
+Cada tabla es un "documento" formado por su nombre, los nombres de sus
+columnas y los valores categóricos perfilados.
+"""
+from typing import Dict, List, Any, Tuple, Iterable
+from collections import Counter, defaultdict
+import re
+import unicodedata
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """Pasar a minúsculas y eliminar acentos ('Categoría' -> 'categoria')"""
+    decomposed = unicodedata.normalize("NFKD", str(text).lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Tokenizar texto o identificadores: separa por caracteres no alfanuméricos
+    (incluido '_'), descarta tokens cortos y aplica un stemming mínimo de
+    plurales para que 'alumnos' coincida con 'alumno'.
+    """
+    tokens = []
+    for token in re.split(r'[^a-z0-9]+', normalize_text(text)):
+        if len(token) < 3 or token.isdigit():
+            continue
+        if len(token) > 4 and token.endswith("es") and token[-3] in "rldnz":
+            # 'profesores' -> 'profesor', 'ciudades' -> 'ciudad'
+            token = token[:-2]
+        elif len(token) > 3 and token.endswith("s"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class BM25TableRanker:
+    """
+    Ranker BM25 con puntuación vectorizada en NumPy.
+
+    Las listas de postings guardan el peso BM25 ya normalizado por longitud
+    de documento, de modo que puntuar una pregunta es sumar, por cada término,
+    un vector de pesos sobre los índices de las tablas que lo contienen.
+    """
+
+    # Peso relativo de cada campo (se repiten los tokens del campo)
+    TABLE_NAME_BOOST = 3
+    COLUMN_BOOST = 1
+    VALUE_BOOST = 1
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.table_names: List[str] = []
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def from_schema(cls, tables: Iterable, data_profile: Dict[str, Any] = None,
+                    k1: float = 1.2, b: float = 0.75) -> "BM25TableRanker":
+        """Construir el ranker a partir del esquema y (opcionalmente) del perfil"""
+        ranker = cls(k1=k1, b=b)
+        documents = []
+        profile_tables = (data_profile or {}).get("tables", {})
+
+        for table in tables:
+            tokens = tokenize(table.table_name) * cls.TABLE_NAME_BOOST
+            for col in table.columns:
+                tokens.extend(tokenize(col["name"]) * cls.COLUMN_BOOST)
+
+            columns_profile = profile_tables.get(table.table_name, {}).get("columns_profile", {})
+            for col_profile in columns_profile.values():
+                for value in col_profile.get("unique_values") or []:
+                    if isinstance(value, str):
+                        tokens.extend(tokenize(value) * cls.VALUE_BOOST)
+
+            ranker.table_names.append(table.table_name.lower())
+            documents.append(Counter(tokens))
+
+        ranker._build(documents)
+        return ranker
+
+    def _build(self, documents: List[Counter]) -> None:
+        """Precalcular pesos BM25 por término y documento"""
+        doc_count = len(documents)
+        if doc_count == 0:
+            return
+
+        doc_lengths = np.array([sum(doc.values()) for doc in documents], dtype=np.float32)
+        avg_length = float(doc_lengths.mean()) or 1.0
+        length_norm = self.k1 * (1 - self.b + self.b * doc_lengths / avg_length)
+
+        term_docs: Dict[str, List[int]] = defaultdict(list)
+        term_freqs: Dict[str, List[int]] = defaultdict(list)
+        for doc_id, doc in enumerate(documents):
+            for term, freq in doc.items():
+                term_docs[term].append(doc_id)
+                term_freqs[term].append(freq)
+
+        for term, doc_ids in term_docs.items():
+            ids = np.array(doc_ids, dtype=np.int32)
+            tf = np.array(term_freqs[term], dtype=np.float32)
+            df = len(doc_ids)
+            idf = np.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            weights = (idf * tf * (self.k1 + 1) / (tf + length_norm[ids])).astype(np.float32)
+            self._postings[term] = (ids, weights)
+
+    def score(self, message: str) -> np.ndarray:
+        """Puntuar todas las tablas para un mensaje (vector de scores)"""
+        scores = np.zeros(len(self.table_names), dtype=np.float32)
+        for term in tokenize(message):
+            posting = self._postings.get(term)
+            if posting is not None:
+                ids, weights = posting
+                scores[ids] += weights
+        return scores
+
+    def rank(self, message: str, top_k: int = None) -> List[Tuple[str, float]]:
+        """
+        Devolver las tablas con score > 0 ordenadas de mayor a menor.
+        Si se indica top_k, solo las k primeras.
+        """
+        scores = self.score(message)
+        candidates = np.flatnonzero(scores)
+        if top_k is not None and len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        ordered = sorted(candidates, key=lambda i: (-scores[i], self.table_names[i]))
+        return [(self.table_names[i], float(scores[i])) for i in ordered]
@@ -0,0 +1,83 @@
+"""
+Índice invertido de valores categóricos perfilados.
+Permite resolver menciones como "Cochabamba" o "activo" directamente a la
+tabla y columna que contienen ese valor.
+"""
+from typing import Dict, List, Any, Tuple
+from collections import defaultdict
+import re
+from app.services.table_ranker import normalize_text
+
+
+class ValueIndex:
+    """
+    Índice: valor normalizado (sin acentos, minúsculas) -> [(tabla, columna, valor original)].
+    La búsqueda recorre las palabras del mensaje y sus n-gramas hasta el
+    número máximo de palabras de un valor indexado: O(palabras).
+    """
+
+    # Valores demasiado cortos generan falsos positivos ('a', 'si', 'no')
+    MIN_VALUE_LENGTH = 3
+
+    def __init__(self):
+        self._index: Dict[str, List[Tuple[str, str, Any]]] = defaultdict(list)
+        self.max_words = 1
+
+    @staticmethod
+    def normalize(value: Any) -> str:
+        """Normalizar un valor: minúsculas, sin acentos y espacios simples"""
+        return " ".join(re.findall(r'[a-z0-9]+', normalize_text(value)))
+
+    @classmethod
+    def from_profile(cls, data_profile: Dict[str, Any] = None) -> "ValueIndex":
+        """Construir el índice a partir del perfil de DataProfiler"""
+        index = cls()
+        for table_name, table_profile in (data_profile or {}).get("tables", {}).items():
+            for col_name, col_profile in table_profile.get("columns_profile", {}).items():
+                for value in col_profile.get("unique_values") or []:
+                    if isinstance(value, str):
+                        index.add(table_name, col_name, value)
+        return index
+
+    def add(self, table_name: str, column_name: str, value: str) -> None:
+        """Agregar un valor al índice"""
+        key = self.normalize(value)
+        if len(key) < self.MIN_VALUE_LENGTH:
+            return
+        self._index[key].append((table_name.lower(), column_name, value))
+        self.max_words = max(self.max_words, key.count(" ") + 1)
+
+    def lookup(self, message: str) -> List[Dict[str, Any]]:
+        """
+        Buscar valores perfilados mencionados en el mensaje.
+        Devuelve [{"table", "column", "value", "mention"}] sin duplicados.
+        """
+        words = self.normalize(message).split()
+        matches = []
+        seen = set()
+
+        for start in range(len(words)):
+            for size in range(min(self.max_words, len(words) - start), 0, -1):
+                mention = " ".join(words[start:start + size])
+                entries = self._index.get(mention)
+                # Admitir plurales simples: 'activos' -> 'activo'
+                if entries is None and size == 1 and mention.endswith("s"):
+                    entries = self._index.get(mention[:-1])
+                if not entries:
+                    continue
+
+                for table_name, column_name, value in entries:
+                    if (table_name, column_name, value) not in seen:
+                        seen.add((table_name, column_name, value))
+                        matches.append({
+                            "table": table_name,
+                            "column": column_name,
+                            "value": value,
+                            "mention": mention
+                        })
+                break
+
+        return matches
+
+    def __len__(self) -> int:
+        return len(self._index)
@@ -0,0 +1,4 @@
+"""
+Benchmarks reproducibles del backend (se ejecutan sin Ollama ni base de datos).
+Uso: python -m benchmarks.<nombre_del_benchmark> desde el directorio backend/
+"""
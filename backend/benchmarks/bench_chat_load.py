@@ -0,0 +1,223 @@
+"""
+Benchmark de carga de /chat de extremo a extremo, sin Ollama ni servidor de BD.
+
+Levanta el Ollama falso (benchmarks.fake_ollama) y el backend con uvicorn en
+el mismo proceso, con las BD de prueba de benchmarks.fixture_db (10, 500 y
+5000 tablas por defecto), y lanza preguntas sintéticas a /api/v1/chat con
+una concurrencia fija. Para cada BD informa del rendimiento (peticiones/s),
+la tasa de éxito y los p50/p95/p99 del total y de cada etapa según la
+cabecera Server-Timing. La primera petición de cada BD (contexto en frío) se
+informa aparte y no entra en las medidas.
+
+Con --json se guardan los resultados; con --baseline se comparan con los de
+una ejecución anterior y el proceso termina con código 1 si algún p95 (o el
+rendimiento) empeora más que --tolerance.
+
+Uso:
+  python -m benchmarks.bench_chat_load [--tables 10,500,5000] [--concurrency 8] [--requests 200]
+  python -m benchmarks.bench_chat_load --prefill-ms-per-token 0.5 --decode-ms-per-token 20 --parallel 2
+  python -m benchmarks.bench_chat_load --json actual.json --baseline base.json [--tolerance 0.2]
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+from typing import Dict, Any, List
+
+import httpx
+
+from app.services.structured_logging import configure_logging
+from benchmarks.eval_schema_format import make_questions
+from benchmarks.fake_ollama import FakeOllama, serve_in_thread
+from benchmarks.fixture_db import FixtureDatabase, install_fixtures
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """'etapa;dur=12.3, total;dur=45.6' -> {"etapa": 12.3, "total": 45.6}"""
+    timings = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.startswith("dur="):
+            timings[name] = float(params[4:])
+    return timings
+
+
+async def send_chat(client: httpx.AsyncClient, database: str, model: str, question: str) -> Dict[str, Any]:
+    body = {
+        "message": question,
+        "model": model,
+        "database_connection": {
+            "type": "postgresql", "host": "fixture", "port": 5432,
+            "database": database, "username": "bench", "password": "bench"
+        }
+    }
+    start = time.perf_counter()
+    response = await client.post("/api/v1/chat", json=body)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    payload = response.json() if response.status_code == 200 else {}
+    return {
+        "status": response.status_code,
+        "success": bool(payload.get("success")),
+        "error": payload.get("error") or (None if response.status_code == 200 else response.text[:200]),
+        "client_ms": elapsed_ms,
+        "timings": parse_server_timing(response.headers.get("server-timing", ""))
+    }
+
+
+async def run_load(client: httpx.AsyncClient, database: str, model: str,
+                   questions: List[str], concurrency: int) -> Dict[str, Any]:
+    """Enviar `questions` con `concurrency` clientes a la vez (cada uno espera su respuesta)"""
+    pending = list(reversed(questions))
+    results: List[Dict[str, Any]] = []
+
+    async def worker():
+        while pending:
+            results.append(await send_chat(client, database, model, pending.pop()))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall_s = time.perf_counter() - start
+
+    stages: Dict[str, List[float]] = {}
+    for result in results:
+        for stage, ms in result["timings"].items():
+            stages.setdefault(stage, []).append(ms)
+    errors: Dict[str, int] = {}
+    for result in results:
+        if not result["success"]:
+            key = result["error"] or f"HTTP {result['status']}"
+            errors[key] = errors.get(key, 0) + 1
+
+    return {
+        "requests": len(results),
+        "concurrency": concurrency,
+        "wall_s": round(wall_s, 3),
+        "throughput_rps": round(len(results) / wall_s, 2),
+        "success_rate": round(sum(r["success"] for r in results) / len(results), 4),
+        "rejected_429": sum(r["status"] == 429 for r in results),
+        "client_ms": {f"p{p}": round(percentile([r["client_ms"] for r in results], p), 1) for p in PERCENTILES},
+        "stages_ms": {
+            stage: {f"p{p}": round(percentile(values, p), 1) for p in PERCENTILES}
+            for stage, values in stages.items()
+        },
+        "errors": errors
+    }
+
+
+def print_report(name: str, table_count: int, cold: Dict[str, Any], report: Dict[str, Any]) -> None:
+    print(f"\n{name} ({table_count} tablas) | {report['requests']} peticiones, concurrencia {report['concurrency']}")
+    cold_timings = ", ".join(f"{stage} {ms:.0f}" for stage, ms in cold["timings"].items())
+    print(f"  primera petición (contexto en frío): {cold['client_ms']:.0f} ms ({cold_timings})")
+    print(f"  rendimiento: {report['throughput_rps']} pet/s | éxito {report['success_rate']:.1%}"
+          f" | 429: {report['rejected_429']}")
+    print(f"  {'etapa':<16}" + "".join(f"{f'p{p} ms':>10}" for p in PERCENTILES))
+    rows = [("cliente", report["client_ms"])] + list(report["stages_ms"].items())
+    for stage, values in rows:
+        print(f"  {stage:<16}" + "".join(f"{values[f'p{p}']:>10.1f}" for p in PERCENTILES))
+    for error, count in report["errors"].items():
+        print(f"  error x{count}: {error}")
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Regresiones frente a una ejecución anterior: p95 por etapa y rendimiento"""
+    regressions = []
+    for name, report in results["databases"].items():
+        previous = baseline.get("databases", {}).get(name)
+        if previous is None:
+            continue
+        if report["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rendimiento {previous['throughput_rps']} -> {report['throughput_rps']} pet/s")
+        for stage, values in report["stages_ms"].items():
+            before = previous["stages_ms"].get(stage, {}).get("p95")
+            # Por debajo de 1 ms la variación es ruido
+            if before is not None and values["p95"] > max(before * (1 + tolerance), before + 1):
+                regressions.append(f"{name}: p95 de {stage} {before} -> {values['p95']} ms")
+    return regressions
+
+
+async def run(args, backend_url: str, fixtures: List[FixtureDatabase]) -> Dict[str, Any]:
+    results = {"config": vars(args), "databases": {}}
+    async with httpx.AsyncClient(base_url=backend_url, timeout=600.0) as client:
+        for fixture in fixtures:
+            rng = random.Random(args.seed)
+            cold = await send_chat(client, fixture.name, args.model, make_questions(fixture.schema, 1, rng)[0])
+            if args.warmup:
+                await run_load(client, fixture.name, args.model,
+                               make_questions(fixture.schema, args.warmup, rng), args.concurrency)
+            report = await run_load(client, fixture.name, args.model,
+                                    make_questions(fixture.schema, args.requests, rng), args.concurrency)
+            report["cold_ms"] = round(cold["client_ms"], 1)
+            results["databases"][fixture.name] = report
+            print_report(fixture.name, fixture.table_count, cold, report)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tables", default="10,500,5000", help="Tamaños de las BD de prueba")
+    parser.add_argument("--rows", type=int, default=100, help="Filas por tabla")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--model", default="qwen2.5-coder:7b")
+    parser.add_argument("--prefill-ms-per-token", type=float, default=0.05)
+    parser.add_argument("--decode-ms-per-token", type=float, default=2.0)
+    parser.add_argument("--load-ms", type=float, default=0.0)
+    parser.add_argument("--parallel", type=int, default=2, help="Generaciones simultáneas del Ollama falso")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Guardar los resultados en este fichero")
+    parser.add_argument("--baseline", help="Resultados (--json) de una ejecución anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Empeoramiento admitido frente a --baseline")
+    args = parser.parse_args()
+
+    fake = FakeOllama(args.prefill_ms_per_token, args.decode_ms_per_token, args.load_ms, args.parallel, [args.model])
+    fixtures = []
+    for table_count in (int(t) for t in args.tables.split(",") if t.strip()):
+        start = time.perf_counter()
+        fixtures.append(FixtureDatabase(table_count, args.rows))
+        print(f"BD de prueba {fixtures[-1].name}: {time.perf_counter() - start:.1f} s")
+
+    with serve_in_thread(fake.app) as ollama_url:
+        # El backend lee su configuración al importarse: antes hay que apuntarlo
+        # al Ollama falso (sin embeddings), ajustar su cola al paralelismo y
+        # rehacer el logging (ya configurado al importar las fixtures)
+        os.environ["OLLAMA_BASE_URL"] = ollama_url
+        os.environ["EMBEDDING_MODEL"] = ""
+        os.environ.setdefault("OLLAMA_MAX_CONCURRENT", str(args.parallel))
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        configure_logging()
+        from app.main import app
+
+        install_fixtures(fixtures)
+        with serve_in_thread(app) as backend_url:
+            results = asyncio.run(run(args, backend_url, fixtures))
+    print(f"\nOllama falso: {fake.stats}")
+    for fixture in fixtures:
+        fixture.close()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as previous:
+            regressions = compare(results, json.load(previous), args.tolerance)
+        for regression in regressions:
+            print(f"⚠️  Regresión: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("\nSin regresiones frente a la ejecución anterior")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Benchmark: salida estructurada (format con esquema JSON) frente a extracción
+con regex de la respuesta en texto ("SQL: ... EXPLICACIÓN: ...").
+
+Mide el tiempo de extracción y la tasa de éxito:
+  - offline: respuestas sintéticas con razonamiento largo antes del SQL
+    (la prosa menciona "select", como hacen los modelos al razonar); se
+    comprueba que se extrae exactamente el SQL esperado.
+  - con Ollama: para cada modelo y pregunta se genera en ambos modos, cada
+    uno con los mensajes de /api/chat que produce en producción (el mismo
+    esquema; cambian las instrucciones de formato), y se mide extracción,
+    SQL extraído y SQL válido (EXPLAIN sobre una copia vacía del esquema en
+    SQLite).
+
+Uso:
+  python -m benchmarks.bench_output_format --offline [--reasoning 40] [--iterations 2000]
+  python -m benchmarks.bench_output_format --models qwen2.5-coder:7b,llama3:8b [--queries 20]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import time
+
+import httpx
+
+from app.services.ollama_service import OllamaService, SQL_RESPONSE_SCHEMA
+from app.services.prompt_assembler import PromptAssembler, token_budget_for_model
+from app.services.query_analyzer import QueryAnalyzer
+from benchmarks.eval_schema_format import build_sqlite, is_valid_sql, make_questions
+from benchmarks.synthetic_schema import generate_catalog
+
+REASONING_LINES = [
+    "Primero hay que decidir qué columnas select conviene devolver para esta pregunta.",
+    "La tabla principal tiene una clave foránea, así que un JOIN podría ser necesario.",
+    "Podríamos hacer select de todo, pero es mejor limitar las columnas; ",
+    "El usuario pide un conteo, por lo que usaremos COUNT(*) con GROUP BY.",
+    "Hay que respetar los valores permitidos de las columnas categóricas.",
+]
+
+
+def extract_text(service: OllamaService, response: str):
+    """Extracción del modo texto (la de producción, con sus print de depuración)"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return service._extract_sql_query(response), service._extract_explanation(response)
+
+
+def extract_json(service: OllamaService, response: str):
+    structured = service._parse_structured_response(response)
+    return structured if structured is not None else (None, None)
+
+
+def synthetic_responses(schema, count: int, reasoning: int, rng: random.Random):
+    """[(sql esperado, respuesta en texto, respuesta JSON)]"""
+    responses = []
+    for _ in range(count):
+        table = rng.choice(schema.tables)
+        column = rng.choice(table.columns)["name"]
+        sql = f"SELECT {column}, COUNT(*) AS total FROM {table.table_name} GROUP BY {column} ORDER BY total DESC LIMIT 10"
+        explanation = f"Cuenta los registros de {table.table_name} por {column}."
+        prose = "\n".join(rng.choice(REASONING_LINES) for _ in range(reasoning))
+        text = f"{prose}\n\nSQL: {sql}\nEXPLICACIÓN: {explanation}"
+        responses.append((sql, text, json.dumps({"sql": sql, "explanation": explanation}, ensure_ascii=False)))
+    return responses
+
+
+def run_offline(service: OllamaService, schema, args) -> None:
+    rng = random.Random(args.seed)
+    responses = synthetic_responses(schema, 50, args.reasoning, rng)
+
+    for name, extract, index in (("text", extract_text, 1), ("json", extract_json, 2)):
+        correct = sum(extract(service, sample[index])[0] == sample[0] for sample in responses)
+        start = time.perf_counter()
+        for iteration in range(args.iterations):
+            extract(service, responses[iteration % len(responses)][index])
+        elapsed_us = (time.perf_counter() - start) / args.iterations * 1e6
+        print(f"{name:>5}: {elapsed_us:8.1f} µs/respuesta | SQL exacto {correct}/{len(responses)}")
+
+
+async def chat(client: httpx.AsyncClient, base_url: str, model: str, messages, structured: bool):
+    payload = {
+        "model": model,
+        "messages": messages,
+        "stream": False,
+        "options": {"temperature": 0, "num_predict": 512}
+    }
+    if structured:
+        payload["format"] = SQL_RESPONSE_SCHEMA
+    response = await client.post(f"{base_url}/api/chat", json=payload)
+    response.raise_for_status()
+    return response.json().get("message", {}).get("content", "")
+
+
+async def run_online(service: OllamaService, schema, profile, args) -> None:
+    analyzer = QueryAnalyzer(schema, profile)
+    assemblers = {mode: PromptAssembler(profile, output_format=mode) for mode in ("text", "json")}
+    questions = make_questions(schema, args.queries, random.Random(args.seed))
+    sqlite_db = build_sqlite(schema)
+    models = [m.strip() for m in args.models.split(",") if m.strip()]
+
+    async with httpx.AsyncClient(timeout=1000.0) as client:
+        for model in models:
+            results = {mode: {"extract_us": [], "answered": 0, "valid": 0, "fallback": 0}
+                       for mode in ("text", "json")}
+            for question in questions:
+                analysis = analyzer.analyze_query(question)
+                focused = analyzer.get_focused_context(analysis)
+                examples = analyzer.generate_example_queries(analysis)
+                for mode, assembler in assemblers.items():
+                    messages, _ = assembler.assemble_chat(schema.database_name, question, focused, analysis,
+                                                          examples, token_budget_for_model(model),
+                                                          schema_tables=schema.tables)
+                    content = await chat(client, args.base_url, model, messages, structured=mode == "json")
+
+                    # Igual que en producción: en modo json, regex solo como respaldo
+                    start = time.perf_counter()
+                    sql, _ = extract_json(service, content) if mode == "json" else extract_text(service, content)
+                    if sql is None and mode == "json":
+                        sql, _ = extract_text(service, content)
+                        results[mode]["fallback"] += 1
+                    results[mode]["extract_us"].append((time.perf_counter() - start) * 1e6)
+
+                    if sql:
+                        results[mode]["answered"] += 1
+                        results[mode]["valid"] += is_valid_sql(sqlite_db, sql)
+
+            print(f"\n{model} | preguntas: {len(questions)}")
+            for mode, result in results.items():
+                line = (f"{mode:>5}: extracción {statistics.mean(result['extract_us']):.1f} µs"
+                        f" | SQL extraído {result['answered']}/{len(questions)}"
+                        f" | SQL válido {result['valid']}/{len(questions)}")
+                if mode == "json":
+                    line += f" | respaldo regex {result['fallback']}"
+                print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tables", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--models", default="qwen2.5-coder:7b")
+    parser.add_argument("--base-url", default=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434").split(",")[0])
+    parser.add_argument("--offline", action="store_true", help="Solo respuestas sintéticas, sin Ollama")
+    parser.add_argument("--reasoning", type=int, default=40, help="Líneas de razonamiento antes del SQL (offline)")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+
+    schema, profile = generate_catalog(args.tables)
+    service = OllamaService(args.base_url)
+    if args.offline:
+        run_offline(service, schema, args)
+    else:
+        asyncio.run(run_online(service, schema, profile, args))
+
+
+if __name__ == "__main__":
+    main()
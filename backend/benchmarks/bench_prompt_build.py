@@ -0,0 +1,90 @@
+"""
+Benchmark: tiempo de construcción del prompt para contextos focalizados de
+50 tablas. Compara el renderizado anterior (concatenación con += y búsquedas
+en data_profile por columna) con los mensajes de /api/chat que ensambla
+assemble_chat a partir de los fragmentos por tabla cacheados. No se pasa el
+esquema completo, así que el mensaje de sistema es el de las tablas
+focalizadas (el camino de las BD que no caben en el presupuesto).
+
+Uso: python -m benchmarks.bench_prompt_build [--tables 500] [--focused 50] [--iterations 200]
+"""
+import argparse
+import time
+
+from app.services.prompt_assembler import PromptAssembler
+from app.services.query_analyzer import QueryAnalyzer
+from benchmarks.synthetic_schema import generate_catalog
+
+
+def legacy_render(database_name, data_profile, focused_context, query_analysis):
+    """Renderizado de tablas previo: += por línea y lookups por columna"""
+    prompt = f"Base de datos: **{database_name}**\n"
+    for table in focused_context["tables"]:
+        prompt += f"\n### 🔹 TABLA: `{table.table_name}`\n"
+        table_profile = None
+        if data_profile and "tables" in data_profile:
+            table_profile = data_profile["tables"].get(table.table_name, {})
+        if table_profile and "row_count" in table_profile:
+            prompt += f"  📊 Registros: {table_profile['row_count']}\n"
+        prompt += "\n**COLUMNAS:**\n"
+        mentioned_cols = query_analysis.get("mentioned_columns", {}).get(table.table_name, [])
+        for col in table.columns:
+            mention_mark = " ⭐ [MENCIONADA]" if col['name'].lower() in mentioned_cols else ""
+            col_info = f"  • `{col['name']}` ({col['type']}){mention_mark}"
+            if col['name'] in table.primary_keys:
+                col_info += " 🔑 [PK]"
+            if not col['nullable']:
+                col_info += " [NOT NULL]"
+            prompt += col_info + "\n"
+            if table_profile and "columns_profile" in table_profile:
+                col_profile = table_profile["columns_profile"].get(col['name'])
+                if col_profile and col_profile.get("unique_values"):
+                    formatted = [f"'{v}'" if isinstance(v, str) else str(v) for v in col_profile["unique_values"]]
+                    prompt += f"    ⚠️  VALORES PERMITIDOS: {', '.join(formatted)}\n"
+        prompt += "\n"
+    return prompt
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tables", type=int, default=500)
+    parser.add_argument("--focused", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    schema, profile = generate_catalog(args.tables)
+    analyzer = QueryAnalyzer(schema, profile)
+    message = "nombre, estado y ciudad de clientes, pedidos, ventas y facturas activas"
+    analysis = analyzer.analyze_query(message)
+    analysis["relevant_tables"] = set(analyzer.table_names[:args.focused])
+    focused = analyzer.get_focused_context(analysis, max_tables=args.focused)
+    examples = analyzer.generate_example_queries(analysis)
+    budget = 10 ** 9  # Sin recorte: se mide solo el renderizado
+
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        legacy_render(schema.database_name, profile, focused, analysis)
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        PromptAssembler(profile).assemble_chat(schema.database_name, message, focused, analysis, examples, budget)
+    cold = time.perf_counter() - start
+
+    assembler = PromptAssembler(profile)
+    assembler.assemble_chat(schema.database_name, message, focused, analysis, examples, budget)
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        messages, stats = assembler.assemble_chat(schema.database_name, message, focused, analysis, examples, budget)
+    warm = time.perf_counter() - start
+
+    prompt_chars = sum(len(m["content"]) for m in messages)
+    print(f"Tablas focalizadas: {focused['focused_table_count']} | prompt: {prompt_chars} caracteres, "
+          f"~{stats['estimated_tokens']} tokens | iteraciones: {args.iterations}")
+    print(f"Renderizado anterior (+=):               {legacy * 1000 / args.iterations:.3f} ms/prompt")
+    print(f"Ensamblador sin caché (fragmentos nuevos): {cold * 1000 / args.iterations:.3f} ms/prompt")
+    print(f"Ensamblador con fragmentos cacheados:     {warm * 1000 / args.iterations:.3f} ms/prompt")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark: precisión y latencia de la selección de tablas relevantes.
+Compara la unión booleana de estrategias (sin recorte) con el ranking BM25
+recortado a `--top-k` tablas.
+
+Cada pregunta sintética menciona el nombre de una tabla objetivo más una
+columna común (p.ej. 'nombre'), que en la unión booleana arrastra a todas
+las tablas que tienen esa columna.
+
+Uso: python -m benchmarks.bench_table_ranking [--tables 500] [--queries 200] [--top-k 10]
+"""
+import argparse
+import random
+import time
+
+from app.services.query_analyzer import QueryAnalyzer
+from benchmarks.synthetic_schema import generate_catalog, COLUMN_WORDS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tables", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=QueryAnalyzer.MAX_FOCUSED_TABLES)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    schema, profile = generate_catalog(args.tables)
+    analyzer = QueryAnalyzer(schema, profile)
+
+    questions = []
+    for _ in range(args.queries):
+        target = rng.choice(schema.tables)
+        column = rng.choice([c["name"] for c in target.columns if c["name"] in COLUMN_WORDS])
+        words = target.table_name.replace("_", " ")
+        questions.append((target.table_name.lower(), f"muestra el {column} de {words}"))
+
+    union_precision = union_recall = 0.0
+    ranked_precision = ranked_recall = 0.0
+    union_time = ranked_time = 0.0
+    ranked_top1 = 0
+
+    for target, question in questions:
+        message = question.lower()
+
+        start = time.perf_counter()
+        selected = analyzer._extract_relevant_tables_dynamic(message)
+        union_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        ranked = [t for t, _ in analyzer.table_ranker.rank(message, top_k=args.top_k)]
+        ranked_time += time.perf_counter() - start
+
+        if selected:
+            union_precision += (target in selected) / len(selected)
+        union_recall += target in selected
+        if ranked:
+            ranked_precision += (target in ranked) / len(ranked)
+        ranked_recall += target in ranked
+        ranked_top1 += ranked[:1] == [target]
+
+    n = len(questions)
+    print(f"Tablas: {args.tables} | preguntas: {n} | top-k: {args.top_k}")
+    print(f"Unión booleana: precisión {union_precision / n:.3f} | recall {union_recall / n:.3f} | "
+          f"{union_time * 1000 / n:.3f} ms/pregunta")
+    print(f"BM25 top-k:     precisión {ranked_precision / n:.3f} | recall {ranked_recall / n:.3f} | "
+          f"acierto top-1 {ranked_top1 / n:.3f} | {ranked_time * 1000 / n:.3f} ms/pregunta")
+
+
+if __name__ == "__main__":
+    main()
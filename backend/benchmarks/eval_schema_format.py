@@ -0,0 +1,137 @@
+"""
+Evaluación: formato de esquema 'markdown' (actual) vs 'compact' (tipo DDL).
+
+Para cada pregunta sintética y cada formato se ensamblan los mensajes de
+/api/chat como en producción (assemble_chat con el esquema completo) y se mide:
+  - tokens estimados del prompt (sin Ollama)
+  - tokens reales y tiempo de prefill según Ollama (`prompt_eval_count`,
+    `prompt_eval_duration`)
+  - validez del SQL generado: se extrae igual que en producción y se prepara
+    (EXPLAIN) sobre una copia vacía del esquema en SQLite en memoria, lo que
+    detecta errores de sintaxis y tablas/columnas inexistentes.
+
+Uso:
+  python -m benchmarks.eval_schema_format --offline            # solo tokens
+  python -m benchmarks.eval_schema_format --model qwen2.5-coder:7b [--queries 20]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+
+import httpx
+
+from app.services.ollama_service import OllamaService
+from app.services.prompt_assembler import PromptAssembler, SCHEMA_DIALECTS, token_budget_for_model
+from app.services.query_analyzer import QueryAnalyzer
+from benchmarks.synthetic_schema import generate_catalog, CATEGORICAL_VALUES
+
+
+def build_sqlite(schema) -> sqlite3.Connection:
+    """Crear las tablas del esquema (vacías) en SQLite para validar el SQL"""
+    connection = sqlite3.connect(":memory:")
+    for table in schema.tables:
+        columns = ", ".join(f'"{col["name"]}" {col["type"]}' for col in table.columns)
+        connection.execute(f'CREATE TABLE "{table.table_name}" ({columns})')
+    return connection
+
+
+def is_valid_sql(connection: sqlite3.Connection, sql: str) -> bool:
+    try:
+        connection.execute(f"EXPLAIN {sql.rstrip(';')}")
+        return True
+    except sqlite3.Error:
+        return False
+
+
+def make_questions(schema, count: int, rng: random.Random):
+    """Preguntas de conteo, agregación y filtro por valor sobre tablas al azar"""
+    questions = []
+    for _ in range(count):
+        table = rng.choice(schema.tables)
+        words = table.table_name.replace("_", " ")
+        categorical = [c["name"] for c in table.columns if c["name"] in CATEGORICAL_VALUES]
+        if categorical and rng.random() < 0.5:
+            column = rng.choice(categorical)
+            value = rng.choice(CATEGORICAL_VALUES[column])
+            questions.append(f"lista de {words} con {column} {value}")
+        elif categorical:
+            questions.append(f"cuantos {words} hay por {rng.choice(categorical)}")
+        else:
+            questions.append(f"cuantos registros de {words} hay")
+    return questions
+
+
+async def run_ollama(client: httpx.AsyncClient, base_url: str, model: str, messages):
+    response = await client.post(f"{base_url}/api/chat", json={
+        "model": model,
+        "messages": messages,
+        "stream": False,
+        "options": {"temperature": 0, "num_predict": 512}
+    })
+    response.raise_for_status()
+    return response.json()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tables", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--model", default="qwen2.5-coder:7b")
+    parser.add_argument("--base-url", default=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"))
+    parser.add_argument("--offline", action="store_true", help="Solo comparar tokens estimados")
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+
+    schema, profile = generate_catalog(args.tables)
+    analyzer = QueryAnalyzer(schema, profile)
+    questions = make_questions(schema, args.queries, random.Random(args.seed))
+    assemblers = {name: PromptAssembler(profile, name) for name in SCHEMA_DIALECTS}
+    budget = token_budget_for_model(args.model)
+    service = OllamaService(args.base_url)
+    sqlite_db = build_sqlite(schema)
+
+    results = {name: {"estimated": [], "prompt_tokens": [], "prefill_ms": [], "valid": 0, "answered": 0,
+                      "full_schema": 0}
+               for name in SCHEMA_DIALECTS}
+
+    async with httpx.AsyncClient(timeout=1000.0) as client:
+        for question in questions:
+            analysis = analyzer.analyze_query(question)
+            focused = analyzer.get_focused_context(analysis)
+            examples = analyzer.generate_example_queries(analysis)
+
+            for name, assembler in assemblers.items():
+                messages, stats = assembler.assemble_chat(schema.database_name, question, focused,
+                                                          analysis, examples, budget,
+                                                          schema_tables=schema.tables)
+                result = results[name]
+                result["estimated"].append(stats["estimated_tokens"])
+                result["full_schema"] += stats["prefix_mode"] == "full_schema"
+                if args.offline:
+                    continue
+
+                data = await run_ollama(client, args.base_url, args.model, messages)
+                result["prompt_tokens"].append(data.get("prompt_eval_count", 0))
+                result["prefill_ms"].append(data.get("prompt_eval_duration", 0) / 1e6)
+                sql = service._extract_sql_query(data.get("message", {}).get("content", ""))
+                if sql:
+                    result["answered"] += 1
+                    result["valid"] += is_valid_sql(sqlite_db, sql)
+
+    print(f"\nTablas: {args.tables} | preguntas: {len(questions)} | presupuesto: {budget} tokens")
+    for name, result in results.items():
+        line = (f"{name:>9}: ~{statistics.mean(result['estimated']):.0f} tokens estimados"
+                f" (esquema completo en {result['full_schema']}/{len(questions)})")
+        if not args.offline:
+            line += (f" | {statistics.mean(result['prompt_tokens']):.0f} tokens reales"
+                     f" | prefill {statistics.mean(result['prefill_ms']):.0f} ms"
+                     f" | SQL válido {result['valid']}/{len(questions)}"
+                     f" (extraído {result['answered']})")
+        print(line)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,208 @@
+"""
+Servidor local que imita la API de Ollama para los benchmarks de carga.
+
+Responde /api/tags, /api/ps, /api/show, /api/generate y /api/chat sin
+modelo: cada /api/chat espera el tiempo de prefill (ms por token evaluado)
+y de decodificación (ms por token generado) configurados y devuelve un SQL
+enlatado sobre la primera tabla de "Tablas relevantes" del mensaje, en JSON
+({"sql", "explanation"}) si la petición trae `format` o en texto
+("SQL: ... EXPLICACIÓN: ...") si no. Como Ollama:
+  - si el prompt de sistema es el mismo que el anterior del modelo, solo se
+    evalúa el resto (reutilización de la caché KV);
+  - la primera petición de un modelo paga la carga (`load_duration`);
+  - solo se atienden `parallel` generaciones a la vez; el resto espera.
+
+Uso:
+  python -m benchmarks.fake_ollama [--port 11434] [--prefill-ms-per-token 0.5] [--decode-ms-per-token 20]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import re
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List
+
+import uvicorn
+from fastapi import FastAPI
+
+from app.services.prompt_assembler import estimate_tokens
+
+RELEVANT_TABLES = re.compile(r"Tablas relevantes: `([^`]+)`")
+QUESTION = re.compile(r'PREGUNTA DEL USUARIO:\s*\**"(.*)"')
+
+
+class FakeOllama:
+    """Estado del servidor falso: modelos cargados, prefijo por modelo y contadores"""
+
+    def __init__(self,
+                 prefill_ms_per_token: float = 0.5,
+                 decode_ms_per_token: float = 20.0,
+                 load_ms: float = 0.0,
+                 parallel: int = 1,
+                 models: List[str] = None):
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self.decode_ms_per_token = decode_ms_per_token
+        self.load_ms = load_ms
+        self.models = models or ["qwen2.5-coder:7b"]
+        self._slots = asyncio.Semaphore(max(1, parallel))
+        self._loaded: Dict[str, float] = {}
+        self._last_prefix: Dict[str, str] = {}
+        self.stats = {"chat": 0, "prompt_tokens": 0, "reused_prefix": 0, "eval_tokens": 0}
+        self.app = self._build_app()
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI(title="Ollama falso")
+
+        @app.get("/api/tags")
+        async def tags():
+            return {"models": [self._model_entry(name) for name in self.models]}
+
+        @app.get("/api/ps")
+        async def ps():
+            return {"models": [self._model_entry(name) for name in self._loaded]}
+
+        @app.post("/api/show")
+        async def show(body: Dict[str, Any]):
+            return {
+                "model_info": {"general.architecture": "llama", "llama.context_length": 32768},
+                "details": self._model_entry(body.get("model") or body.get("name", ""))["details"]
+            }
+
+        @app.post("/api/generate")
+        async def generate(body: Dict[str, Any]):
+            model = body.get("model", "")
+            if body.get("keep_alive") == 0:
+                self._loaded.pop(model, None)
+                return {"model": model, "done": True, "done_reason": "unload"}
+            load_ns = await self._ensure_loaded(model)
+            return {"model": model, "response": "", "done": True, "load_duration": load_ns}
+
+        @app.post("/api/chat")
+        async def chat(body: Dict[str, Any]):
+            return await self.chat(body)
+
+        return app
+
+    @staticmethod
+    def _model_entry(name: str) -> Dict[str, Any]:
+        return {
+            "name": name,
+            "model": name,
+            "size": 4_700_000_000,
+            "modified_at": "2024-01-01T00:00:00Z",
+            "details": {"family": "llama", "parameter_size": "7B", "quantization_level": "Q4_K_M"}
+        }
+
+    async def _ensure_loaded(self, model: str) -> int:
+        """Cargar el modelo si no lo está; devuelve load_duration (ns)"""
+        if model in self._loaded:
+            return 0
+        await asyncio.sleep(self.load_ms / 1000)
+        self._loaded[model] = time.time()
+        return int(self.load_ms * 1e6)
+
+    async def chat(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        model = body.get("model", "")
+        messages = body.get("messages", [])
+        system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        rest = "".join(m.get("content", "") for m in messages if m.get("role") != "system")
+
+        content = self.canned_response(rest, structured=bool(body.get("format")))
+        eval_count = max(1, estimate_tokens(content))
+
+        async with self._slots:
+            load_ns = await self._ensure_loaded(model)
+            # Con el mismo prefijo de sistema que la vez anterior solo se evalúa el resto
+            prefix_hash = hashlib.sha1(system.encode()).hexdigest()
+            reused = self._last_prefix.get(model) == prefix_hash
+            self._last_prefix[model] = prefix_hash
+            prompt_eval_count = estimate_tokens(rest) + (0 if reused else estimate_tokens(system))
+
+            prefill_ms = prompt_eval_count * self.prefill_ms_per_token
+            decode_ms = eval_count * self.decode_ms_per_token
+            await asyncio.sleep((prefill_ms + decode_ms) / 1000)
+
+        self.stats["chat"] += 1
+        self.stats["prompt_tokens"] += prompt_eval_count
+        self.stats["reused_prefix"] += reused
+        self.stats["eval_tokens"] += eval_count
+        return {
+            "model": model,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((prefill_ms + decode_ms) * 1e6) + load_ns,
+            "load_duration": load_ns,
+            "prompt_eval_count": prompt_eval_count,
+            "prompt_eval_duration": int(prefill_ms * 1e6),
+            "eval_count": eval_count,
+            "eval_duration": int(decode_ms * 1e6)
+        }
+
+    @staticmethod
+    def canned_response(user_turn: str, structured: bool) -> str:
+        """SQL enlatado sobre la primera tabla relevante (conteo o listado según la pregunta)"""
+        match = RELEVANT_TABLES.search(user_turn)
+        if match is None:
+            sql, explanation = "SELECT 1 AS resultado", "No se identificó ninguna tabla."
+        else:
+            table = match.group(1)
+            question = QUESTION.search(user_turn)
+            if question and "cuant" in question.group(1).lower():
+                sql = f'SELECT COUNT(*) AS total FROM "{table}"'
+                explanation = f"Cuenta los registros de {table}."
+            else:
+                sql = f'SELECT * FROM "{table}" LIMIT 20'
+                explanation = f"Lista los primeros registros de {table}."
+        if structured:
+            return json.dumps({"sql": sql, "explanation": explanation}, ensure_ascii=False)
+        return f"SQL: {sql}\nEXPLICACIÓN: {explanation}"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def serve_in_thread(app, port: int = None):
+    """Servir una app ASGI con uvicorn en un hilo aparte; devuelve su URL"""
+    port = port or free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port,
+                                           log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError(f"No se pudo arrancar el servidor en el puerto {port}")
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--prefill-ms-per-token", type=float, default=0.5)
+    parser.add_argument("--decode-ms-per-token", type=float, default=20.0)
+    parser.add_argument("--load-ms", type=float, default=0.0, help="Carga en frío de cada modelo")
+    parser.add_argument("--parallel", type=int, default=1, help="Generaciones simultáneas (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--models", default="qwen2.5-coder:7b")
+    args = parser.parse_args()
+
+    fake = FakeOllama(args.prefill_ms_per_token, args.decode_ms_per_token, args.load_ms, args.parallel,
+                      [m.strip() for m in args.models.split(",") if m.strip()])
+    uvicorn.run(fake.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Bases de datos de prueba para los benchmarks de carga, sin servidor de BD.
+
+Cada fixture es un catálogo sintético (synthetic_schema: tablas con FKs y
+columnas categóricas perfiladas) cargado con filas en una base SQLite en un
+fichero temporal. `install_fixtures` hace que el backend las use como si
+fueran PostgreSQL: el análisis del esquema y el perfilado devuelven el
+catálogo y DatabaseService abre conexiones SQLite detrás de un adaptador que
+entiende lo que el backend envía a PostgreSQL (SET, EXPLAIN (FORMAT JSON),
+EXPLAIN).
+
+Uso (genera las fixtures y muestra su tamaño):
+  python -m benchmarks.fixture_db [--tables 10,500,5000] [--rows 100]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from typing import Dict, Any, Iterable, List
+
+from app.models.database import DatabaseSchema
+from app.services.data_profiler import DataProfiler
+from app.services.database_service import DatabaseService
+from app.services.schema_analyzer import SchemaAnalyzer
+from benchmarks.synthetic_schema import generate_catalog, CATEGORICAL_VALUES
+
+DATE_COLUMNS = {"fecha", "creado_en", "actualizado_en"}
+NUMERIC_COLUMNS = {"monto", "cantidad", "precio", "total"}
+DATES = [f"2024-{month:02d}-{day:02d}" for month in range(1, 13) for day in range(1, 29)]
+
+
+class FixtureDatabase:
+    """Catálogo sintético y su copia con datos en SQLite (fichero temporal)"""
+
+    def __init__(self, table_count: int, rows: int = 100, seed: int = 42):
+        self.table_count = table_count
+        self.rows = rows
+        self.schema, self.profile = generate_catalog(table_count, seed)
+        # En fichero y no en memoria compartida (cache=shared): cada petición
+        # abre su conexión y en memoria compartida las lecturas se serializan
+        self._directory = tempfile.TemporaryDirectory(prefix="bench_db_")
+        self.path = os.path.join(self._directory.name, f"{self.name}.db")
+        self._populate(random.Random(seed))
+
+    @property
+    def name(self) -> str:
+        return self.schema.database_name
+
+    def _populate(self, rng: random.Random) -> None:
+        connection = sqlite3.connect(self.path, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=OFF")
+        connection.execute("PRAGMA synchronous=OFF")
+        # Una sola transacción: SQLite no relee el esquema tras cada CREATE
+        connection.execute("BEGIN")
+        for table in self.schema.tables:
+            columns = ", ".join(f'"{col["name"]}" {col["type"]}' for col in table.columns)
+            connection.execute(f'CREATE TABLE "{table.table_name}" ({columns})')
+            fk_columns = {fk["column"] for fk in table.foreign_keys}
+            values = [self._column_values(col["name"], fk_columns, rng) for col in table.columns]
+            placeholders = ", ".join("?" for _ in table.columns)
+            connection.executemany(f'INSERT INTO "{table.table_name}" VALUES ({placeholders})', zip(*values))
+        connection.execute("COMMIT")
+        connection.close()
+
+    def _column_values(self, column: str, fk_columns, rng: random.Random) -> List[Any]:
+        """Valores de una columna para todas las filas (ids, FKs válidas y categorías del perfil)"""
+        if column == "id":
+            return list(range(1, self.rows + 1))
+        if column in fk_columns:
+            return rng.choices(range(1, self.rows + 1), k=self.rows)
+        if column in CATEGORICAL_VALUES:
+            return rng.choices([int(v) if isinstance(v, bool) else v for v in CATEGORICAL_VALUES[column]], k=self.rows)
+        if column in DATE_COLUMNS:
+            return rng.choices(DATES, k=self.rows)
+        if column in NUMERIC_COLUMNS:
+            return [round(rng.uniform(1, 10_000), 2) for _ in range(self.rows)]
+        return [f"{column}_{row_id}" for row_id in range(1, self.rows + 1)]
+
+    def connect(self) -> "SQLiteStandIn":
+        return SQLiteStandIn(sqlite3.connect(self.path, check_same_thread=False), self.rows)
+
+    def close(self) -> None:
+        self._directory.cleanup()
+
+
+class SQLiteStandIn:
+    """Conexión SQLite con la interfaz de psycopg2 que usa DatabaseService"""
+
+    def __init__(self, connection: sqlite3.Connection, table_rows: int):
+        self._connection = connection
+        self._table_rows = table_rows
+
+    def cursor(self, *args) -> "SQLiteStandInCursor":
+        return SQLiteStandInCursor(self._connection.cursor(), self._table_rows)
+
+    def cancel(self) -> None:
+        self._connection.interrupt()
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class SQLiteStandInCursor:
+    """Traduce SET y EXPLAIN de PostgreSQL; el resto se ejecuta tal cual"""
+
+    def __init__(self, cursor: sqlite3.Cursor, table_rows: int):
+        self._cursor = cursor
+        self._table_rows = table_rows
+        self._rows: List[tuple] = None
+
+    @property
+    def description(self):
+        return self._cursor.description if self._rows is None else None
+
+    def execute(self, sql: str, params: Iterable = ()) -> None:
+        statement = sql.strip()
+        upper = statement[:24].upper()
+        self._rows = None
+        if upper.startswith("SET "):
+            self._rows = []
+        elif upper.startswith("EXPLAIN (FORMAT JSON)"):
+            # Valida la consulta con el planificador de SQLite y devuelve un plan
+            # con la forma del de PostgreSQL (coste y filas de una tabla completa)
+            self._cursor.execute(f"EXPLAIN QUERY PLAN {statement[len('EXPLAIN (FORMAT JSON)'):]}", params)
+            self._cursor.fetchall()
+            plan = [{"Plan": {"Total Cost": float(self._table_rows), "Plan Rows": self._table_rows}}]
+            self._rows = [(plan,)]
+        elif upper.startswith("EXPLAIN "):
+            self._cursor.execute(f"EXPLAIN QUERY PLAN {statement[len('EXPLAIN '):]}", params)
+        else:
+            self._cursor.execute(statement, params)
+
+    def fetchall(self) -> List[tuple]:
+        if self._rows is not None:
+            rows, self._rows = self._rows, []
+            return rows
+        return self._cursor.fetchall()
+
+    def fetchone(self):
+        if self._rows is not None:
+            return self._rows.pop(0) if self._rows else None
+        return self._cursor.fetchone()
+
+    def close(self) -> None:
+        self._cursor.close()
+
+
+def install_fixtures(fixtures: List[FixtureDatabase]) -> None:
+    """
+    Servir las fixtures al backend por nombre de BD (el `database` de la
+    conexión). El esquema y el perfil se devuelven ya calculados: las etapas
+    schema_analysis y profiling solo miden el trabajo en proceso.
+    """
+    by_name: Dict[str, FixtureDatabase] = {fixture.name: fixture for fixture in fixtures}
+
+    def fixture_for(service) -> FixtureDatabase:
+        return by_name[service.db_connection.database]
+
+    def analyze_schema(self) -> DatabaseSchema:
+        return fixture_for(self).schema.model_copy(deep=True)
+
+    def profile_database(self, tables) -> Dict[str, Any]:
+        return fixture_for(self).profile
+
+    SchemaAnalyzer.analyze_schema = analyze_schema
+    SchemaAnalyzer.test_connection = lambda self: self.db_connection.database in by_name
+    DataProfiler.profile_database = profile_database
+    DatabaseService.get_connection = lambda self: fixture_for(self).connect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tables", default="10,500,5000")
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    for table_count in (int(t) for t in args.tables.split(",") if t.strip()):
+        start = time.perf_counter()
+        fixture = FixtureDatabase(table_count, args.rows, args.seed)
+        elapsed = time.perf_counter() - start
+        fks = sum(len(table.foreign_keys) for table in fixture.schema.tables)
+        categorical = sum(len(table["columns_profile"]) for table in fixture.profile["tables"].values())
+        print(f"{fixture.name}: {table_count} tablas, {fks} FKs, {categorical} columnas categóricas, "
+              f"{table_count * args.rows} filas en {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Generador de catálogos sintéticos (esquema + perfil de datos) para benchmarks.
+"""
+import random
+from typing import Dict, Any, Tuple
+from app.models.database import DatabaseSchema, TableSchema
+
+ENTITY_WORDS = [
+    "alumno", "curso", "docente", "materia", "nota", "factura", "cliente",
+    "producto", "venta", "compra", "proveedor", "empleado", "sucursal",
+    "inventario", "pedido", "pago", "carrera", "facultad", "inscripcion",
+    "horario", "aula", "gestion", "usuario", "rol", "permiso", "ciudad",
+    "departamento", "contrato", "beca", "asistencia"
+]
+
+SUFFIX_WORDS = [
+    "detalle", "historial", "registro", "resumen", "log", "tipo", "estado",
+    "categoria", "archivo", "auditoria", "temporal", "periodo"
+]
+
+COLUMN_WORDS = [
+    "nombre", "descripcion", "fecha", "monto", "cantidad", "estado", "codigo",
+    "observacion", "precio", "total", "email", "telefono", "direccion",
+    "ciudad", "tipo", "activo", "creado_en", "actualizado_en"
+]
+
+CATEGORICAL_VALUES = {
+    "estado": ["activo", "inactivo", "pendiente", "anulado"],
+    "ciudad": ["Cochabamba", "La Paz", "Santa Cruz", "Sucre", "Oruro", "Tarija"],
+    "tipo": ["regular", "especial", "temporal"],
+    "activo": [True, False],
+}
+
+
+def generate_catalog(table_count: int, seed: int = 42) -> Tuple[DatabaseSchema, Dict[str, Any]]:
+    """
+    Generar un esquema sintético con `table_count` tablas, FKs hacia tablas
+    anteriores y columnas categóricas perfiladas.
+    Devuelve (schema, data_profile) con el mismo formato que DataProfiler.
+    """
+    rng = random.Random(seed)
+    tables = []
+    profile = {"tables": {}}
+    used_names = set()
+
+    for i in range(table_count):
+        name = f"{rng.choice(ENTITY_WORDS)}_{rng.choice(SUFFIX_WORDS)}"
+        if name in used_names:
+            name = f"{name}_{i}"
+        used_names.add(name)
+
+        columns = [{"name": "id", "type": "integer", "nullable": False,
+                    "default": None, "max_length": None}]
+        for col_name in rng.sample(COLUMN_WORDS, rng.randint(3, 8)):
+            col_type = "boolean" if col_name == "activo" else "character varying"
+            columns.append({"name": col_name, "type": col_type, "nullable": True,
+                            "default": None, "max_length": 50})
+
+        foreign_keys = []
+        if tables:
+            for target in rng.sample(tables, min(len(tables), rng.randint(0, 2))):
+                fk_column = f"{target.table_name}_id"
+                columns.append({"name": fk_column, "type": "integer", "nullable": True,
+                                "default": None, "max_length": None})
+                foreign_keys.append({
+                    "column": fk_column,
+                    "referenced_table": target.table_name,
+                    "referenced_column": "id"
+                })
+
+        table = TableSchema(
+            table_name=name,
+            columns=columns,
+            primary_keys=["id"],
+            foreign_keys=foreign_keys
+        )
+        tables.append(table)
+
+        columns_profile = {}
+        for col in columns:
+            values = CATEGORICAL_VALUES.get(col["name"])
+            if values:
+                columns_profile[col["name"]] = {
+                    "unique_values": list(values),
+                    "sample_values": [],
+                    "total_count": 1000,
+                    "null_count": 0,
+                    "distinct_count": len(values),
+                    "value_distribution": {str(v): rng.randint(1, 500) for v in values}
+                }
+        profile["tables"][name] = {
+            "table_name": name,
+            "columns_profile": columns_profile,
+            "row_count": rng.randint(10, 1_000_000)
+        }
+
+    schema = DatabaseSchema(database_name=f"sintetica_{table_count}", tables=tables)
+    return schema, profile
+
+
+def typo(word: str, rng: random.Random) -> str:
+    """Introducir un error tipográfico simple (intercambio o eliminación)"""
+    if len(word) < 4:
+        return word
+    pos = rng.randint(1, len(word) - 2)
+    if rng.random() < 0.5:
+        return word[:pos] + word[pos + 1] + word[pos] + word[pos + 2:]
+    return word[:pos] + word[pos + 1:]
@@ -0,0 +1,65 @@
+"""
+num_ctx de las peticiones a Ollama (OllamaService): la precarga usa el
+mínimo y cada pregunta lo sube solo si su prompt no cabe, así que un prompt
+corto no paga la caché KV de la ventana completa.
+
+Uso (desde backend/): python -m pytest -q tests
+"""
+import asyncio
+
+from app.services.ollama_service import OllamaService
+from app.services.prompt_assembler import MIN_NUM_CTX, num_ctx_for_prompt
+
+MODEL = "qwen2.5-coder:7b"
+WINDOW = 32768
+
+
+class FakeResponse:
+    status_code = 200
+
+    def json(self):
+        return {"load_duration": 0}
+
+
+def make_service():
+    """Servicio con el pool sustituido: guarda los payloads enviados a Ollama"""
+    service = OllamaService("http://ollama.test:11434")
+    sent = []
+
+    async def request(method, path, **kwargs):
+        sent.append(kwargs.get("json"))
+        return FakeResponse(), "http://ollama.test:11434"
+
+    service.pool.request = request
+    return service, sent
+
+
+def test_preload_uses_the_minimum_num_ctx():
+    service, sent = make_service()
+    result = asyncio.run(service.preload_model(MODEL))
+    assert result["success"]
+    assert sent[-1]["options"]["num_ctx"] == MIN_NUM_CTX
+
+
+def test_short_prompt_after_preload_gets_a_small_num_ctx():
+    service, _ = make_service()
+    asyncio.run(service.preload_model(MODEL))
+    assert service._request_num_ctx(MODEL, 300, WINDOW) == MIN_NUM_CTX
+
+
+def test_num_ctx_only_grows_when_a_prompt_needs_more():
+    service, _ = make_service()
+    asyncio.run(service.preload_model(MODEL))
+
+    large = service._request_num_ctx(MODEL, 6000, WINDOW)
+    assert large == num_ctx_for_prompt(6000, MODEL, WINDOW) > MIN_NUM_CTX
+    # Un prompt corto después no lo baja (obligaría a recargar el modelo)
+    assert service._request_num_ctx(MODEL, 300, WINDOW) == large
+    # Ni supera la ventana del modelo
+    assert service._request_num_ctx(MODEL, 10 ** 6, WINDOW) == WINDOW
+
+
+def test_learned_prefix_sets_the_floor():
+    service, _ = make_service()
+    session = {"prefill": {"num_ctx": 16384}}
+    assert service._request_num_ctx(MODEL, 300, WINDOW, session) == 16384
@@ -0,0 +1,170 @@
+"""
+Control de admisión de OllamaPool: los huecos libres se reparten por
+prioridad y orden de llegada, una cola demasiado larga se rechaza
+(QueueFullError -> 429 en /chat) y las esperas canceladas no se quedan con
+ningún hueco. Sin red: el pool no llega a enviar ninguna petición.
+
+Uso (desde backend/): python -m pytest -q tests
+"""
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import routes
+from app.main import app
+from app.services.ollama_pool import OllamaPool, QueueFullError, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+
+MODEL = "qwen2.5-coder:7b"
+
+
+def make_pool(queue_deadline_s: float = 120.0) -> OllamaPool:
+    """Un host con un solo hueco de generación, ya chequeado"""
+    pool = OllamaPool(["http://ollama.test:11434"], max_concurrent=1, queue_deadline_s=queue_deadline_s)
+    pool._checked_at = datetime.now()
+    return pool
+
+
+async def acquire(pool: OllamaPool, priority: int = PRIORITY_INTERACTIVE):
+    return await pool._acquire(MODEL, set(), None, priority)
+
+
+def test_free_slots_go_by_priority_then_arrival():
+    async def scenario():
+        pool = make_pool()
+        backend = await acquire(pool)
+        served = []
+
+        async def waiter(name, priority):
+            await acquire(pool, priority)
+            served.append(name)
+
+        tasks = [
+            asyncio.create_task(waiter("background", PRIORITY_BACKGROUND)),
+            asyncio.create_task(waiter("interactive-1", PRIORITY_INTERACTIVE)),
+            asyncio.create_task(waiter("interactive-2", PRIORITY_INTERACTIVE)),
+        ]
+        await asyncio.sleep(0)
+        assert len(pool._waiters) == 3
+
+        for _ in tasks:
+            pool._release(backend)
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return served, backend["outstanding"]
+
+    served, outstanding = asyncio.run(scenario())
+    assert served == ["interactive-1", "interactive-2", "background"]
+    assert outstanding == 1
+
+
+def test_full_queue_is_rejected():
+    async def scenario():
+        # Sin latencias medidas cada generación cuenta DEFAULT_SERVICE_S (20 s)
+        pool = make_pool(queue_deadline_s=30)
+        await acquire(pool)
+        queued = asyncio.create_task(acquire(pool))
+        await asyncio.sleep(0)
+
+        # Una espera delante: (1 + 1) * 20 s > 30 s
+        with pytest.raises(QueueFullError) as error:
+            await acquire(pool)
+        assert error.value.retry_after == 40
+        # La rechazada no queda en la cola; la de fondo, con más esperas delante, tampoco entra
+        assert len(pool._waiters) == 1
+        with pytest.raises(QueueFullError):
+            pool.check_admission(PRIORITY_BACKGROUND)
+
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+
+    asyncio.run(scenario())
+
+
+def test_queue_deadline_expires_without_a_slot():
+    async def scenario():
+        pool = make_pool(queue_deadline_s=0.05)
+        pool.DEFAULT_SERVICE_S = 0.01
+        backend = await acquire(pool)
+        with pytest.raises(QueueFullError):
+            await acquire(pool)
+        return pool, backend
+
+    pool, backend = asyncio.run(scenario())
+    assert pool._waiters == []
+    assert backend["outstanding"] == 1
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def scenario():
+        pool = make_pool()
+        backend = await acquire(pool)
+        waiting = asyncio.create_task(acquire(pool))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert pool._waiters == []
+        pool._release(backend)
+        return backend["outstanding"]
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_waiter_cancelled_after_getting_a_slot_gives_it_back():
+    async def scenario():
+        pool = make_pool()
+        backend = await acquire(pool)
+        waiting = asyncio.create_task(acquire(pool))
+        await asyncio.sleep(0)
+        # El hueco se le da (outstanding sigue en 1) pero se cancela antes de usarlo
+        pool._release(backend)
+        assert backend["outstanding"] == 1
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        return backend["outstanding"]
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_cancelled_request_releases_the_model():
+    async def scenario():
+        pool = make_pool()
+        backend = await acquire(pool)
+        request = asyncio.create_task(pool.request("POST", "/api/chat", model="otro:7b", json={}))
+        await asyncio.sleep(0)
+        assert pool.in_use("otro:7b")
+        request.cancel()
+        await asyncio.gather(request, return_exceptions=True)
+        pool._release(backend)
+        return pool, backend
+
+    pool, backend = asyncio.run(scenario())
+    assert not pool.in_use("otro:7b")
+    assert pool._waiters == []
+    assert backend["outstanding"] == 0
+
+
+def test_chat_maps_a_full_queue_to_429(monkeypatch):
+    pool = routes.ollama_service.pool
+    backend = pool.backends[0]
+    # Todos los huecos ocupados y sin margen de espera
+    monkeypatch.setattr(pool, "queue_deadline_s", 0)
+    monkeypatch.setitem(backend, "outstanding", pool.max_concurrent)
+    monkeypatch.setitem(backend, "healthy", True)
+
+    async def context(db_connection):
+        # La admisión se comprueba antes de usar nada del contexto
+        return dict.fromkeys(["schema", "data_profile", "analyzer", "embedding_index", "prompt_assembler"])
+
+    monkeypatch.setattr(routes, "get_database_context", context)
+    response = TestClient(app).post("/api/v1/chat", json={
+        "message": "¿Cuántos clientes hay?",
+        "model": MODEL,
+        "database_connection": {
+            "type": "postgresql", "host": "localhost", "port": 5432,
+            "database": "test", "username": "test", "password": "test"
+        }
+    })
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
@@ -0,0 +1,141 @@
+"""
+Paginación de resultados de /chat: reescritura de la cláusula de límite
+exterior (split_row_limit y DatabaseService.paginate), recorrido de páginas
+con execute_page y tokens de continuación firmados (ResultCursorCodec).
+
+Uso (desde backend/): python -m pytest -q tests
+"""
+import pytest
+
+from app.models.database import DatabaseConnection, DatabaseType
+from app.services import result_cursor
+from app.services.database_service import DatabaseService
+from app.services.result_cursor import InvalidCursorError, ResultCursorCodec
+from app.services.sql_lexer import split_row_limit
+
+ROWS = list(range(100))
+
+
+@pytest.mark.parametrize("sql, mysql, body, limit, offset", [
+    # UNION: el límite final es de toda la consulta
+    ("SELECT a FROM t UNION SELECT a FROM u LIMIT 10", False,
+     "SELECT a FROM t UNION SELECT a FROM u", 10, 0),
+    ("SELECT a FROM t UNION ALL SELECT a FROM u ORDER BY a LIMIT 10 OFFSET 20", False,
+     "SELECT a FROM t UNION ALL SELECT a FROM u ORDER BY a", 10, 20),
+    # Los límites de cada rama entre paréntesis no son el exterior
+    ("(SELECT a FROM t LIMIT 5) UNION ALL (SELECT a FROM u LIMIT 5)", False,
+     "(SELECT a FROM t LIMIT 5) UNION ALL (SELECT a FROM u LIMIT 5)", None, 0),
+    # Comentarios finales (también '#' en MySQL)
+    ("SELECT * FROM t LIMIT 10 -- diez\n/* fin */", False, "SELECT * FROM t", 10, 0),
+    ("SELECT * FROM t LIMIT 10 # fin", True, "SELECT * FROM t", 10, 0),
+    # FETCH FIRST conservando el ORDER BY
+    ("SELECT * FROM t ORDER BY a FETCH FIRST 5 ROWS ONLY", False, "SELECT * FROM t ORDER BY a", 5, 0),
+    ("SELECT * FROM t OFFSET 10", False, "SELECT * FROM t", None, 10),
+    # Un LIMIT dentro de un literal no cuenta
+    ("SELECT * FROM t WHERE nota = 'LIMIT 5'", False, "SELECT * FROM t WHERE nota = 'LIMIT 5'", None, 0),
+])
+def test_split_row_limit_edge_cases(sql, mysql, body, limit, offset):
+    assert split_row_limit(sql, mysql) == {"body": body, "limit": limit, "offset": offset}
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM t LIMIT $1",
+    "SELECT * FROM t LIMIT $1 OFFSET $2",
+    "SELECT * FROM t LIMIT %s",
+    "SELECT * FROM t LIMIT 1 + 1",
+])
+def test_parameterized_limit_is_wrapped_in_a_subquery(sql):
+    assert split_row_limit(sql) is None
+    assert DatabaseService.paginate(sql, 20, 40) == \
+        f"SELECT * FROM (\n{sql}\n) AS paged_query\nLIMIT 21 OFFSET 40"
+
+
+@pytest.mark.parametrize("sql, mysql, expected", [
+    # LIMIT m, n de MySQL: el desplazamiento original se suma al de la página
+    ("SELECT * FROM t LIMIT 10, 30", True, "SELECT * FROM t\nLIMIT 21 OFFSET 10"),
+    ("SELECT * FROM t ORDER BY a FETCH FIRST 5 ROWS ONLY", False, "SELECT * FROM t ORDER BY a\nLIMIT 5 OFFSET 0"),
+    ("SELECT a FROM t UNION SELECT a FROM u LIMIT 50;", False, "SELECT a FROM t UNION SELECT a FROM u\nLIMIT 21 OFFSET 0"),
+    ("SELECT * FROM t LIMIT 10 -- diez", False, "SELECT * FROM t\nLIMIT 10 OFFSET 0"),
+])
+def test_paginate_first_page(sql, mysql, expected):
+    assert DatabaseService.paginate(sql, 20, mysql=mysql) == expected
+
+
+def test_paginate_past_the_original_limit_returns_no_rows():
+    assert DatabaseService.paginate("SELECT * FROM t LIMIT 10", 20, 40) == "SELECT * FROM t\nLIMIT 0 OFFSET 40"
+
+
+class FakeTableService(DatabaseService):
+    """execute_query sobre ROWS, interpretando el LIMIT/OFFSET que escribe paginate"""
+
+    def __init__(self):
+        super().__init__(DatabaseConnection(
+            type=DatabaseType.POSTGRESQL, host="localhost", port=5432,
+            database="test", username="test", password="test"
+        ))
+
+    def execute_query(self, sql_query):
+        parts = split_row_limit(sql_query)
+        inner = split_row_limit(parts["body"])
+        rows = ROWS[inner["offset"]:][:inner["limit"]]
+        rows = rows[parts["offset"]:][:parts["limit"]]
+        return {"success": True, "data": [{"n": n} for n in rows], "row_count": len(rows)}
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT n FROM t", ROWS),
+    ("SELECT n FROM t LIMIT 45 OFFSET 5", ROWS[5:50]),
+    ("SELECT n FROM t LIMIT 40", ROWS[:40]),
+    ("SELECT n FROM t OFFSET 90", ROWS[90:]),
+])
+def test_pages_cover_the_original_result(sql, expected):
+    service, seen, offset = FakeTableService(), [], 0
+    while offset is not None:
+        result = service.execute_page(sql, 20, offset)
+        assert result["success"] and result["row_count"] <= 20
+        seen.extend(row["n"] for row in result["data"])
+        offset = result["page"]["next_offset"]
+    assert seen == expected
+
+
+STATE = {"sql": "SELECT * FROM t", "offset": 20, "page_size": 20, "db": "abc"}
+
+
+def test_cursor_round_trip():
+    codec = ResultCursorCodec("secreto")
+    state = codec.decode(codec.encode(STATE))
+    assert {key: state[key] for key in STATE} == STATE
+
+
+def swap_payload(token: str) -> str:
+    """Otro estado (otro SQL) con la firma del token original"""
+    payload = ResultCursorCodec("otro").encode(dict(STATE, sql="DELETE FROM t")).split(".")[0]
+    return f"{payload}.{token.split('.')[1]}"
+
+
+def alter_signature(token: str) -> str:
+    payload, signature = token.split(".")
+    return f"{payload}.{signature[::-1]}"
+
+
+@pytest.mark.parametrize("tamper", [
+    swap_payload,
+    alter_signature,
+    # Firmado con otro secreto
+    lambda token: ResultCursorCodec("otro").encode(STATE),
+    # Sin firma
+    lambda token: token.split(".")[0],
+])
+def test_tampered_cursor_is_rejected(tamper):
+    codec = ResultCursorCodec("secreto")
+    with pytest.raises(InvalidCursorError):
+        codec.decode(tamper(codec.encode(STATE)))
+
+
+def test_expired_cursor_is_rejected(monkeypatch):
+    codec = ResultCursorCodec("secreto", ttl_minutes=30)
+    token = codec.encode(STATE)
+    now = result_cursor.time.time()
+    monkeypatch.setattr(result_cursor.time, "time", lambda: now + 31 * 60)
+    with pytest.raises(InvalidCursorError, match="caducado"):
+        codec.decode(token)
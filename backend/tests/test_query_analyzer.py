@@ -0,0 +1,102 @@
+"""
+Regresión de la detección de intención de QueryAnalyzer: el matcher
+compilado (INTENT_MATCHER) debe clasificar igual que el bucle anterior de
+re.search por patrón y extraer los mismos valores entre comillas y números.
+El único cambio intencionado: las palabras booleanas cuentan como palabras
+completas ('no' ya no coincide dentro de 'nombre').
+
+Uso (desde backend/): python -m pytest -q tests
+"""
+import random
+import re
+
+import pytest
+
+from app.models.database import DatabaseSchema, TableSchema
+from app.services.query_analyzer import QueryAnalyzer
+
+VOCABULARY = [
+    # Intención
+    "cuantos", "cuántos", "cuantas", "promedio", "media", "suma", "total", "cantidad", "conteo",
+    "máximo", "minimo", "max", "min", "mejor", "peor", "primero", "último", "top", "mayor",
+    "menor", "más", "menos", "ordenado", "orden", "asc", "desc", "con su", "con los", "y sus",
+    "relacionados", "junto con", "donde", "que", "cual", "solo", "únicamente", "igual a",
+    "mayor que", "entre",
+    # Booleanas (y palabras que las contienen)
+    "activo", "activos", "inactivo", "vigente", "vencido", "si", "no", "nombre", "sino",
+    "habilitado", "falso", "verdadero", "nota",
+    # Resto
+    "clientes", "pedidos", "ventas", "facturas", "empleados", "por", "de", "los", "las", "el",
+    "mes", "año", "ciudad", "estado", "muéstrame", "lista", "dame", "todos",
+    "5", "10", "3.5", "2024", "'Cochabamba'", "'no activo'", '"cuantos"', "'top 5'",
+]
+
+SCHEMA = DatabaseSchema(database_name="prueba", tables=[
+    TableSchema(table_name="clientes", columns=[{"name": "id", "type": "integer", "nullable": False}],
+                primary_keys=["id"], foreign_keys=[])
+])
+
+
+def legacy_query_type(message: str) -> str:
+    """Clasificación anterior: un re.search por patrón, en orden de especificidad"""
+    groups = [
+        ("aggregation", QueryAnalyzer.AGGREGATION_PATTERNS),
+        ("top_n", QueryAnalyzer.ORDER_PATTERNS),
+        ("join", QueryAnalyzer.JOIN_PATTERNS),
+        ("filter", QueryAnalyzer.FILTER_PATTERNS),
+    ]
+    for query_type, patterns in groups:
+        for pattern in patterns:
+            if re.search(pattern, message, re.IGNORECASE):
+                return query_type
+    return "simple_select"
+
+
+def corpus(count: int, seed: int = 27):
+    rng = random.Random(seed)
+    for _ in range(count):
+        words = rng.choices(VOCABULARY, k=rng.randint(1, 12))
+        if rng.random() < 0.3:
+            # Comillas que envuelven varias palabras (incluidas las de intención)
+            start = rng.randrange(len(words))
+            words[start] = "'" + words[start]
+            words[-1] += "'"
+        yield " ".join(words).lower()
+
+
+@pytest.fixture(scope="module")
+def analyzer():
+    return QueryAnalyzer(SCHEMA)
+
+
+def test_query_type_matches_the_legacy_classifier(analyzer):
+    mismatches = [
+        message for message in corpus(20000)
+        if analyzer._determine_query_type(message) != legacy_query_type(message)
+    ]
+    assert mismatches == []
+
+
+def test_quoted_values_and_numbers_match_the_legacy_extraction(analyzer):
+    for message in corpus(5000, seed=31):
+        hints = analyzer._extract_filter_hints_dynamic(message, set())
+        assert hints["exact_values"] == re.findall(r"['\"]([^'\"]+)['\"]", message)
+        numbers = re.findall(r'\b\d+(?:\.\d+)?\b', message)
+        assert hints["numeric_values"] == [float(n) if '.' in n else int(n) for n in numbers]
+
+
+@pytest.mark.parametrize("message, query_type", [
+    # Una palabra booleana sola no convierte la consulta en filtro
+    ("clientes no morosos", "simple_select"),
+    ("todos los habilitados", "simple_select"),
+    # El texto entre comillas sigue contando para la intención
+    ("clientes de la ciudad 'cuantos'", "aggregation"),
+    ("pedidos 'con su' cliente", "join"),
+])
+def test_query_type_examples(analyzer, message, query_type):
+    assert analyzer._determine_query_type(message) == query_type
+
+
+def test_boolean_keywords_are_whole_words(analyzer):
+    hints = analyzer._extract_filter_hints_dynamic("nombre de los clientes activos", set())
+    assert hints["boolean_keywords"] == [("activo", True)]
@@ -0,0 +1,196 @@
+"""
+Regresiones del analizador léxico de SQL (app.services.sql_lexer), que es la
+barrera de seguridad detrás de DatabaseService._is_safe_query y de
+OllamaService._validate_sql_query: una consulta solo pasa si es un único
+SELECT sin palabras prohibidas fuera de literales y comentarios, con el
+léxico del motor de la conexión (PostgreSQL o MySQL) en ambas barreras.
+
+Uso (desde backend/): python -m pytest -q tests
+"""
+import pytest
+
+from app.models.database import DatabaseConnection, DatabaseSchema, DatabaseType, TableSchema
+from app.services.database_service import DatabaseService
+from app.services.ollama_service import OllamaService
+from app.services.sql_lexer import analyze_sql, split_row_limit
+
+
+def is_safe(sql: str, mysql: bool = False) -> bool:
+    """La comprobación de DatabaseService, con el motor indicado"""
+    connection = DatabaseConnection(
+        type=DatabaseType.MYSQL if mysql else DatabaseType.POSTGRESQL,
+        host="localhost", port=3306 if mysql else 5432,
+        database="test", username="test", password="test"
+    )
+    return DatabaseService(connection)._is_safe_query(sql)
+
+
+def is_valid(sql: str, mysql: bool = False) -> bool:
+    """La validación del SQL generado en OllamaService, con el motor indicado"""
+    schema = DatabaseSchema(database_name="test", tables=[
+        TableSchema(table_name="t", columns=[{"name": "a", "type": "text", "nullable": True}],
+                    primary_keys=[], foreign_keys=[])
+    ])
+    return OllamaService("http://ollama.test:11434")._validate_sql_query(sql, schema, mysql=mysql)["valid"]
+
+
+# Palabras clave dentro de literales, identificadores y comentarios: no cuentan
+@pytest.mark.parametrize("sql, mysql", [
+    ("SELECT 'DELETE me' AS x FROM t", False),
+    ("SELECT * FROM t WHERE nota = 'O''Brien; DROP TABLE t'", False),
+    ("SELECT 1 -- DROP TABLE t", False),
+    ("SELECT 1 /* ; DROP TABLE t */", False),
+    ("SELECT 1 # DROP TABLE t", True),
+    ('SELECT "drop" FROM "delete"', False),
+    ("SELECT `drop` FROM `delete`", True),
+    ("SELECT $$; DROP TABLE t$$", False),
+    ("SELECT $x$; DROP TABLE t$x$", False),
+    ("SELECT 'it\\'s; DROP TABLE t' FROM t", True),
+    ("SELECT REPLACE(nombre, 'a', 'b') FROM t", False),
+])
+def test_keywords_in_literals_and_comments_are_ignored(sql, mysql):
+    assert is_safe(sql, mysql)
+
+
+# Cada motor con sus reglas: lo que en uno es literal o comentario en otro no
+@pytest.mark.parametrize("sql, mysql", [
+    # En PostgreSQL '#' no abre un comentario
+    ("SELECT 1 # DROP TABLE t", False),
+    # MySQL ejecuta el contenido de /*! ... */
+    ("SELECT 1 /*! DROP TABLE t */", True),
+    # En PostgreSQL la barra invertida no escapa la comilla: la cadena termina
+    ("SELECT 'a\\'; DROP TABLE t; --'", False),
+])
+def test_engine_specific_quoting(sql, mysql):
+    assert not is_safe(sql, mysql)
+
+
+# Las dos barreras (validación del SQL generado y ejecución) lexan igual
+@pytest.mark.parametrize("sql", [
+    "SELECT 1 # DROP TABLE t",
+    "SELECT `drop` FROM t",
+    "SELECT 'it\\'s; DROP TABLE t' FROM t",
+    "SELECT 'a\\'; DROP TABLE t; --'",
+    "SELECT 1 /*! DROP TABLE t */",
+])
+@pytest.mark.parametrize("mysql", [False, True])
+def test_generation_and_execution_gates_agree(sql, mysql):
+    assert is_valid(sql, mysql) == is_safe(sql, mysql)
+
+
+def test_generation_gate_uses_mysql_quoting():
+    # Un literal con comilla escapada: válido en MySQL, no en PostgreSQL
+    sql = "SELECT 'it\\'s; DROP TABLE t' FROM t"
+    assert is_valid(sql, mysql=True)
+    assert not is_valid(sql, mysql=False)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT 1; DROP TABLE t",
+    "SELECT 1; SELECT 2",
+    "SELECT * FROM t;\nDELETE FROM t",
+])
+def test_multiple_statements_are_rejected(sql):
+    assert analyze_sql(sql)["statement_count"] > 1
+    assert not is_safe(sql)
+
+
+def test_trailing_semicolon_is_a_single_statement():
+    assert analyze_sql("SELECT 1;")["statement_count"] == 1
+    assert is_safe("SELECT 1;")
+    assert is_safe("SELECT 'a;b' FROM t")
+
+
+@pytest.mark.parametrize("sql, mysql", [
+    ("SELECT * INTO nueva FROM t", False),
+    ("SELECT * FROM t INTO OUTFILE '/tmp/t.csv'", True),
+    ("SELECT * FROM t INTO DUMPFILE '/tmp/t.bin'", True),
+])
+def test_select_into_is_rejected(sql, mysql):
+    assert analyze_sql(sql, mysql)["main_statement"] == "SELECT"
+    assert "INTO" in analyze_sql(sql, mysql)["forbidden"]
+    assert not is_safe(sql, mysql)
+
+
+def test_for_update_is_rejected():
+    assert "UPDATE" in analyze_sql("SELECT * FROM t FOR UPDATE")["forbidden"]
+    assert not is_safe("SELECT * FROM t FOR UPDATE")
+    assert not is_safe("SELECT * FROM t WHERE id = 1 FOR UPDATE NOWAIT", mysql=True)
+
+
+def test_select_cte_is_allowed():
+    sql = "WITH activos AS (SELECT id FROM clientes WHERE activo) SELECT * FROM activos"
+    analysis = analyze_sql(sql)
+    assert analysis["statement_type"] == "WITH"
+    assert analysis["main_statement"] == "SELECT"
+    assert analysis["tables"] == {"clientes"}
+    assert analysis["ctes"] == {"activos"}
+    assert is_safe(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "WITH borrados AS (DELETE FROM t RETURNING *) SELECT * FROM borrados",
+    "WITH x AS (SELECT 1) DELETE FROM t",
+    "WITH x AS (SELECT 1) UPDATE t SET a = 1",
+])
+def test_data_modifying_cte_is_rejected(sql):
+    assert not is_safe(sql)
+
+
+@pytest.mark.parametrize("sql, mysql", [
+    ("DELETE FROM t", False),
+    ("UPDATE t SET a = 1", False),
+    ("DROP TABLE t", False),
+    ("REPLACE INTO t VALUES (1)", True),
+    ("CALL procedimiento()", True),
+])
+def test_non_select_statements_are_rejected(sql, mysql):
+    assert not is_safe(sql, mysql)
+
+
+def test_qualified_columns_resolve_aliases():
+    analysis = analyze_sql(
+        "SELECT e.nombre, d.nombre FROM empleados e "
+        "JOIN departamentos d ON d.id = e.departamento_id"
+    )
+    assert analysis["tables"] == {"empleados", "departamentos"}
+    assert analysis["columns"] == {
+        ("empleados", "nombre"), ("empleados", "departamento_id"),
+        ("departamentos", "nombre"), ("departamentos", "id"),
+    }
+
+
+@pytest.mark.parametrize("sql, mysql, limit, offset", [
+    ("SELECT * FROM t", False, None, 0),
+    ("SELECT * FROM t LIMIT 10", False, 10, 0),
+    ("SELECT * FROM t LIMIT 10 OFFSET 5", False, 10, 5),
+    ("SELECT * FROM t LIMIT 5, 10", True, 10, 5),
+    ("SELECT * FROM t LIMIT ALL", False, None, 0),
+    ("SELECT * FROM t OFFSET 5 ROWS FETCH FIRST 10 ROWS ONLY", False, 10, 5),
+    ("SELECT * FROM t FETCH NEXT ROW ONLY", False, 1, 0),
+    ("SELECT * FROM t LIMIT 10; -- fin", False, 10, 0),
+])
+def test_split_row_limit(sql, mysql, limit, offset):
+    parts = split_row_limit(sql, mysql)
+    assert parts["body"] == "SELECT * FROM t"
+    assert (parts["limit"], parts["offset"]) == (limit, offset)
+
+
+def test_split_row_limit_ignores_inner_limits():
+    sql = "SELECT * FROM (SELECT * FROM t LIMIT 3) s"
+    assert split_row_limit(sql) == {"body": sql, "limit": None, "offset": 0}
+
+
+@pytest.mark.parametrize("sql, mysql", [
+    ("SELECT * FROM t LIMIT ?", False),
+    ("SELECT * FROM t LIMIT 10 LOCK IN SHARE MODE", True),
+])
+def test_split_row_limit_refuses_clauses_it_cannot_rewrite(sql, mysql):
+    assert split_row_limit(sql, mysql) is None
+
+
+def test_paginate_rewrites_the_outer_limit():
+    assert DatabaseService.paginate("SELECT * FROM t LIMIT 100 OFFSET 10", 20, 40) == \
+        "SELECT * FROM t\nLIMIT 21 OFFSET 50"
+    # Sin pasarse del límite original
+    assert DatabaseService.paginate("SELECT * FROM t LIMIT 30", 20, 20) == "SELECT * FROM t\nLIMIT 10 OFFSET 20"
@@ -16,6 +16,7 @@ const Chatbot = ({ databaseConnection, schema, selectedModel, onDisconnect }) =>
     const [isRefreshing, setIsRefreshing] = useState(false);
     const [isDisconnecting, setIsDisconnecting] = useState(false);
     const [copiedMessageId, setCopiedMessageId] = useState(null);
+    const [loadingMoreId, setLoadingMoreId] = useState(null);
     const messagesEndRef = useRef(null);
     const inputRef = useRef(null);
 
@@ -65,6 +66,7 @@ const Chatbot = ({ databaseConnection, schema, selectedModel, onDisconnect }) =>
                 sqlQuery: response.sql_query,
                 explanation: response.explanation,
                 data: response.data,
+                nextCursor: response.next_cursor,
                 error: response.error,
                 success: response.success,
                 timestamp: new Date()
@@ -171,7 +173,25 @@ const Chatbot = ({ databaseConnection, schema, selectedModel, onDisconnect }) =>
         }
     };
 
-    const formatData = (data) => {
+    const handleLoadMore = async (message) => {
+        setLoadingMoreId(message.id);
+        try {
+            const page = await apiService.fetchNextPage(databaseConnection, message.nextCursor);
+            setMessages(prev => prev.map(m => m.id === message.id
+                ? page.success
+                    ? { ...m, data: [...m.data, ...(page.data || [])], nextCursor: page.next_cursor }
+                    : { ...m, nextCursor: null, pageError: page.error }
+                : m
+            ));
+        } catch (error) {
+            setMessages(prev => prev.map(m => m.id === message.id ? { ...m, pageError: error.message } : m));
+        } finally {
+            setLoadingMoreId(null);
+        }
+    };
+
+    const formatData = (message) => {
+        const data = message.data;
         if (!data || data.length === 0) return null;
 
         const columns = Object.keys(data[0]);
@@ -180,9 +200,9 @@ const Chatbot = ({ databaseConnection, schema, selectedModel, onDisconnect }) =>
             <div className="mt-4">
                 <h4 className="font-medium text-gray-700 mb-3 flex items-center gap-2">
                     <Database size={16} />
-                    Resultados ({data.length} {data.length === 1 ? 'fila' : 'filas'})
+                    Resultados ({data.length}{message.nextCursor ? '+' : ''} {data.length === 1 ? 'fila' : 'filas'})
                 </h4>
-                <div className="overflow-x-auto bg-gray-50 rounded-xl border border-gray-200">
+                <div className="overflow-x-auto max-h-96 overflow-y-auto bg-gray-50 rounded-xl border border-gray-200">
                     <table className="min-w-full text-sm">
                         <thead>
                             <tr className="bg-gradient-to-r from-gray-100 to-gray-200 border-b border-gray-300">
@@ -194,7 +214,7 @@ const Chatbot = ({ databaseConnection, schema, selectedModel, onDisconnect }) =>
                             </tr>
                         </thead>
                         <tbody className="bg-white">
-                            {data.slice(0, 10).map((row, index) => (
+                            {data.map((row, index) => (
                                 <tr key={index} className="border-b border-gray-100 hover:bg-blue-50 transition-colors">
                                     {columns.map((column) => (
                                         <td key={column} className="px-4 py-3 text-gray-600">
@@ -211,9 +231,21 @@ const Chatbot = ({ databaseConnection, schema, selectedModel, onDisconnect }) =>
                             ))}
                         </tbody>
                     </table>
-                    {data.length > 10 && (
-                        <div className="p-3 text-center text-gray-500 text-sm bg-gradient-to-r from-gray-100 to-gray-200 border-t border-gray-300 font-medium">
-                            ... y {data.length - 10} {data.length - 10 === 1 ? 'fila' : 'filas'} más
+                    {message.nextCursor && (
+                        <div className="p-3 text-center bg-gradient-to-r from-gray-100 to-gray-200 border-t border-gray-300">
+                            <button
+                                onClick={() => handleLoadMore(message)}
+                                disabled={loadingMoreId === message.id}
+                                className="inline-flex items-center gap-2 text-sm font-medium text-blue-600 hover:text-blue-800 disabled:text-gray-400"
+                            >
+                                {loadingMoreId === message.id && <Loader2 size={14} className="animate-spin" />}
+                                Cargar más filas
+                            </button>
+                        </div>
+                    )}
+                    {message.pageError && (
+                        <div className="p-3 text-center text-red-600 text-sm border-t border-gray-300">
+                            {message.pageError}
                         </div>
                     )}
                 </div>
@@ -289,7 +321,7 @@ const Chatbot = ({ databaseConnection, schema, selectedModel, onDisconnect }) =>
                         )}
 
                         {/* Resultados de datos */}
-                        {message.data && formatData(message.data)}
+                        {message.data && formatData(message)}
 
                         {/* Error */}
                         {message.error && !message.success && (
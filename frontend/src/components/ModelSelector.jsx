@@ -13,6 +13,13 @@ const ModelSelector = ({ selectedModel, onModelChange, databaseConnection, schem
         loadModels();
     }, []);
 
+    // Precargar el modelo en Ollama en cuanto hay BD conectada y modelo elegido
+    useEffect(() => {
+        if (selectedModel && databaseConnection) {
+            apiService.preloadModel(selectedModel).catch((err) => console.warn(err.message));
+        }
+    }, [selectedModel, databaseConnection]);
+
     const loadModels = async () => {
         setIsLoading(true);
         setError(null);
@@ -100,7 +107,7 @@ const ModelSelector = ({ selectedModel, onModelChange, databaseConnection, schem
             if (result.success) {
                 setLearningStatus({ 
                     type: 'success', 
-                    message: `¡Modelo entrenado exitosamente! Analizó ${result.tables_analyzed} tablas con ${result.total_samples} registros de muestra.`,
+                    message: `¡Modelo entrenado exitosamente! Analizó ${result.tables_analyzed} tablas y mantiene ${result.tables_in_context} en contexto (~${result.prefix_tokens} tokens precargados).`,
                     summary: result.learning_summary
                 });
             } else {
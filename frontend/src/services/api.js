@@ -34,6 +34,16 @@ export const apiService = {
         }
     },
 
+    // Precargar un modelo en Ollama (evita pagar la carga en la primera consulta)
+    async preloadModel(modelName) {
+        try {
+            const response = await api.post('/models/preload', { model_name: modelName });
+            return response.data;
+        } catch (error) {
+            throw new Error('Error al precargar el modelo: ' + error.message);
+        }
+    },
+
     // Probar conexión a base de datos
     async testDatabaseConnection(connectionData) {
         try {
@@ -80,6 +90,19 @@ export const apiService = {
         }
     },
 
+    // Página siguiente de un resultado de chat (sin volver a llamar al modelo)
+    async fetchNextPage(databaseConnection, cursor) {
+        try {
+            const response = await api.post('/chat/next-page', {
+                database_connection: databaseConnection,
+                cursor
+            });
+            return response.data;
+        } catch (error) {
+            throw new Error('Error al cargar más filas: ' + error.message);
+        }
+    },
+
     // Ejecutar consulta SQL directamente
     async executeSQL(connectionData, sqlQuery) {
         try {